@@ -20,20 +20,12 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
-import math
 import os
 import sys
 
-import lsst.afw.geom as afwGeom
-import lsst.afw.detection as afwDetection
-import lsst.afw.image as afwImage
-import lsst.afw.math as afwMath
-import lsst.coadd.chisquared as coaddChiSq
-import lsst.ip.diffim as ipDiffIm
 import lsst.pex.logging as pexLog
 import lsst.pipette.coaddOptions
-
-FWHMPerSigma = 2 * math.sqrt(2 * math.log(2))
+import lsst.pipette.coaddEngine as pipCoadd
 
 def chiSquaredCoadd(idList, butler, desFwhm, coaddWcs, coaddBBox, policy):
     """PSF-match (if desFwhm is specified), warp and chi-squared-coadd images
@@ -47,6 +39,8 @@ def chiSquaredCoadd(idList, butler, desFwhm, coaddWcs, coaddBBox, policy):
     PSF-matching is performed before warping so the code can use the PSF models
     associated with the calibrated science exposures (without having to warp those models).
 
+    Warps are taken from, and added to, the warp cache if roots.warpCache is set.
+
     @param[in] idList: list of data identity dictionaries
     @param[in] butler: data butler for input images
     @param[in] desFwhm: desired PSF of coadd, but in science exposure pixels
@@ -69,44 +63,10 @@ def chiSquaredCoadd(idList, butler, desFwhm, coaddWcs, coaddBBox, policy):
         sys.exit(1)
     print "Coadd %s calexp" % (numExp,)
 
-    warpPolicy = policy.getPolicy("warpPolicy")
-    coaddPolicy = policy.getPolicy("coaddPolicy")
-
-    if desFwhm > 0:
-        psfMatchPolicy = policy.getPolicy("psfMatchPolicy")
-        psfMatchPolicy = ipDiffIm.modifyForModelPsfMatch(psfMatchPolicy)
-        psfMatcher = ipDiffIm.ModelPsfMatch(psfMatchPolicy)
-    else:
-        print "No PSF matching will be done (desFwhm <= 0)"
-
-    warper = afwMath.Warper.fromPolicy(warpPolicy)
-    coadd = coaddChiSq.Coadd.fromPolicy(coaddBBox, coaddWcs, coaddPolicy)
-    print "bad pixel mask=", coadd._badPixelMask
-    prevKernelDim = afwGeom.Extent2I(0, 0) # use this because the test Extent2I == None is an error
-    for ind, id in enumerate(idList):
-        print "Processing exposure %d of %d: id=%s" % (ind+1, numExp, id)
-        exposure = butler.get("calexp", id)
-        psf = butler.get("psf", id)
-        exposure.setPsf(psf)
-        if desFwhm > 0:
-            psfKernel = psf.getKernel()
-            kernelDim = psfKernel.getDimensions()
-            if kernelDim != prevKernelDim:
-                print "Create double Gaussian PSF model with core fwhm %0.1f and size %dx%d" % \
-                    (desFwhm, kernelDim[0], kernelDim[1])
-                coreSigma = desFwhm / FWHMPerSigma
-                modelPsf = afwDetection.createPsf("DoubleGaussian", kernelDim[0], kernelDim[1],
-                    coreSigma, coreSigma * 2.5, 0.1)
-                prevKernelDim = kernelDim
-
-            print "PSF-match exposure"
-            exposure, psfMatchingKernel, kernelCellSet = psfMatcher.matchExposure(exposure, modelPsf)
-        print "Warp exposure"
-        exposure = warper.warpExposure(coaddWcs, exposure, maxBBox = coaddBBox)
-        coadd.addExposure(exposure)
-
-    coaddExposure = coadd.getCoadd()
-    weightMap = coadd.getWeightMap()
+    engine = pipCoadd.CoaddEngine(desFwhm, coaddWcs, coaddBBox, policy)
+    products = engine.run(idList, butler, [pipCoadd.ChiSquaredAccumulator(coaddWcs, coaddBBox, policy)])
+    coaddExposure = products[pipCoadd.ChiSquaredAccumulator.name]["coadd"]
+    weightMap = products[pipCoadd.ChiSquaredAccumulator.name]["weight"]
 
     return coaddExposure, weightMap
 
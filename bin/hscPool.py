@@ -8,6 +8,7 @@ import collections
 import lsst.pex.logging as pexLog
 import lsst.pipette.runHsc as runHsc
 import lsst.pipette.options as pipOptions
+import lsst.pipette.phot as pipPhot
 
 Inputs = collections.namedtuple('Inputs', ['rerun', 'frame', 'ccd', 'config', 'log'])
 
@@ -66,6 +67,8 @@ def main(argv=None):
             inputs.append(Inputs(rerun=opts.rerun, frame=frame, ccd=ccd, config=config,
                                  log="%s.%d.%d.log" % (opts.rerun, frame, ccd)))
 
+    # Workers are forked afresh for each CCD, so import the plugins once here for them to inherit
+    pipPhot.importPlugins(config)
     pool = multiprocessing.Pool(processes=opts.threads, maxtasksperchild=1)
     pool.map(run, inputs)
     pool.close()
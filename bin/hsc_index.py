@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+import lsst.obs.hscSim as hsc
+import lsst.pipette.warp as pipWarp
+import lsst.pipette.options as pipOptions
+import lsst.pipette.readwrite as pipReadWrite
+import lsst.pipette.footprintIndex as pipIndex
+
+def run(rerun,                          # Rerun name
+        frames,                         # Frame numbers
+        ccds,                           # CCD numbers
+        config,                         # Configuration
+        ):
+    io = pipReadWrite.ReadWrite(hsc.HscSimMapper(rerun=rerun), ['visit', 'ccd'], config=config)
+    index = pipIndex.getIndex(config)
+    warpProc = pipWarp.Warp(config=config)
+
+    for frame in frames:
+        for ccd in ccds:
+            dataId = { 'visit': frame, 'ccd': ccd }
+            header = warpProc.readHeader(io.inButler, dataId, ignore=True)
+            if header is None:
+                continue
+            wcs, width, height, fscale = header
+            index.addExposure(dataId, wcs, width, height)
+            print "Indexed %s" % dataId
+
+
+if __name__ == "__main__":
+    parser = pipOptions.OptionParser()
+    parser.add_option("-r", "--rerun", default=os.getenv("USER", default="rerun"), dest="rerun",
+                      help="rerun name (default=%default)")
+    parser.add_option("-f", "--frames", dest="frames",
+                      help="visits to index, colon-delimited")
+    parser.add_option("-c", "--ccds", dest="ccds", default=":".join(map(str, range(100))),
+                      help="CCDs to index (default=%default)")
+
+    default = os.path.join(os.getenv("PIPETTE_DIR"), "policy", "WarpProcessDictionary.paf")
+    overrides = os.path.join(os.getenv("PIPETTE_DIR"), "policy", "suprimecam_warp.paf")
+    config, opts, args = parser.parse_args([default, overrides])
+    if len(args) > 0 or len(sys.argv) == 1 or opts.rerun is None or opts.frames is None or opts.ccds is None \
+       or not config.has_key('roots') or not config['roots'].has_key('index'):
+        parser.print_help()
+        sys.exit(1)
+
+    run(opts.rerun, map(int, opts.frames.split(":")), map(int, opts.ccds.split(":")), config)
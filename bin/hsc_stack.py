@@ -20,6 +20,7 @@ def run(rerun,                          # Rerun name
         scale,                          # Pixel scale
         sizes,                          # Skycell size
         ignore=False,                   # Ignore missing files?
+        tiled=False,                    # Write tiles as they are stacked?
         ):
     io = pipReadWrite.ReadWrite(hsc.HscSimMapper(rerun=rerun), ['visit', 'ccd'], config=config)
     roots = config['roots']
@@ -34,6 +35,13 @@ def run(rerun,                          # Rerun name
             identList.append(dataId)
         identMatrix.append(identList)
 
+    if tiled:
+        def output(bbox, tile):
+            tile.writeFits(pipStack.tileFilename("%s-%d-%d-%s" % (basename, stack, patch, filter), bbox))
+        stackProc.run(identMatrix, io.inButler, coords[0], coords[1], scale, sizes[0], sizes[1],
+                      ignore=ignore, output=output)
+        return
+
     exp = stackProc.run(identMatrix, io.inButler,
                         coords[0], coords[1], scale, sizes[0], sizes[1], ignore=ignore)
 
@@ -64,6 +72,8 @@ if __name__ == "__main__":
                       help="Sizes in x and y for skycell, pixels")
     parser.add_option("--ignore", dest="ignore", default=False, action="store_true",
                       help="Ignore missing files?")
+    parser.add_option("--tiled", dest="tiled", default=False, action="store_true",
+                      help="Write each tile (stack.tileSize) as a separate file as it is stacked?")
 
     default = os.path.join(os.getenv("PIPETTE_DIR"), "policy", "WarpProcessDictionary.paf")
     overrides = os.path.join(os.getenv("PIPETTE_DIR"), "policy", "suprimecam_warp.paf")
@@ -75,4 +85,4 @@ if __name__ == "__main__":
         sys.exit(1)
 
     run(opts.rerun, map(int, opts.frames.split(":")), map(int, opts.ccds.split(":")), opts.stack, opts.patch,
-        opts.filter, config, opts.coords, opts.scale, opts.sizes, ignore=opts.ignore)
+        opts.filter, config, opts.coords, opts.scale, opts.sizes, ignore=opts.ignore, tiled=opts.tiled)
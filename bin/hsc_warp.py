@@ -12,9 +12,9 @@ import lsst.pipette.readwrite as pipReadWrite
 def run(rerun,                          # Rerun name
         frame,                          # Frame number
         ccds,                           # CCD number
-        patch,                          # Patch identifier
+        patches,                        # Patch identifiers
         config,                         # Configuration
-        coords,                         # Skycell centre coordinates
+        coords,                         # Skycell centre coordinates, for each patch
         scale,                          # Pixel scale
         sizes,                          # Skycell size
         ):
@@ -28,10 +28,13 @@ def run(rerun,                          # Rerun name
         dataId = { 'visit': frame, 'ccd': ccd }
         identList.append(dataId)
 
-    warp = warpProc.run(identList, io.inButler, coords[0], coords[1], scale, sizes[0], sizes[1])
+    # Each CCD is read and warped once for all the patches
+    skycells = [warpProc.skycell(ra, dec, scale, sizes[0], sizes[1]) for ra, dec in coords]
+    warps = warpProc.warpMany(identList, io.inButler, skycells, ignore=True)
 
-    #warp.writeFits(basename + ".fits")
-    warpProc.write(io.outButler, {'visit': frame, 'skytile': skytile}, {"warp": warp})
+    for patch, warp in zip(patches, warps):
+        #warp.writeFits(basename + ".fits")
+        warpProc.write(io.outButler, {'visit': frame, 'skytile': patch}, {"warp": warp})
     
 
 
@@ -44,10 +47,10 @@ if __name__ == "__main__":
                       help="visit to run")
     parser.add_option("-c", "--ccds", dest="ccds", default="0:1:2:3:4:5:6:7:8:9",
                       help="CCD to run (default=%default)")
-    parser.add_option("-p", "--patch", dest="patch", type="int",
-                      help="Sky patch identifier")
-    parser.add_option("--coords", dest="coords", type="float", nargs=2,
-                      help="Coordinates for skycell, degrees")
+    parser.add_option("-p", "--patches", dest="patches",
+                      help="Sky patch identifiers, colon-delimited")
+    parser.add_option("--coords", dest="coords", type="float", nargs=2, action="append",
+                      help="Coordinates for skycell, degrees (once for each patch)")
     parser.add_option("--scale", dest="scale", type="float",
                       help="Pixel scale for skycell, arcsec/pixel")
     parser.add_option("--sizes", dest="sizes", nargs=2, type="int",
@@ -57,9 +60,10 @@ if __name__ == "__main__":
     overrides = os.path.join(os.getenv("PIPETTE_DIR"), "policy", "suprimecam_warp.paf")
     config, opts, args = parser.parse_args([default, overrides])
     if len(args) > 0 or len(sys.argv) == 1 or opts.rerun is None or opts.frame is None or opts.ccds is None \
-       or opts.patch is None or opts.coords is None or opts.scale is None or opts.sizes is None:
+       or opts.patches is None or opts.coords is None or opts.scale is None or opts.sizes is None \
+       or len(opts.patches.split(":")) != len(opts.coords):
         parser.print_help()
         sys.exit(1)
 
-    run(opts.rerun, int(opts.frame), map(int, opts.ccds.split(":")), opts.patch, config,
+    run(opts.rerun, int(opts.frame), map(int, opts.ccds.split(":")), map(int, opts.patches.split(":")), config,
         opts.coords, opts.scale, opts.sizes)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import sys
+
+import lsst.pex.logging as pexLog
+import lsst.pipette.coaddOptions
+import lsst.pipette.coaddEngine as pipCoadd
+
+def incrementalCoadd(idList, butler, desFwhm, coaddWcs, coaddBBox, policy, stateDir, retract=False):
+    """Update a saved coadd with new exposures, and optionally retract exposures no longer listed
+
+    Only exposures not already in the saved coadd are PSF-matched, warped and added.  Retracted exposures are
+    subtracted using their contributions, saved with the coadd state, so they needn't be read again (and
+    may since have been reprocessed or removed).
+
+    @param[in] idList: list of data identity dictionaries that should contribute to the coadd
+    @param[in] butler: data butler for input images
+    @param[in] desFwhm: desired PSF of coadd, but in science exposure pixels;
+                if 0 then no PSF matching is performed.
+    @param[in] coaddWcs: WCS for coadd
+    @param[in] coaddBBox: bounding box for coadd
+    @param[in] policy: see policy/coaddDictionary.paf
+    @param[in] stateDir: directory holding the coadd state; created if it doesn't exist
+    @param[in] retract: subtract exposures in the saved coadd that are not in idList?
+    @output:
+    - coaddExposure: coadd exposure
+    - weightMap: sum of the weights of all the images that contributed to each pixel
+    """
+    engine = pipCoadd.CoaddEngine(desFwhm, coaddWcs, coaddBBox, policy)
+    acc = pipCoadd.IncrementalAccumulator(coaddWcs, coaddBBox, policy)
+    if os.path.exists(os.path.join(stateDir, "manifest.json")):
+        acc.load(stateDir)
+    else:
+        acc.save(stateDir)              # Contributions are written to the state directory as they are added
+    print "Saved coadd has %d exposures" % (len(acc.dataIds()),)
+
+    if retract:
+        wanted = set(acc.key(id) for id in idList)
+        for id in acc.dataIds():
+            if acc.key(id) in wanted:
+                continue
+            print "Retracting exposure %s" % (id,)
+            acc.retract(id)
+
+    newIdList = [id for id in idList if not acc.contains(id)]
+    print "Adding %d new exposures" % (len(newIdList),)
+    products = engine.run(newIdList, butler, [acc])[acc.name]
+    acc.save(stateDir)
+
+    return products["coadd"], products["weight"]
+
+if __name__ == "__main__":
+    algName = "incrementalCoadd"
+    pexLog.Trace.setVerbosity('lsst.coadd', 3)
+    pexLog.Trace.setVerbosity('lsst.ip.diffim', 1)
+
+    parser = lsst.pipette.coaddOptions.CoaddOptionParser()
+    parser.add_option("--fwhm", dest="fwhm", type="float", default=0.0,
+        help="Desired FWHM, in science exposure pixels; for no PSF matching omit or set to 0")
+    parser.add_option("--retract", dest="retract", default=False, action="store_true",
+        help="Retract exposures in the saved coadd that are not selected?")
+    policyPath = os.path.join(os.getenv("PIPETTE_DIR"), "policy", "coaddDictionary.paf")
+    config, opts, args = parser.parse_args(policyPath, requiredArgs=["fwhm"])
+
+    desFwhm = opts.fwhm
+    coaddBasePath = parser.getCoaddBasePath()
+    stateDir = "%s_%s_fwhm_%s_state" % (coaddBasePath, algName, desFwhm)
+    coaddExposure, weightMap = incrementalCoadd(
+        idList = parser.getIdList(),
+        butler = parser.getReadWrite().inButler,
+        desFwhm = desFwhm,
+        coaddWcs = parser.getCoaddWcs(),
+        coaddBBox = parser.getCoaddBBox(),
+        policy = config.getPolicy(),
+        stateDir = stateDir,
+        retract = opts.retract)
+
+    filterName = coaddExposure.getFilter().getName()
+    coaddBaseName = "%s_%s_filter_%s_fwhm_%s" % (coaddBasePath, algName, filterName, desFwhm)
+    coaddPath = coaddBaseName + ".fits"
+    weightPath = coaddBaseName + "weight.fits"
+    print "Saving coadd as %s" % (coaddPath,)
+    coaddExposure.writeFits(coaddPath)
+    print "saving weight map as %s" % (weightPath,)
+    weightMap.writeFits(weightPath)
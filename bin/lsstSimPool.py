@@ -12,6 +12,7 @@ import lsst.pipette.processCcd as pipProcCcd
 import lsst.pipette.options as pipOptions
 import lsst.pipette.catalog as pipCatalog
 import lsst.pipette.readwrite as pipReadWrite
+import lsst.pipette.phot as pipPhot
 
 Inputs = collections.namedtuple('Inputs', ['rerun', 'visit', 'snap', 'raft', 'sensor', 'config', 'log'])
 
@@ -106,6 +107,8 @@ if __name__ == "__main__":
                     inputs.append(Inputs(rerun=opts.rerun, visit=opts.visit, snap=opts.snap,
                                          raft=raft, sensor=sensor, config=config, log=logName))
 
+    # Workers are forked afresh for each CCD, so import the plugins once here for them to inherit
+    pipPhot.importPlugins(config)
     pool = multiprocessing.Pool(processes=opts.threads, maxtasksperchild=1)
     pool.map(run, inputs)
     pool.close()
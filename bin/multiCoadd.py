@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import sys
+
+import lsst.pex.logging as pexLog
+import lsst.pipette.coaddOptions
+import lsst.pipette.coaddEngine as pipCoadd
+
+if __name__ == "__main__":
+    pexLog.Trace.setVerbosity('lsst.coadd', 3)
+    pexLog.Trace.setVerbosity('lsst.ip.diffim', 1)
+
+    parser = lsst.pipette.coaddOptions.CoaddOptionParser()
+    parser.add_option("--fwhm", dest="fwhm", type="float", default=0.0,
+        help="Desired FWHM, in science exposure pixels; for no PSF matching omit or set to 0")
+    parser.add_option("--combiners", dest="combiners", default="coadd:chiSquaredCoadd:outlierRejectedCoadd",
+        help="Coadds to make, colon-delimited (default=%default)")
+    # this dictionary is a superset of those for the individual coadds
+    policyPath = os.path.join(os.getenv("PIPETTE_DIR"), "policy", "outlierRejectedCoaddDictionary.paf")
+    config, opts, args = parser.parse_args(policyPath, requiredArgs=["fwhm"])
+
+    desFwhm = opts.fwhm
+    idList = parser.getIdList()
+    if len(idList) < 1:
+        print "Warning: no exposures to coadd!"
+        sys.exit(1)
+    print "Coadd %s calexp" % (len(idList),)
+
+    engine = pipCoadd.CoaddEngine(desFwhm, parser.getCoaddWcs(), parser.getCoaddBBox(), config.getPolicy())
+    products = engine.run(idList, parser.getReadWrite().inButler, opts.combiners.split(":"))
+
+    coaddBasePath = parser.getCoaddBasePath()
+    for algName, algProducts in products.iteritems():
+        coaddExposure = algProducts["coadd"]
+        filterName = coaddExposure.getFilter().getName()
+        coaddBaseName = "%s_%s_filter_%s_fwhm_%s" % (coaddBasePath, algName, filterName, desFwhm)
+        coaddPath = coaddBaseName + ".fits"
+        print "Saving coadd as %s" % (coaddPath,)
+        coaddExposure.writeFits(coaddPath)
+        if algProducts.has_key("weight"):
+            weightPath = coaddBaseName + "weight.fits"
+            print "saving weight map as %s" % (weightPath,)
+            algProducts["weight"].writeFits(weightPath)
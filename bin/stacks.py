@@ -2,21 +2,50 @@
 
 import os
 import sys
-import optparse
+import time
 
 import lsst.obs.hscSim as hsc
 import lsst.pipette.config as pipConfig
 import lsst.pipette.stack as pipStack
+import lsst.pipette.warp as pipWarp
+import lsst.pipette.options as pipOptions
+import lsst.pipette.footprintIndex as pipIndex
 import lsst.pipette.readwrite as pipReadWrite
+import lsst.pipette.stackScheduler as pipScheduler
+import lsst.pipette.writeBehind as pipWriteBehind
 import lsst.skypix as skypix
 
+ALL_CCDS = range(100)
+
+def filename(butler, datasetType, dataId):
+    """Filename of a dataset, or None if it can't be determined"""
+    try:
+        return butler.mapper.map(datasetType, dataId).getLocations()[0]
+    except Exception:
+        return None
+
+def outputs(output, job):
+    """Filenames of the outputs of a stack job: the stack, or its tiles if it is tiled (job.tileSize > 0)"""
+    if job.tileSize <= 0:
+        return [output]
+    basename = os.path.splitext(output)[0]
+    boxes = pipStack.tileBoxes(job.size, job.size, job.tileSize)
+    return [pipStack.tileFilename(basename, bbox) for bbox in boxes]
+
 def run(rerun,                          # Rerun name
         stack,                          # Stack identifier
         filter,                         # Filter name
         field,                          # Field name
         scale,                          # Scale, arcsec/pix
+        config,                         # Configuration
+        index=None,                     # Filename of footprint index
+        warps=False,                    # Print warp commands, one per visit?
+        execute=False,                  # Run the stacks, rather than printing commands?
+        processes=1,                    # Number of stacks to run at once
+        memory=0,                       # Memory budget per stack (MB; 0: no limit)
+        force=False,                    # Run stacks even if their outputs are current?
         ):
-    io = pipReadWrite.ReadWrite(hsc.HscSimMapper(rerun=rerun), ['visit', 'ccd'])
+    io = pipReadWrite.ReadWrite(hsc.HscSimMapper(rerun=rerun), ['visit', 'ccd'], config=config)
 
     skyPolicy = io.inButler.get('skypolicy')
     print skyPolicy.toString()
@@ -25,6 +54,13 @@ def run(rerun,                          # Rerun name
     dataId = {'filter': filter}
     if field is not None:
         dataId['field'] = field
+    if index is not None:
+        index = pipIndex.FootprintIndex(index)
+        warp = pipWarp.Warp()
+
+    jobList = list()                    # Stacks to make
+    visitTiles = dict()                 # Tiles overlapping each visit, for warps
+    visitCcds = dict()                  # CCDs of each visit overlapping its tiles, for warps
     skytiles = io.inButler.queryMetadata('calexp', None, 'skyTile', dataId)
     for tile in skytiles:
         dataId['skyTile'] = tile
@@ -37,33 +73,153 @@ def run(rerun,                          # Rerun name
         ra, dec = bbox.getCenter()      # Degrees
         theta = bbox.getThetaExtent()   # Width, degrees
         size = int(theta * 3600.0 / scale)   # Size, pixels
-        
+
+        ccds = None
+        overlapping = None
+        if index is not None:
+            skycell = warp.skycell(ra, dec, scale, size, size)
+            footprint = pipIndex.SkyFootprint.fromWcs(skycell.getWcs(), size, size)
+            overlapping = [ident for ident in index.query(footprint) if ident['visit'] in visits]
+            if len(overlapping) == 0:
+                continue
+            visits = sorted(set(ident['visit'] for ident in overlapping))
+            ccds = sorted(set(ident['ccd'] for ident in overlapping))
+
+        if warps:
+            for visit in visits:
+                key = (visit, size)
+                if not visitTiles.has_key(key):
+                    visitTiles[key] = list()
+                visitTiles[key].append((tile, ra, dec))
+                if not visitCcds.has_key(key):
+                    visitCcds[key] = set()
+                if overlapping is not None:
+                    visitCcds[key].update(ident['ccd'] for ident in overlapping if ident['visit'] == visit)
+                else:
+                    visitCcds[key].update(ALL_CCDS)
+            continue
+
+        jobList.append(pipScheduler.StackJob(tile, filter, visits, ccds, ra, dec, size))
+
+    if execute:
+        runStacks(io, rerun, stack, scale, config, jobList, processes=processes, memory=memory, force=force)
+        return
+
+    for job in jobList:
         cmd  = "hsc_stack.py --rerun " + rerun
         cmd += " --stack %d" % stack
-        cmd += " --patch %d" % tile
-        cmd += " --filter %s" % filter
-        cmd += " --coords %f %f" % (ra, dec)
+        cmd += " --patch %d" % job.tile
+        cmd += " --filter %s" % job.filter
+        cmd += " --coords %f %f" % (job.ra, job.dec)
         cmd += " --scale %f" % scale
-        cmd += " --sizes %d %d" % (size, size)
-        cmd += " --frames %s" % ":".join(map(str, visits))
+        cmd += " --sizes %d %d" % (job.size, job.size)
+        cmd += " --frames %s" % ":".join(map(str, job.visits))
+        if job.ccds is not None:
+            cmd += " --ccds %s" % ":".join(map(str, job.ccds))
         cmd += " --ignore"
         print cmd
 
+    # Each visit is warped onto all its tiles at once, so each CCD is read only once
+    for (visit, size), tiles in sorted(visitTiles.items()):
+        cmd  = "hsc_warp.py --rerun " + rerun
+        cmd += " --frame %d" % visit
+        cmd += " --ccds %s" % ":".join(map(str, sorted(visitCcds[(visit, size)])))
+        cmd += " --patches %s" % ":".join(str(tile) for tile, ra, dec in tiles)
+        cmd += "".join(" --coords %f %f" % (ra, dec) for tile, ra, dec in tiles)
+        cmd += " --scale %f" % scale
+        cmd += " --sizes %d %d" % (size, size)
+        print cmd
+
+
+def runStacks(io,                       # Input/output
+              rerun,                    # Rerun name
+              stack,                    # Stack identifier
+              scale,                    # Scale, arcsec/pix
+              config,                   # Configuration
+              jobList,                  # List of StackJobs
+              processes=1,              # Number of stacks to run at once
+              memory=0,                 # Memory budget per stack (MB; 0: no limit)
+              force=False,              # Run stacks even if their outputs are current?
+              ):
+    """Run stacks on a pool of processes, largest first"""
+    todo = list()
+    warpProcesses, calexps = pipScheduler.warpConcurrency(config)
+    for job in pipScheduler.order(jobList):
+        job.warpProcesses, job.calexps = warpProcesses, calexps
+        job.tileSize = pipScheduler.tileSizeForBudget(job.size, memory * 1024 * 1024, calexps=calexps,
+                                                      warpProcesses=warpProcesses)
+        output = filename(io.outButler, 'stack', {'stack': stack, 'patch': job.tile, 'filter': job.filter})
+        inputs = [filename(io.inButler, 'calexp', {'visit': visit, 'ccd': ccd}) for visit in job.visits
+                  for ccd in (job.ccds if job.ccds is not None else ALL_CCDS)]
+        if not force and output is not None and \
+               all(pipScheduler.outputCurrent(path, inputs) for path in outputs(output, job)):
+            print "Skipping %s: output %s is current" % (job, output)
+            continue
+        todo.append(job)
+
+    def stackJob(job):
+        config['stack']['tileSize'] = job.tileSize # Only affects this worker
+        stackProc = pipStack.Stack(config=config)
+        identMatrix = [[{'visit': visit, 'ccd': ccd} for ccd in (job.ccds if job.ccds is not None else ALL_CCDS)]
+                       for visit in job.visits]
+        outputId = {'stack': stack, 'patch': job.tile, 'filter': job.filter}
+        if job.tileSize > 0:
+            # The full stack would exceed the memory budget, so each tile is written separately
+            path = filename(io.outButler, 'stack', outputId)
+            if path is None:
+                raise RuntimeError("Unable to determine filename for tiles of stack %s" % (outputId,))
+            basename = os.path.splitext(path)[0]
+            def output(bbox, tile):
+                tile.writeFits(pipStack.tileFilename(basename, bbox))
+            stackProc.run(identMatrix, io.inButler, job.ra, job.dec, scale, job.size, job.size, ignore=True,
+                          output=output)
+        else:
+            exp = stackProc.run(identMatrix, io.inButler, job.ra, job.dec, scale, job.size, job.size,
+                                ignore=True)
+            stackProc.write(io.outButler, outputId, {"stack": exp})
+        pipWriteBehind.flush()          # Pool workers don't run exit handlers
+
+    print "Running %d stacks (%d current) with %d processes" % (len(todo), len(jobList) - len(todo), processes)
+    start = time.time()
+    failed = 0
+    for num, (job, elapsed, error) in enumerate(pipScheduler.runJobs(todo, stackJob, processes=processes)):
+        if error is not None:
+            failed += 1
+            print "Failed %s after %.1f sec: %s" % (job, elapsed, error)
+        else:
+            print "Stacked %s in %.1f sec (tile size %d, ~%d MB)" % (job, elapsed, job.tileSize,
+                                                                     job.memory() / 1024 / 1024)
+        print "Progress: %d/%d stacks done (%d failed), %.1f sec elapsed" % (num + 1, len(todo), failed,
+                                                                              time.time() - start)
 
 
 if __name__ == "__main__":
-    parser = optparse.OptionParser()
+    parser = pipOptions.OptionParser()
     parser.add_option("-r", "--rerun", default=os.getenv("USER", default="rerun"), dest="rerun",
                       help="rerun name (default=%default)")
     parser.add_option("-s", "--stack", dest="stack", type="int", help="Stack identifier")
     parser.add_option("--filter", dest="filter", type="string", help="Filter name")
     parser.add_option("--field", dest="field", type="string", help="Field name")
     parser.add_option("--scale", dest="scale", type="float", help="Scale, arcsec/pix")
+    parser.add_option("--index", dest="index", type="string", help="Footprint index, to select CCDs")
+    parser.add_option("--warps", dest="warps", default=False, action="store_true",
+                      help="Print a warp command for each visit, covering all its tiles?")
+    parser.add_option("--run", dest="execute", default=False, action="store_true",
+                      help="Run the stacks here, rather than printing commands?")
+    parser.add_option("--processes", dest="processes", type="int", default=1,
+                      help="Number of stacks to run at once (default=%default)")
+    parser.add_option("--memory", dest="memory", type="int", default=0,
+                      help="Memory budget per stack, MB; sets the tile size (default=%default: no limit)")
+    parser.add_option("--force", dest="force", default=False, action="store_true",
+                      help="Run stacks even if their outputs are current?")
 
-    opts, args = parser.parse_args()
+    default = os.path.join(os.getenv("PIPETTE_DIR"), "policy", "WarpProcessDictionary.paf")
+    overrides = os.path.join(os.getenv("PIPETTE_DIR"), "policy", "suprimecam_warp.paf")
+    config, opts, args = parser.parse_args([default, overrides])
     if len(args) > 0 or len(sys.argv) == 1 or opts.rerun is None or opts.stack is None \
-           or opts.filter is None or opts.scale is None:
+           or opts.filter is None or opts.scale is None or (opts.execute and opts.warps):
         parser.print_help()
         sys.exit(1)
 
-    run(opts.rerun, opts.stack, opts.filter, opts.field, opts.scale)
+    run(opts.rerun, opts.stack, opts.filter, opts.field, opts.scale, config, index=opts.index,
+        warps=opts.warps, execute=opts.execute, processes=opts.processes, memory=opts.memory, force=opts.force)
@@ -21,10 +21,13 @@ def run(rerun,                          # Rerun name
     io = pipReadWrite.ReadWrite(suprimecam.SuprimecamMapper(rerun=rerun), ['visit'], config=config)
     diffProc = pipDiff.Diff(config=config)
 
-    exp1 = io.inButler.get('warp', {'visit': frame1, 'patch': patch})
+    inputId = {'visit': frame1, 'patch': patch}
+    exp1 = io.inButler.get('warp', inputId)
     exp2 = io.inButler.get('warp', {'visit': frame2, 'patch': patch})
 
-    diffExp, sources, psf, apcorr, brightSources = diffProc.run(exp1, exp2)
+    diffExp, sources, psf, apcorr, brightSources = diffProc.run(exp1, exp2,
+                                                                templateId={'visit': frame2, 'patch': patch},
+                                                                butler=io.inButler, inputId=inputId)
 
     sources = afwDet.PersistableSourceVector(sources)
 
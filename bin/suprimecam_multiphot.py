@@ -15,6 +15,7 @@ def run(rerun,                          # Rerun name
         measureList,                    # List of stack names to measure
         skytile,                        # Sky tile number
         config,                         # Configuration
+        processes=1,                    # Number of processes
         ):
     io = pipReadWrite.ReadWrite(suprimecam.SuprimecamMapper, ['visit', 'ccd'], config=config)
     roots = config['roots']
@@ -27,18 +28,18 @@ def run(rerun,                          # Rerun name
 
     refId = {'stack': reference, 'skytile': skytile, 'filter': "r"}
     refStack = photProc.read(io.inButler, refId, ['stack'])[0]
-    measStackList = list()
-    for name in measureList:
-        dataId = {'stack': name, 'skytile': skytile, 'filter': "r"}
-        measStack = refStack if dataId == refId else photProc.read(io.inButler, dataId, ['stack'])[0]
-        measStackList.append(measStack)
-
-    sourceList = photProc.run(refStack, measStackList)
+    identList = [{'stack': name, 'skytile': skytile, 'filter': "r"} for name in measureList]
 
     catPolicy = os.path.join(os.getenv("PIPETTE_DIR"), "policy", "catalog.paf")
     catalog = pipCatalog.Catalog(catPolicy, allowNonfinite=False)
-    for name, sources in zip(measureList, sourceList):
-        catalog.writeSources(basename + '-' + name + '.sources', sources, 'sources')
+
+    def output(ident, sources):
+        catalog.writeSources(basename + '-' + ident['stack'] + '.sources', sources, 'sources')
+        return len(sources)
+
+    for ident, num in photProc.runIdents(refStack, io.inButler, identList, 'stack', output,
+                                         processes=processes, refIdent=refId):
+        photProc.log.log(photProc.log.INFO, "Wrote %d sources for %s" % (num, ident))
 
 
 
@@ -52,6 +53,8 @@ if __name__ == "__main__":
                       help="Stack name to measure")
     parser.add_option("-s", "--skytile", dest="skytile", type="int",
                       help="Skytile identifier")
+    parser.add_option("-j", "--processes", dest="processes", type="int", default=1,
+                      help="Number of processes (default=%default)")
 
     default = os.path.join(os.getenv("PIPETTE_DIR"), "policy", "MultiPhotProcessDictionary.paf")
     overrides = os.path.join(os.getenv("PIPETTE_DIR"), "policy", "suprimecam_multiphot.paf")
@@ -61,4 +64,4 @@ if __name__ == "__main__":
         parser.print_help()
         sys.exit(1)
 
-    run(opts.rerun, opts.reference, opts.measure, opts.skytile, config)
+    run(opts.rerun, opts.reference, opts.measure, opts.skytile, config, processes=opts.processes)
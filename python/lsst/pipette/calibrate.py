@@ -33,13 +33,15 @@ def propagateFlag(flag, old, new):
 
 class Calibrate(pipProc.Process):
     def __init__(self, Repair=pipRepair.Repair, Photometry=pipPhot.Photometry,
-                 Background=pipBackground.Background, Rephotometry=pipPhot.Rephotometry,
-                 *args, **kwargs):
+                 Background=pipBackground.Background, Rephotometry=pipPhot.Rephotometry, detections=None,
+                 BrightPhotometry=pipPhot.BrightPhotometry, *args, **kwargs):
         super(Calibrate, self).__init__(*args, **kwargs)
         self._Repair = Repair
         self._Photometry = Photometry
+        self._BrightPhotometry = BrightPhotometry
         self._Background = Background
         self._Rephotometry = Rephotometry
+        self._detections = detections
 
     def run(self, exposure, defects=None, background=None):
         """Calibrate an exposure: PSF, astrometry and photometry
@@ -147,6 +149,8 @@ class Calibrate(pipProc.Process):
         """
         repair = self._Repair(keepCRs=preserve, config=self.config, log=self.log)
         repair.run(exposure, psf, defects=defects)
+        if self._detections is not None:
+            self._detections.modified(exposure)
 
 
     @timecall
@@ -159,8 +163,14 @@ class Calibrate(pipProc.Process):
         @param wcs World Coordinate System, or None
         @return Source list
         """
-        thresholdMultiplier = self.config['calibrate']['thresholdValue']
-        phot = self._Photometry(config=self.config, log=self.log, thresholdMultiplier=thresholdMultiplier)
+        calibrate = self.config['calibrate']
+        thresholdMultiplier = calibrate['thresholdValue']
+        if calibrate.has_key('maxSources') and calibrate['maxSources'] > 0:
+            Photometry = self._BrightPhotometry
+        else:
+            Photometry = self._Photometry
+        phot = Photometry(config=self.config, log=self.log, thresholdMultiplier=thresholdMultiplier,
+                          detections=self._detections)
         return phot.run(exposure, psf)
 
 
@@ -265,6 +275,8 @@ class Calibrate(pipProc.Process):
         # Subtract background
         bg = self._Background(config=self.config, log=self.log)
         bg.run(exposure)
+        if self._detections is not None:
+            self._detections.modified(exposure)
 
 
     @timecall
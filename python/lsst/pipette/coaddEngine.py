@@ -0,0 +1,533 @@
+#!/usr/bin/env python
+
+import os
+import json
+import hashlib
+import numpy
+
+import lsst.pex.logging as pexLog
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
+import lsst.afw.math as afwMath
+import lsst.coadd.utils as coaddUtils
+import lsst.pipette.mappedExposure as pipMapped
+import lsst.pipette.warpCache as pipWarpCache
+
+"""This module provides a coadd engine that reads, PSF-matches and warps each input once, and feeds the warp
+to any number of accumulators, each of which produces a flavour of coadd."""
+
+class CoaddInput(object):
+    """A PSF-matched and warped input to a coadd
+
+    Attributes:
+    - dataId: data identifier
+    - exposure: warped exposure (unnormalized); accumulators must not modify it
+    - path: base path of the memory-mappable copy of the warp, or None
+    - fluxMag0: flux of a zero-magnitude object in the input exposure
+    - stats: dict of statistics of the warp, measured as it was written (see
+      lsst.pipette.mappedExposure.PixelStatistics): meanVariance, coverage and maskCounts
+    """
+    def __init__(self, dataId, exposure, path, fluxMag0, stats):
+        self.dataId = dataId
+        self.exposure = exposure
+        self.path = path
+        self.fluxMag0 = fluxMag0
+        self.stats = stats
+
+
+class Accumulator(object):
+    """Base class for coadd accumulators
+
+    Subclasses define name, and implement add (called for each input) and finish (called at the end).
+    """
+    name = None
+
+    def __init__(self, coaddWcs, coaddBBox, policy, log=None):
+        """Initialisation
+
+        @param coaddWcs WCS of coadd
+        @param coaddBBox Bounding box of coadd
+        @param policy Coadd policy
+        @param log Log, or None for the default
+        """
+        self.coaddWcs = coaddWcs
+        self.coaddBBox = coaddBBox
+        self.policy = policy
+        if log is None: log = pexLog.getDefaultLog()
+        self.log = pexLog.Log(log, self.__class__.__name__)
+
+    def add(self, coaddInput):
+        """Add an input (CoaddInput) to the coadd"""
+        raise NotImplementedError("This method needs to be provided by the subclass.")
+
+    def finish(self):
+        """Complete the coadd
+
+        @return dict of products: coadd (exposure) and, if available, weight (image)
+        """
+        raise NotImplementedError("This method needs to be provided by the subclass.")
+
+
+class MeanAccumulator(Accumulator):
+    """Weighted mean coadd (lsst.coadd.utils)"""
+    name = "coadd"
+
+    def __init__(self, coaddWcs, coaddBBox, policy, log=None):
+        Accumulator.__init__(self, coaddWcs, coaddBBox, policy, log=log)
+        self._coadd = coaddUtils.Coadd.fromPolicy(coaddBBox, coaddWcs, policy.getPolicy("coaddPolicy"))
+
+    def add(self, coaddInput):
+        self._coadd.addExposure(coaddInput.exposure)
+
+    def finish(self):
+        return dict(coadd=self._coadd.getCoadd(), weight=self._coadd.getWeightMap())
+
+
+class ChiSquaredAccumulator(Accumulator):
+    """Chi-squared coadd (lsst.coadd.chisquared)"""
+    name = "chiSquaredCoadd"
+
+    def __init__(self, coaddWcs, coaddBBox, policy, log=None):
+        Accumulator.__init__(self, coaddWcs, coaddBBox, policy, log=log)
+        import lsst.coadd.chisquared as coaddChiSq
+        self._coadd = coaddChiSq.Coadd.fromPolicy(coaddBBox, coaddWcs, policy.getPolicy("coaddPolicy"))
+
+    def add(self, coaddInput):
+        self._coadd.addExposure(coaddInput.exposure)
+
+    def finish(self):
+        return dict(coadd=self._coadd.getCoadd(), weight=self._coadd.getWeightMap())
+
+
+class ExposureMetadata(object):
+    """Metadata for an exposure
+
+    Attributes:
+    - path: base path of memory-mapped exposure (see lsst.pipette.mappedExposure)
+    - wcs: WCS of exposure
+    - bbox: parent bounding box of exposure
+    - scale: factor by which the stored pixels must be multiplied to normalize them
+    - weight = weightFactor / clipped mean variance (of the normalized exposure)
+    """
+    def __init__(self, path, exposure, stats, weightFactor = 1.0, scale = 1.0):
+        """Create an ExposureMetadata
+
+        @param[in] path: base path of memory-mapped exposure
+        @param[in] exposure: Exposure (unnormalized)
+        @param[in] stats: statistics of the (unnormalized) exposure, from the warp (CoaddInput.stats)
+        @param[in] weightFactor: additional scaling factor for weight:
+        @param[in] scale: normalization of the stored pixels
+        """
+        self.path = path
+        self.scale = scale
+        self.wcs = exposure.getWcs()
+        self.bbox = exposure.getBBox(afwImage.PARENT)
+        self.filter = exposure.getFilter()
+        self.weight = weightFactor / (stats["meanVariance"] * scale**2)
+
+
+def subBBoxIter(bbox, subregionSize):
+    """Iterate over subregions of a bbox
+
+    @param[in] bbox: bounding box over which to iterate: afwGeom.Box2I
+    @param[in] subregionSize: size of sub-bboxes
+
+    @return subBBox: next sub-bounding box of size subregionSize or smaller;
+        each subBBox is contained within bbox, so it may be smaller than subregionSize at the edges of bbox,
+        but it will never be empty
+    """
+    if bbox.isEmpty():
+        raise RuntimeError("bbox %s is empty" % (bbox,))
+    if subregionSize[0] < 1 or subregionSize[1] < 1:
+        raise RuntimeError("subregionSize %s must be nonzero" % (subregionSize,))
+
+    for rowShift in range(0, bbox.getHeight(), subregionSize[1]):
+        for colShift in range(0, bbox.getWidth(), subregionSize[0]):
+            subBBox = afwGeom.Box2I(bbox.getMin() + afwGeom.Extent2I(colShift, rowShift), subregionSize)
+            subBBox.clip(bbox)
+            if subBBox.isEmpty():
+                raise RuntimeError("Bug: empty bbox! bbox=%s, subregionSize=%s, colShift=%s, rowShift=%s" % \
+                    (bbox, subregionSize, colShift, rowShift))
+            yield subBBox
+
+
+class OutlierRejectedAccumulator(Accumulator):
+    """Outlier-rejected (clipped mean) coadd
+
+    Inputs are normalized to the coadd zero point.  Since clipping needs all inputs at once, each warp is
+    kept in the memory-mappable format (in the warp cache, or else in the working directory) and the coadd
+    is computed subregion by subregion at the end.
+    """
+    name = "outlierRejectedCoadd"
+
+    def __init__(self, coaddWcs, coaddBBox, policy, log=None):
+        Accumulator.__init__(self, coaddWcs, coaddBBox, policy, log=log)
+        coaddPolicy = policy.getPolicy("coaddPolicy")
+        self._badPixelMask = afwImage.MaskU.getPlaneBitMask(coaddPolicy.getArray("badMaskPlanes"))
+        self._coaddZeroPoint = coaddPolicy.get("coaddZeroPoint")
+        self._coaddCalib = afwImage.Calib()
+        self._coaddCalib.setFluxMag0(10**(0.4 * self._coaddZeroPoint))
+        self._exposureMetadataList = []
+
+    def add(self, coaddInput):
+        path = coaddInput.path
+        if path is None:
+            dataId = coaddInput.dataId
+            path = "_".join(["%s_%s" % (k, dataId[k]) for k in sorted(dataId.keys())])
+            path = path.replace(",", "_")
+            self.log.log(self.log.INFO, "Saving intermediate exposure %s" % (path,))
+            pipMapped.writeMappedExposure(coaddInput.exposure, path)
+
+        # Normalization is applied as the stored (unnormalized, so shareable) warp is read
+        srcCalib = afwImage.Calib()
+        srcCalib.setFluxMag0(coaddInput.fluxMag0)
+        scaleFac = 1.0 / srcCalib.getFlux(self._coaddZeroPoint)
+        self.log.log(self.log.INFO, "Normalized using scaleFac=%0.3g" % (scaleFac,))
+
+        self._exposureMetadataList.append(ExposureMetadata(
+                path = path,
+                exposure = coaddInput.exposure,
+                stats = coaddInput.stats,
+                scale = scaleFac,
+            ))
+
+    def finish(self):
+        exposureMetadataList = self._exposureMetadataList
+        edgeMask = afwImage.MaskU.getPlaneBitMask("EDGE")
+
+        statsCtrl = afwMath.StatisticsControl()
+        statsCtrl.setNumSigmaClip(3.0)
+        statsCtrl.setNumIter(2)
+        statsCtrl.setAndMask(self._badPixelMask)
+
+        coaddExposure = afwImage.ExposureF(self.coaddBBox, self.coaddWcs)
+        coaddExposure.setCalib(self._coaddCalib)
+
+        filterDict = {} # dict of name: Filter
+        for expMeta in exposureMetadataList:
+            filterDict.setdefault(expMeta.filter.getName(), expMeta.filter)
+        if len(filterDict) == 1:
+            coaddExposure.setFilter(filterDict.values()[0])
+        self.log.log(self.log.INFO, "Filter=%s" % (coaddExposure.getFilter().getName(),))
+
+        coaddMaskedImage = coaddExposure.getMaskedImage()
+        subregionSizeArr = self.policy.getArray("subregionSize")
+        subregionSize = afwGeom.Extent2I(subregionSizeArr[0], subregionSizeArr[1])
+        mappedList = [pipMapped.MappedExposure(expMeta.path) for expMeta in exposureMetadataList]
+        buffers = [None] * len(mappedList) # subregion buffers, recycled between subregions
+        for bbox in subBBoxIter(self.coaddBBox, subregionSize):
+            self.log.log(self.log.INFO, "Computing coadd %s" % (bbox,))
+            coaddView = afwImage.MaskedImageF(coaddMaskedImage, bbox, afwImage.PARENT, False)
+            maskedImageList = afwImage.vectorMaskedImageF() # [] is rejected by afwMath.statisticsStack
+            weightList = []
+            for i, (expMeta, mapped) in enumerate(zip(exposureMetadataList, mappedList)):
+                if not bbox.overlaps(expMeta.bbox):
+                    self.log.log(self.log.DEBUG, "Skipping %s; no overlap" % (expMeta.path,))
+                    continue
+                maskedImage = buffers[i]
+                if maskedImage is None or maskedImage.getDimensions() != bbox.getDimensions():
+                    maskedImage = afwImage.MaskedImageF(bbox)
+                    buffers[i] = maskedImage
+                else:
+                    maskedImage.setXY0(bbox.getMin())
+                # pixels outside the exposure (partial overlap) are set to EDGE
+                mapped.fill(maskedImage, edgeMask)
+                maskedImage *= expMeta.scale
+                maskedImageList.append(maskedImage)
+                weightList.append(expMeta.weight)
+            try:
+                coaddSubregion = afwMath.statisticsStack(
+                    maskedImageList, afwMath.MEANCLIP, statsCtrl, weightList)
+
+                coaddView <<= coaddSubregion
+            except Exception, e:
+                self.log.log(self.log.WARN, "Outlier rejection failed for %s: %s" % (bbox, e))
+                raise
+
+        coaddUtils.setCoaddEdgeBits(coaddMaskedImage.getMask(), coaddMaskedImage.getVariance())
+
+        return dict(coadd=coaddExposure)
+
+
+class IncrementalAccumulator(Accumulator):
+    """Weighted mean coadd whose state may be saved, and later updated with new inputs or inputs retracted
+
+    The state is the weighted sum of the (normalized) pixels, the sum of weights, the weighted sum of
+    variances, a manifest of the contributing inputs with the weights and normalizations they were added with,
+    and the contribution of each input to the sums, so that an input can be subtracted exactly without
+    reading or warping it again.  Each input is weighted by the inverse of its clipped mean variance, as for
+    MeanAccumulator.  Only EDGE is set in the coadd mask, since OR-ed mask bits can't be retracted.
+
+    Once the state has been saved or loaded, the contributions of new inputs are written to the state
+    directory as they are added; before then, they are held in memory.
+    """
+    name = "incrementalCoadd"
+
+    def __init__(self, coaddWcs, coaddBBox, policy, log=None):
+        Accumulator.__init__(self, coaddWcs, coaddBBox, policy, log=log)
+        coaddPolicy = policy.getPolicy("coaddPolicy")
+        self._badPixelMask = afwImage.MaskU.getPlaneBitMask(coaddPolicy.getArray("badMaskPlanes"))
+        self._coaddZeroPoint = coaddPolicy.get("coaddZeroPoint")
+        shape = (coaddBBox.getHeight(), coaddBBox.getWidth())
+        self._sum = numpy.zeros(shape, dtype=numpy.float64)
+        self._weight = numpy.zeros(shape, dtype=numpy.float64)
+        self._varSum = numpy.zeros(shape, dtype=numpy.float64)
+        self._manifest = dict()         # Contributing inputs: key --> dataId, weight, scale, filter, etc.
+        self._directory = None          # Directory holding the state
+        self._pending = dict()          # Contributions not yet written: filename --> contribution
+
+    @staticmethod
+    def key(dataId):
+        """Key in the manifest for a data identifier"""
+        return json.dumps(dataId, sort_keys=True)
+
+    def contains(self, dataId):
+        """Has this input been added?"""
+        return self._manifest.has_key(self.key(dataId))
+
+    @classmethod
+    def contributionName(cls, dataId):
+        """Filename for the contribution of an input"""
+        return hashlib.md5(cls.key(dataId)).hexdigest() + ".npz"
+
+    def dataIds(self):
+        """Data identifiers of the contributing inputs"""
+        return [entry["dataId"] for entry in self._manifest.itervalues()]
+
+    def add(self, coaddInput):
+        if self.contains(coaddInput.dataId):
+            self.log.log(self.log.WARN, "Exposure %s already in coadd; ignoring" % (coaddInput.dataId,))
+            return
+        srcCalib = afwImage.Calib()
+        srcCalib.setFluxMag0(coaddInput.fluxMag0)
+        scale = 1.0 / srcCalib.getFlux(self._coaddZeroPoint)
+        weight = ExposureMetadata(coaddInput.path, coaddInput.exposure, coaddInput.stats, scale=scale).weight
+        contribution = self._contribution(coaddInput.exposure, weight, scale)
+        self._accumulate(contribution, 1.0)
+        filename = self.contributionName(coaddInput.dataId)
+        if self._directory is None:
+            self._pending[filename] = contribution
+        else:
+            self._writeContribution(self._directory, filename, contribution)
+        self._manifest[self.key(coaddInput.dataId)] = dict(dataId=coaddInput.dataId, weight=weight,
+                                                           scale=scale, contribution=filename,
+                                                           filter=coaddInput.exposure.getFilter().getName())
+
+    def retract(self, dataId):
+        """Subtract an input that was previously added, using its saved contribution
+
+        @param dataId Data identifier of input
+        """
+        key = self.key(dataId)
+        entry = self._manifest[key]
+        filename = entry.get("contribution")
+        if self._pending.has_key(filename):
+            contribution = self._pending.pop(filename)
+        elif filename is not None and self._directory is not None and \
+                 os.path.exists(os.path.join(self._directory, "contributions", filename)):
+            contribution = self._readContribution(self._directory, filename)
+        else:
+            raise RuntimeError("Unable to retract %s: contribution was not saved" % (dataId,))
+        del self._manifest[key]
+        self._accumulate(contribution, -1.0)
+        # Remove round-off where nothing remains
+        empty = numpy.abs(self._weight) <= 1.0e-10 * max(entry["weight"], self._weight.max())
+        self._sum[empty] = 0.0
+        self._weight[empty] = 0.0
+        self._varSum[empty] = 0.0
+
+    def _contribution(self, exposure, weight, scale):
+        """Return the contribution of an exposure to the sums
+
+        The contribution is restricted to the box (in coadd pixels) bounding the good pixels.
+
+        @return box (x0, y0, width, height), and dict of sum, weight and varSum arrays
+        """
+        mi = exposure.getMaskedImage()
+        image = mi.getImage().getArray()
+        mask = mi.getMask().getArray()
+        variance = mi.getVariance().getArray()
+        good = ((mask & self._badPixelMask) == 0) & numpy.isfinite(image) & numpy.isfinite(variance)
+
+        rows = numpy.where(good.any(axis=1))[0]
+        cols = numpy.where(good.any(axis=0))[0]
+        if len(rows) == 0:
+            return (0, 0, 0, 0), dict((name, numpy.zeros((0, 0))) for name in ("sum", "weight", "varSum"))
+        sub = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+        good = good[sub]
+        arrays = dict()
+        for name, values in (("sum", weight * scale * image[sub]), ("weight", weight),
+                             ("varSum", weight**2 * scale**2 * variance[sub])):
+            arrays[name] = numpy.where(good, values, 0.0).astype(numpy.float64)
+        x0 = mi.getX0() - self.coaddBBox.getMinX() + cols[0]
+        y0 = mi.getY0() - self.coaddBBox.getMinY() + rows[0]
+        return (int(x0), int(y0), int(cols[-1] + 1 - cols[0]), int(rows[-1] + 1 - rows[0])), arrays
+
+    def _accumulate(self, contribution, sign):
+        """Add (sign=+1) or subtract (sign=-1) a contribution into the sums"""
+        (x0, y0, width, height), arrays = contribution
+        box = (slice(y0, y0 + height), slice(x0, x0 + width))
+        self._sum[box] += sign * arrays["sum"]
+        self._weight[box] += sign * arrays["weight"]
+        self._varSum[box] += sign * arrays["varSum"]
+
+    @staticmethod
+    def _writeContribution(directory, filename, contribution):
+        """Write the contribution of an input to the state directory"""
+        subdir = os.path.join(directory, "contributions")
+        if not os.path.isdir(subdir):
+            os.makedirs(subdir)
+        box, arrays = contribution
+        numpy.savez(os.path.join(subdir, filename), box=numpy.array(box), **arrays)
+
+    @staticmethod
+    def _readContribution(directory, filename):
+        """Read the contribution of an input from the state directory"""
+        data = numpy.load(os.path.join(directory, "contributions", filename))
+        try:
+            return tuple(int(x) for x in data["box"]), dict((name, data[name]) for name in
+                                                            ("sum", "weight", "varSum"))
+        finally:
+            if hasattr(data, "close"):
+                data.close()
+
+    def finish(self):
+        coaddExposure = afwImage.ExposureF(self.coaddBBox, self.coaddWcs)
+        coaddCalib = afwImage.Calib()
+        coaddCalib.setFluxMag0(10**(0.4 * self._coaddZeroPoint))
+        coaddExposure.setCalib(coaddCalib)
+        filterNames = set(entry["filter"] for entry in self._manifest.itervalues())
+        if len(filterNames) == 1 and not "_unknown_" in filterNames:
+            coaddExposure.setFilter(afwImage.Filter(filterNames.pop()))
+
+        mi = coaddExposure.getMaskedImage()
+        covered = self._weight > 0
+        image = numpy.zeros_like(self._sum)
+        variance = numpy.zeros_like(self._sum)
+        image[covered] = self._sum[covered] / self._weight[covered]
+        variance[covered] = self._varSum[covered] / self._weight[covered]**2
+        mi.getImage().getArray()[:] = image
+        mi.getVariance().getArray()[:] = variance
+
+        weightMap = afwImage.ImageF(self.coaddBBox.getWidth(), self.coaddBBox.getHeight())
+        weightMap.getArray()[:] = self._weight
+        coaddUtils.setCoaddEdgeBits(mi.getMask(), weightMap)
+        return dict(coadd=coaddExposure, weight=weightMap)
+
+    def save(self, directory):
+        """Save the state in a directory
+
+        Contributions of inputs no longer in the coadd are removed.  Contributions of inputs added after
+        this are written to the directory as they are added.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for filename, contribution in self._pending.iteritems():
+            self._writeContribution(directory, filename, contribution)
+        self._pending.clear()
+        wanted = set(entry.get("contribution") for entry in self._manifest.itervalues())
+        if self._directory is not None and os.path.abspath(self._directory) != os.path.abspath(directory):
+            for filename in wanted:
+                if filename is not None and os.path.exists(os.path.join(self._directory, "contributions",
+                                                                        filename)):
+                    self._writeContribution(directory, filename,
+                                            self._readContribution(self._directory, filename))
+        self._directory = directory
+        subdir = os.path.join(directory, "contributions")
+        if os.path.isdir(subdir):
+            for filename in os.listdir(subdir):
+                if filename not in wanted:
+                    os.remove(os.path.join(subdir, filename))
+        for name, array in (("sum", self._sum), ("weight", self._weight), ("varSum", self._varSum)):
+            numpy.save(os.path.join(directory, name + ".npy"), array)
+        bbox = self.coaddBBox
+        manifest = dict(bbox=[bbox.getMinX(), bbox.getMinY(), bbox.getWidth(), bbox.getHeight()],
+                        zeroPoint=self._coaddZeroPoint, inputs=self._manifest.values())
+        fd = open(os.path.join(directory, "manifest.json"), "w")
+        try:
+            json.dump(manifest, fd)
+        finally:
+            fd.close()
+
+    def load(self, directory):
+        """Load the state from a directory
+
+        The saved coadd must have the same bounding box and zero point.  Contributions of inputs added after
+        this are written to the directory as they are added.
+        """
+        fd = open(os.path.join(directory, "manifest.json"))
+        try:
+            manifest = json.load(fd)
+        finally:
+            fd.close()
+        bbox = self.coaddBBox
+        if manifest["bbox"] != [bbox.getMinX(), bbox.getMinY(), bbox.getWidth(), bbox.getHeight()] or \
+               manifest["zeroPoint"] != self._coaddZeroPoint:
+            raise RuntimeError("Saved coadd in %s does not match this coadd" % (directory,))
+        self._sum = numpy.load(os.path.join(directory, "sum.npy"))
+        self._weight = numpy.load(os.path.join(directory, "weight.npy"))
+        self._varSum = numpy.load(os.path.join(directory, "varSum.npy"))
+        self._manifest = dict()
+        for entry in manifest["inputs"]:
+            dataId = dict((str(k), str(v) if isinstance(v, unicode) else v)
+                          for k, v in entry["dataId"].iteritems())
+            contribution = entry.get("contribution")
+            self._manifest[self.key(dataId)] = dict(dataId=dataId, weight=entry["weight"],
+                                                    scale=entry["scale"], filter=str(entry["filter"]),
+                                                    contribution=str(contribution) if contribution else None)
+        self._pending.clear()
+        self._directory = directory
+
+
+accumulatorRegistry = dict((Acc.name, Acc) for Acc in
+                           (MeanAccumulator, ChiSquaredAccumulator, OutlierRejectedAccumulator,
+                            IncrementalAccumulator))
+
+
+class CoaddEngine(object):
+    """Coadd engine: PSF-match and warp each input once, and feed it to all the accumulators
+
+    Warps are taken from, and added to, the warp cache if roots.warpCache is set.
+    """
+    def __init__(self, desFwhm, coaddWcs, coaddBBox, policy, log=None):
+        """Initialisation
+
+        @param desFwhm Desired FWHM of coadd, in science exposure pixels; if 0 then no PSF matching
+        @param coaddWcs WCS of coadd
+        @param coaddBBox Bounding box of coadd
+        @param policy Coadd policy
+        @param log Log, or None for the default
+        """
+        self.coaddWcs = coaddWcs
+        self.coaddBBox = coaddBBox
+        self.policy = policy
+        if log is None: log = pexLog.getDefaultLog()
+        self.log = pexLog.Log(log, self.__class__.__name__)
+        cache = pipWarpCache.getWarpCache(desFwhm, coaddWcs, coaddBBox, policy)
+        self._warper = pipWarpCache.MatchedWarper(desFwhm, coaddWcs, coaddBBox, policy, cache=cache, log=log)
+
+    def accumulators(self, names):
+        """Construct accumulators by name (see accumulatorRegistry)"""
+        return [accumulatorRegistry[name](self.coaddWcs, self.coaddBBox, self.policy, log=self.log)
+                for name in names]
+
+    def run(self, idList, butler, accumulators):
+        """Coadd exposures
+
+        @param idList List of data identifiers
+        @param butler Data butler for input calexp and psf
+        @param accumulators List of accumulators (or their names)
+        @return dict of accumulator name: dict of products
+        """
+        accumulators = [self.accumulators([acc])[0] if isinstance(acc, basestring) else acc
+                        for acc in accumulators]
+        numExp = len(idList)
+        for ind, id in enumerate(idList):
+            self.log.log(self.log.INFO, "Processing exposure %d of %d: id=%s" % (ind+1, numExp, id))
+            exposure, path, fluxMag0, stats = self._warper.warp(id, butler)
+            coaddInput = CoaddInput(id, exposure, path, fluxMag0, stats)
+            for acc in accumulators:
+                acc.add(coaddInput)
+            del coaddInput, exposure
+
+        return dict((acc.name, acc.finish()) for acc in accumulators)
@@ -28,6 +28,7 @@ import lsst.afw.geom as afwGeom
 import lsst.afw.image as afwImage
 import lsst.skymap as skymap
 import idListOptions
+import footprintIndex
 
 _RadPerDeg = math.pi / 180.0
 
@@ -133,6 +134,13 @@ help="x, y index of lower left corner (pixels, space-separated); if omitted, coa
             ctrPixInd = afwGeom.Point2I(ctrPixPos)
             llcPixInd = ctrPixInd - (dimensions / 2)
         self._coaddBBox = afwGeom.Box2I(llcPixInd, dimensions)
+
+        # use the footprint index, if any, to drop exposures that don't overlap the coadd
+        index = footprintIndex.getIndex(config)
+        if index is not None:
+            footprint = footprintIndex.SkyFootprint.fromWcs(self._coaddWcs, dimensions[0], dimensions[1],
+                                                            llcPixInd[0], llcPixInd[1])
+            self._idList = index.prune(self._idList, footprint)
         
         roots = config["roots"]
         self._coaddBasePath = os.path.join(roots["output"], opts.rerun)
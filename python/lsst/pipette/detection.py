@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+import math
+import numpy
+
+import lsst.afw.geom as afwGeom
+
+"""This module provides a cache of source detections, so that a CCD need only be detected once."""
+
+class FootprintSubset(object):
+    """A subset of the footprints in a FootprintSet
+
+    Quacks enough like a FootprintSet for measurement.
+    """
+    def __init__(self, footprints):
+        self._footprints = footprints
+
+    def getFootprints(self):
+        return self._footprints
+
+
+def peakSignificance(maskedImage, kernel, footprint):
+    """Matched-filter significance of the brightest peak in a footprint
+
+    This is the significance with which the peak appears in the image smoothed by the PSF, which is what
+    detection thresholds in units of the standard deviation.
+
+    @param maskedImage Masked image on which the footprint was detected
+    @param kernel Normalised PSF image, as a numpy array
+    @param footprint Footprint of interest
+    @return Significance (standard deviations)
+    """
+    image = maskedImage.getImage().getArray()
+    variance = maskedImage.getVariance().getArray()
+    height, width = image.shape
+    kHeight, kWidth = kernel.shape
+    x0, y0 = maskedImage.getX0(), maskedImage.getY0()
+
+    best = float("-inf")
+    for peak in footprint.getPeaks():
+        x, y = peak.getIx() - x0, peak.getIy() - y0
+        xMin, xMax = max(0, x - kWidth//2), min(width, x + kWidth//2 + 1)
+        yMin, yMax = max(0, y - kHeight//2), min(height, y + kHeight//2 + 1)
+        if xMin >= xMax or yMin >= yMax:
+            continue
+        k = kernel[yMin - y + kHeight//2:yMax - y + kHeight//2, xMin - x + kWidth//2:xMax - x + kWidth//2]
+        flux = numpy.sum(k * image[yMin:yMax, xMin:xMax])
+        noise = math.sqrt(numpy.sum(k * k * variance[yMin:yMax, xMin:xMax]))
+        if noise > 0 and flux / noise > best:
+            best = flux / noise
+    return best
+
+
+class DetectionCache(object):
+    """Cache of source detections on an exposure
+
+    Detection is run once, at the faintest threshold required, and brighter subsets are produced by
+    filtering on the matched-filter significance of each footprint's peak, rather than by re-convolving and
+    re-thresholding the image.
+
+    The cache is only used while the exposure and the PSF used for smoothing are unchanged.  The identity of
+    the exposure doesn't reveal changes to its pixels, so steps that modify the exposure in place (repair,
+    background subtraction) must call 'modified', which drops the cached detections.  In practice the cache
+    hits only when the PSF isn't measured and the background isn't subtracted in calibration, since
+    calibration otherwise detects only with its initial PSF, on the image before background subtraction.
+    """
+    def __init__(self, config, log, faintest=None):
+        """Initialisation
+
+        @param config Configuration (for detection policy)
+        @param log Log
+        @param faintest Faintest threshold multiplier that will be requested, or None to detect at the
+        threshold first requested
+        """
+        self.config = config
+        self.log = log
+        self._faintest = faintest
+        self._exposure = None
+        self._psf = None
+        self._multiplier = None
+        self._footprintSet = None
+        self._significance = None
+
+    def modified(self, exposure):
+        """Note that an exposure has been modified in place, so detections on it are stale
+
+        @param exposure Exposure that has been modified
+        """
+        if exposure is self._exposure and self._footprintSet is not None:
+            self.log.log(self.log.INFO, "Exposure modified: dropping cached detections")
+            self._exposure = None
+            self._psf = None
+            self._multiplier = None
+            self._footprintSet = None
+            self._significance = None
+
+    def detect(self, exposure, psf, thresholdMultiplier, detector):
+        """Detect sources, using the cache if possible
+
+        @param exposure Exposure to process
+        @param psf PSF for detection
+        @param thresholdMultiplier Multiplier for the detection threshold
+        @param detector Function(exposure, psf, thresholdMultiplier) that performs detection
+        @return Positive source footprints
+        """
+        if self.usable(exposure, psf, thresholdMultiplier):
+            return self.filter(exposure, psf, thresholdMultiplier)
+        if self._footprintSet is not None:
+            self.log.log(self.log.INFO, "Cached detections can't be used (PSF or threshold changed)")
+
+        multiplier = thresholdMultiplier
+        if self._faintest is not None and self._faintest < multiplier and self.filterable():
+            multiplier = self._faintest
+        footprintSet = detector(exposure, psf, multiplier)
+
+        self._exposure = exposure
+        self._psf = psf
+        self._multiplier = multiplier
+        self._footprintSet = footprintSet
+        self._significance = None
+
+        if multiplier == thresholdMultiplier:
+            return footprintSet
+        return self.filter(exposure, psf, thresholdMultiplier)
+
+    def filterable(self):
+        """Can detections be filtered by significance?"""
+        return self.config['detect']['thresholdType'].lower() == "stdev"
+
+    def usable(self, exposure, psf, thresholdMultiplier):
+        """Can the cached detections be used?
+
+        @param exposure Exposure to process
+        @param psf PSF for detection
+        @param thresholdMultiplier Multiplier for the detection threshold
+        """
+        if self._footprintSet is None or exposure is not self._exposure or psf is not self._psf:
+            return False
+        if thresholdMultiplier == self._multiplier:
+            return True
+        return thresholdMultiplier > self._multiplier and self.filterable()
+
+    def filter(self, exposure, psf, thresholdMultiplier):
+        """Return the cached footprints above a threshold
+
+        @param exposure Exposure on which footprints were detected
+        @param psf PSF for detection
+        @param thresholdMultiplier Multiplier for the detection threshold
+        @return Footprints above threshold
+        """
+        if thresholdMultiplier == self._multiplier:
+            return self._footprintSet
+
+        footprints = self._footprintSet.getFootprints()
+        if self._significance is None:
+            mi = exposure.getMaskedImage()
+            center = afwGeom.Point2D(mi.getX0() + 0.5 * mi.getWidth(), mi.getY0() + 0.5 * mi.getHeight())
+            kernel = psf.computeImage(center).getArray().astype(numpy.float64)
+            kernel /= kernel.sum()
+            self._significance = [peakSignificance(mi, kernel, foot) for foot in footprints]
+
+        threshold = thresholdMultiplier * self.config['detect']['thresholdValue']
+        subset = [foot for foot, sig in zip(footprints, self._significance) if sig >= threshold]
+        self.log.log(self.log.INFO, "Selected %d of %d cached detections above %g sigma" %
+                     (len(subset), len(footprints), threshold))
+        return FootprintSubset(subset)
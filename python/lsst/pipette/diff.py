@@ -21,36 +21,159 @@
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
 
+import math
+import numpy
+import multiprocessing
+import multiprocessing.pool
+
+import lsst.pex.exceptions as pexExcept
+import lsst.pex.logging as pexLog
+import lsst.afw.geom as afwGeom
 import lsst.afw.math as afwMath
 import lsst.afw.image as afwImage
 import lsst.ip.diffim as diffim
 import lsst.pipette.process as pipProc
+import lsst.pipette.templateCache as pipTemplateCache
 
 
 from lsst.pipette.calibrate import CalibratePsf
 from lsst.pipette.phot import Photometry
 
+_diffTileState = dict()                 # State for tiled PSF matching workers; inherited on fork
+
+def _matchTile(index):
+    """PSF-match a single tile for Diff.tiledMatch
+
+    @param index Index of tile in the list of tiles
+    @return index, and arrays (image, mask, variance) of the convolved template tile
+    """
+    state = _diffTileState
+    core, bbox = state['tiles'][index]
+    template = state['template'].Factory(state['template'], bbox, afwImage.PARENT, True)
+    input = state['input'].Factory(state['input'], bbox, afwImage.PARENT, True)
+    convolved = state['process'].match(template, input).getMaskedImage()
+    return index, (convolved.getImage().getArray().copy(), convolved.getMask().getArray().copy(),
+                   convolved.getVariance().getArray().copy())
+
 class Diff(pipProc.Process):
     def __init__(self, Calibrate=CalibratePsf, Photometry=Photometry, *args, **kwargs):
         super(Diff, self).__init__(*args, **kwargs)
         self._Calibrate = Calibrate
         self._Photometry = Photometry
 
-    def run(self, inputExp, templateExp, inverse=False):
+    def run(self, inputExp, templateExp, inverse=False, templateId=None, psf=None, apcorr=None,
+            butler=None, inputId=None):
         """Subtract a template exposure from an input exposure.
         The exposures are assumed to be aligned already
 
-        @param[in] inputExp Input exposure (minuend)
+        If do.diff.reusePsf, the PSF of the difference is taken from the input (see inputPsf), rather than
+        calibrating the mean of the input and convolved template.
+
+        @param[in] inputExp Input exposure (minuend); overwritten if do.diff.lean
         @param[in] templateExp Template exposure (subtrahend)        
         @param[in] inverse Invert sense of subtraction?
+        @param[in] templateId Identifier for template (for do.diff.cacheTemplate), or None
+        @param[in] psf PSF of input exposure (for do.diff.reusePsf), or None
+        @param[in] apcorr Aperture correction of input exposure (for do.diff.reusePsf), or None
+        @param[in] butler Data butler from which to read the PSF of the input (for do.diff.reusePsf), or None
+        @param[in] inputId Data identifier of the input (for do.diff.reusePsf), or None
         @return Subtracted exposure
         """
 
         do = self.config['do']['diff']
 
-        if True:
+        psf, apcorr = self.inputPsf(inputExp, psf, apcorr, butler=butler, inputId=inputId)
+
+        if do['lean']:
+            diff, psf, apcorr, brightSources = self.leanSubtract(inputExp, templateExp, inverse=inverse,
+                                                                 templateId=templateId, psf=psf, apcorr=apcorr)
+        elif psf is not None:
+            convolved = self.convolveTemplate(templateExp, inputExp, templateId=templateId)
+            diff = inputExp.Factory(inputExp, True)
+            diffImage = diff.getMaskedImage()
+            diffImage -= convolved.getMaskedImage()
+            del convolved
+            if inverse:
+                diffImage *= -1
+            brightSources = None
+        else:
+            convolved = self.convolveTemplate(templateExp, inputExp, templateId=templateId)
+            diff = inputExp.Factory(inputExp, True)
+            diffImage = diff.getMaskedImage()
+            convImage = convolved.getMaskedImage()
+            diffImage -= convImage
+            if inverse:
+                diffImage *= -1
+
+            combined = inputExp.Factory(inputExp, True)
+            combinedImage = combined.getMaskedImage()
+            combinedImage += convImage
+            combinedImage *= 0.5            # Get scaling right!
+            del convolved, convImage
+
+            psf, apcorr, brightSources = self.calibrate(combined)
+            del combined, combinedImage
+
+        sources, footprints = self.phot(diff, psf, apcorr)
+
+        self.display('diff', exposure=diff, sources=sources)
+
+        return diff, sources, psf, apcorr, brightSources
+
+    def inputPsf(self, inputExp, psf=None, apcorr=None, butler=None, inputId=None):
+        """Return the PSF and aperture correction of the input, if the difference is to use them
+
+        Since the template is convolved to match the input, the PSF of the difference is that of the input.
+        The PSF is, in order of preference: that provided; the persisted PSF of the input (the 'psf' dataset,
+        or 'diffpsf' if the input is itself a difference) read through the butler; or that attached to the
+        input exposure.
+
+        The PSF is not modelled as the template PSF convolved with the PSF-matching kernel: by construction
+        that is the input PSF, degraded by the noise in the kernel solution, and there is no PSF class to
+        carry a spatially-varying convolution of a PSF model with a kernel.
+
+        @param[in] inputExp Input exposure
+        @param[in] psf PSF of input exposure, or None to find it
+        @param[in] apcorr Aperture correction of input exposure, or None
+        @param[in] butler Data butler from which to read the PSF of the input, or None
+        @param[in] inputId Data identifier of the input, or None
+        @output PSF and aperture correction; the PSF is None if it is to be measured on the combined image
+        """
+        if not self.config['do']['diff']['reusePsf']:
+            return None, None
+        if psf is None and butler is not None and inputId is not None:
+            for datasetType in ("psf", "diffpsf"):
+                try:
+                    exists = butler.datasetExists(datasetType, inputId)
+                except Exception:
+                    exists = False      # Dataset not defined for this kind of identifier
+                if exists:
+                    self.log.log(self.log.INFO, "Reading %s for %s" % (datasetType, inputId))
+                    psf = butler.get(datasetType, inputId)
+                    break
+        if psf is None and inputExp.hasPsf():
+            psf = inputExp.getPsf()
+        if psf is None:
+            self.log.log(self.log.WARN, "No PSF available for input; calibrating the combined image")
+            return None, None
+        return psf, apcorr
+
+    def convolveTemplate(self, templateExp, inputExp, templateId=None):
+        """Convolve the template to match the input, as configured
+
+        @param[in] templateExp Template exposure
+        @param[in] inputExp Input exposure
+        @param[in] templateId Identifier for template (for do.diff.cacheTemplate), or None
+        @output Convolved template exposure, or the template itself if not convolving
+        """
+        do = self.config['do']['diff']
+        if do['match'] and do['convolve'] and self.tileSize() > 0:
+            convolved = self.tiledMatch(templateExp, inputExp)
+            if do['compare']:
+                self.compare(convolved, self.match(templateExp, inputExp, templateId=templateId))
+        elif True:
             if do['match'] and do['convolve']:
-                convolved = self.match(templateExp, inputExp)
+                convolved = self.match(templateExp, inputExp, templateId=templateId)
             else:
                 convolved = templateExp
         else:
@@ -65,46 +188,251 @@ class Diff(pipProc.Process):
                 convolved = self.convolve(templateExp, kernel)
             else:
                 convolved = templateExp
-        
-        diff = inputExp.Factory(inputExp, True)
+        return convolved
+
+    def leanSubtract(self, inputExp, templateExp, inverse=False, templateId=None, psf=None, apcorr=None):
+        """Subtract with the minimum of full-sized copies
+
+        The input exposure is overwritten with the difference, and the combined image (the mean of the input
+        and convolved template) used for PSF calibration is built in the pixels of the convolved template,
+        which is released after calibration.  Only the input, template and convolved template are ever held.
+
+        @param[in,out] inputExp Input exposure (minuend); overwritten with the difference
+        @param[in] templateExp Template exposure (subtrahend)
+        @param[in] inverse Invert sense of subtraction?
+        @param[in] templateId Identifier for template (for do.diff.cacheTemplate), or None
+        @param[in] psf PSF for the difference, or None to calibrate the combined image
+        @param[in] apcorr Aperture correction for the difference (if psf is provided)
+        @return Subtracted exposure, PSF, aperture correction, bright sources
+        """
+        convolved = self.convolveTemplate(templateExp, inputExp, templateId=templateId)
+        if psf is not None:
+            diff = inputExp
+            diffImage = diff.getMaskedImage()
+            diffImage -= convolved.getMaskedImage()
+            del convolved
+            if inverse:
+                diffImage *= -1
+            return diff, psf, apcorr, None
+
+        if convolved is templateExp:
+            # We don't own the template, so need our own pixels for the combined image
+            convolved = templateExp.Factory(templateExp, True)
+
+        diff = inputExp
         diffImage = diff.getMaskedImage()
-        convImage = convolved.getMaskedImage()
-        diffImage -= convImage
-        if inverse:
-            diffImage *= -1
+        diffImage -= convolved.getMaskedImage()
 
-        combined = inputExp.Factory(inputExp, True)
+        # combined = (input + convolved)/2 = convolved + diff/2; variance and mask follow from the difference
+        combined = convolved
+        del convolved
         combinedImage = combined.getMaskedImage()
-        combinedImage += convImage
-        combinedImage *= 0.5            # Get scaling right!
+        combinedImage.getImage().scaledPlus(0.5, diffImage.getImage())
+        combinedMask = combinedImage.getMask()
+        combinedMask <<= diffImage.getMask()
+        combinedVariance = combinedImage.getVariance()
+        combinedVariance <<= diffImage.getVariance()
+        combinedVariance *= 0.25
 
         psf, apcorr, brightSources = self.calibrate(combined)
+        del combined, combinedImage, combinedMask, combinedVariance
 
-        sources, footprints = self.phot(diff, psf, apcorr)
-
-        self.display('diff', exposure=diff, sources=sources)
+        if inverse:
+            diffImage *= -1
 
-        return diff, sources, psf, apcorr, brightSources
+        return diff, psf, apcorr, brightSources
 
-    def match(self, template, input):
+    def match(self, template, input, templateId=None):
         """Convolve template to match input
 
+        If do.diff.cacheTemplate and the template is identified, the candidate stamps found on it are cached
+        (see lsst.pipette.templateCache), so that subsequent inputs differenced against the same template only
+        need the kernel solution and convolution; the differential background is then added to the convolved
+        template, as part of the model for the input.  Otherwise, ImagePsfMatch.matchExposures is used.
+
         @param[in] template Template exposure
         @param[in] input Input exposure
+        @param[in] templateId Identifier for template (for do.diff.cacheTemplate), or None
         @output convolved template exposure
         """
         policy = self.config['diff'].getPolicy()
+        if templateId is not None and self.config['do']['diff']['cacheTemplate']:
+            cellSet = self.stamps(input, template, footprints=self.templateStamps(template, templateId))
+            kernel, bg = self.kernel(input, template, cellSet)
+            convolved = self.convolve(template, kernel)
+            convImage = convolved.getMaskedImage().getImage()
+            convImage += bg             # Differential background is part of the model for the input
+            return convolved
+
         matcher = diffim.ImagePsfMatch(policy)
         convolved, kernel, bg, cells = matcher.matchExposures(template, input, doWarping=False)
         # XXX dropping kernel, bg, cells on the floor
         return convolved
 
+    def tileSize(self):
+        """Size of tiles for PSF matching (0: whole image at once)"""
+        if not self.config.has_key('diffTile'):
+            return 0
+        return self.config['diffTile']['tileSize']
 
-    def stamps(self, exp1, exp2):
+    def tiles(self, bbox):
+        """Divide an image into overlapping tiles for PSF matching
+
+        @param[in] bbox Parent bounding box of image
+        @output List of tiles: core bounding box (tiling the image) and bounding box grown by the overlap
+        """
+        tileSize = self.tileSize()
+        overlap = self.config['diffTile']['overlap']
+        tiles = list()
+        for yMin in range(bbox.getMinY(), bbox.getMaxY() + 1, tileSize):
+            for xMin in range(bbox.getMinX(), bbox.getMaxX() + 1, tileSize):
+                core = afwGeom.Box2I(afwGeom.Point2I(xMin, yMin),
+                                     afwGeom.Point2I(min(xMin + tileSize - 1, bbox.getMaxX()),
+                                                     min(yMin + tileSize - 1, bbox.getMaxY())))
+                grown = afwGeom.Box2I(core)
+                grown.grow(overlap)
+                grown.clip(bbox)
+                tiles.append((core, grown))
+        return tiles
+
+    @staticmethod
+    def _ramp(coreMin, coreMax, grownMin, grownMax):
+        """Blending weights along one axis of a tile
+
+        Weights are unity over the core; in each overlap they are zero over the half nearest the edge of the
+        tile (which suffers from the convolution border) and rise linearly over the half nearest the core.
+        """
+        weight = numpy.ones(grownMax - grownMin + 1, dtype=numpy.float32)
+        lower = coreMin - grownMin
+        if lower > 0:
+            border = lower // 2
+            weight[:border] = 0.0
+            weight[border:lower] = (numpy.arange(lower - border) + 1.0) / (lower - border + 1.0)
+        upper = grownMax - coreMax
+        if upper > 0:
+            border = upper // 2
+            weight[len(weight) - border:] = 0.0
+            weight[len(weight) - upper:len(weight) - border] = \
+                (numpy.arange(upper - border, 0, -1)) / (upper - border + 1.0)
+        return weight
+
+    def tiledMatch(self, template, input):
+        """Convolve template to match input, tile by tile
+
+        Kernels are solved for overlapping tiles in parallel (diffTile.processes), and the convolved tiles are
+        blended in the overlaps.  Variances are blended with the squares of the weights, and masks are OR-ed
+        where a tile contributes.
+
+        @param[in] template Template exposure
+        @param[in] input Input exposure
+        @output convolved template exposure
+        """
+        bbox = template.getBBox(afwImage.PARENT)
+        tiles = self.tiles(bbox)
+        processes = self.config['diffTile']['processes']
+        if processes <= 0:
+            processes = multiprocessing.cpu_count()
+        numWorkers = min(processes, len(tiles))
+
+        convolved = template.Factory(bbox, template.getWcs())
+        convolved.setFilter(template.getFilter())
+        convolved.setCalib(template.getCalib())
+        mi = convolved.getMaskedImage()
+        image = mi.getImage().getArray()
+        mask = mi.getMask().getArray()
+        variance = mi.getVariance().getArray()
+        image.fill(0)
+        mask.fill(0)
+        variance.fill(0)
+        weightSum = numpy.zeros_like(image)
+
+        x0, y0 = bbox.getMinX(), bbox.getMinY()
+        def accumulate(index, arrays):
+            core, grown = tiles[index]
+            tileImage, tileMask, tileVariance = arrays
+            weight = numpy.outer(self._ramp(core.getMinY(), core.getMaxY(), grown.getMinY(), grown.getMaxY()),
+                                 self._ramp(core.getMinX(), core.getMaxX(), grown.getMinX(), grown.getMaxX()))
+            box = (slice(grown.getMinY() - y0, grown.getMaxY() - y0 + 1),
+                   slice(grown.getMinX() - x0, grown.getMaxX() - x0 + 1))
+            image[box] += weight * tileImage
+            variance[box] += weight**2 * tileVariance
+            weightSum[box] += weight
+            use = weight > 0
+            mask[box][use] |= tileMask[use]
+
+        _diffTileState.update(process=self, template=template, input=input, tiles=tiles)
+        try:
+            if numWorkers <= 1:
+                for index in range(len(tiles)):
+                    accumulate(*_matchTile(index))
+            else:
+                if multiprocessing.current_process().daemon:
+                    pool = multiprocessing.pool.ThreadPool(numWorkers)
+                else:
+                    pool = multiprocessing.Pool(numWorkers)
+                try:
+                    for index, arrays in pool.imap_unordered(_matchTile, range(len(tiles))):
+                        accumulate(index, arrays)
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            _diffTileState.clear()
+        self.log.log(self.log.INFO, "PSF-matched %d tiles with %d workers" % (len(tiles), numWorkers))
+
+        good = weightSum > 0
+        image[good] /= weightSum[good]
+        variance[good] /= weightSum[good]**2
+        return convolved
+
+    def compare(self, tiled, whole):
+        """Compare tiled and whole-image PSF matching, for validation
+
+        @param[in] tiled Template convolved by tiledMatch
+        @param[in] whole Template convolved by match
+        """
+        tiledImage = tiled.getMaskedImage()
+        wholeImage = whole.getMaskedImage()
+        badBits = afwImage.MaskU.getPlaneBitMask("EDGE")
+        good = (((tiledImage.getMask().getArray() | wholeImage.getMask().getArray()) & badBits) == 0)
+        residual = (tiledImage.getImage().getArray() - wholeImage.getImage().getArray())[good]
+        residual = residual[numpy.isfinite(residual)]
+        if len(residual) == 0:
+            self.log.log(self.log.WARN, "No good pixels to compare tiled and whole-image PSF matching")
+            return
+        noise = numpy.sqrt(numpy.median(wholeImage.getVariance().getArray()[good]))
+        self.log.log(self.log.INFO, "Tiled - whole-image PSF matching: %d pixels, rms %g, max %g (noise %g)" %
+                     (len(residual), math.sqrt((residual**2).mean()), numpy.abs(residual).max(), noise))
+
+    def templateStamps(self, template, templateId):
+        """Return the candidate PSF-matching stamps for a template, from the cache if possible
+
+        Stamps are found on the template alone, so they may be used for any input.
+
+        @param[in] template Template exposure
+        @param[in] templateId Identifier for template
+        @output List of stamp bounding boxes (parent frame)
+        """
+        policy = self.config['diff'].getPolicy()
+        cache = pipTemplateCache.getTemplateCache(self.config)
+        key = cache.key(templateId, template.getBBox(afwImage.PARENT), policy)
+        stamps = cache.get(key)
+        if stamps is None:
+            footprints = diffim.getCollectionOfFootprintsForPsfMatching(template, template, policy)
+            stamps = [afwGeom.Box2I(fp.getBBox()) for fp in footprints]
+            cache.put(key, stamps)
+            self.log.log(self.log.INFO, "Found %d stamps on template %s" % (len(stamps), templateId))
+        else:
+            self.log.log(self.log.INFO, "Using %d cached stamps for template %s" % (len(stamps), templateId))
+        return stamps
+
+    def stamps(self, exp1, exp2, footprints=None):
         """Find suitable stamps
 
-        @param[in] exp1 First exposure of interest
-        @param[in] exp2 Second exposure of interest
+        @param[in] exp1 First exposure of interest (input)
+        @param[in] exp2 Second exposure of interest (template)
+        @param[in] footprints List of candidate stamp bounding boxes (parent frame), or None to find them;
+                              candidates with bad pixels in the first exposure are rejected
         @output Cell set
         """
         policy = self.config['diff'].getPolicy()
@@ -119,22 +447,27 @@ class Diff(pipProc.Process):
                                                policy.getInt("sizeCellY"))
 
         # Candidate source footprints to use for Psf matching
-        footprints = diffim.getCollectionOfFootprintsForPsfMatching(exp2, exp1, policy)
+        if footprints is None:
+            footprints = [fp.getBBox() for fp in
+                          diffim.getCollectionOfFootprintsForPsfMatching(exp2, exp1, policy)]
+            badBits = 0
+        else:
+            badBits = afwImage.MaskU.getPlaneBitMask(policy.getArray("badMaskPlanes"))
 
         # Place candidate footprints within the spatial grid
-        for fp in footprints:
-            bbox = fp.getBBox()
+        exp1Box = exp1.getBBox(afwImage.PARENT)
+        for bbox in footprints:
+            if not exp1Box.contains(bbox):
+                continue
 
             # Grab the centers in the parent's coordinate system
             xC   = 0.5 * ( bbox.getMinX() + bbox.getMaxX() )
             yC   = 0.5 * ( bbox.getMinY() + bbox.getMaxY() )
 
-            # Since the footprint is in the parent's coordinate system,
-            # while the BBox uses the child's coordinate system.
-            bbox.shift(-afwGeom.Extent2I(exp2.getXY0()))
-
-            tmi  = afwImage.MaskedImageF(exp2, bbox)
-            smi  = afwImage.MaskedImageF(exp1, bbox)
+            tmi  = afwImage.MaskedImageF(exp2.getMaskedImage(), bbox, afwImage.PARENT)
+            smi  = afwImage.MaskedImageF(exp1.getMaskedImage(), bbox, afwImage.PARENT)
+            if badBits and (smi.getMask().getArray() & badBits).any():
+                continue
 
             cand = diffim.makeKernelCandidate(xC, yC, tmi, smi)
             kernelCellSet.insertCandidate(cand)
@@ -155,8 +488,10 @@ class Diff(pipProc.Process):
         # identification and kernel solution within the same function, while one might imagine overriding one
         # of these with some other method.
 
+        kernelCellSet = stamps
+
         # Object to perform the Psf matching on a source-by-source basis
-        kFunctor = createKernelFunctor(policy)
+        kFunctor = diffim.createKernelFunctor(policy)
 
         # Create the Psf matching kernel
         try:
@@ -194,8 +529,8 @@ class Diff(pipProc.Process):
         @param[in] kernel Kernel with which to convolve
         @output Convolved exposure
         """
-        convolved = exposure.Factory(exposure)
-        afwMath.convolve(convolved.getMaskedImage(), exposure.getMaskedImage(), kernel, false)
+        convolved = exposure.Factory(exposure, True)
+        afwMath.convolve(convolved.getMaskedImage(), exposure.getMaskedImage(), kernel, False)
         return convolved
 
     def calibrate(self, exposure):
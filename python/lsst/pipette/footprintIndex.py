@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+import os
+import math
+import json
+import sqlite3
+
+"""This module provides a persistent index of the sky footprints of CCD exposures, so that the exposures
+overlapping a patch of sky may be found without reading their headers."""
+
+indexBuffer = dict()                    # Buffer of open indices, by path
+_inheritedConnections = list()          # Connections inherited across a fork, not to be used or closed
+
+def getIndex(config):
+    """Return the footprint index nominated in the configuration (roots.index), or None"""
+    if not config.has_key('roots') or not config['roots'].has_key('index'):
+        return None
+    path = os.path.expanduser(config['roots']['index'])
+    if not indexBuffer.has_key(path):
+        indexBuffer[path] = FootprintIndex(path)
+    return indexBuffer[path]
+
+
+def _vector(ra, dec):
+    """Unit vector for a position (degrees)"""
+    ra, dec = math.radians(ra), math.radians(dec)
+    return (math.cos(dec) * math.cos(ra), math.cos(dec) * math.sin(ra), math.sin(dec))
+
+def _dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+def _cross(a, b):
+    return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+def _normalise(a):
+    norm = math.sqrt(_dot(a, a))
+    return (a[0] / norm, a[1] / norm, a[2] / norm)
+
+def _separation(a, b):
+    """Angular separation (degrees) between unit vectors"""
+    cross = _cross(a, b)
+    return math.degrees(math.atan2(math.sqrt(_dot(cross, cross)), _dot(a, b)))
+
+
+class SkyFootprint(object):
+    """Footprint of an exposure on the sky: a quadrilateral, with a bounding cap"""
+    def __init__(self, corners):
+        """Initialisation
+
+        @param corners List of (ra, dec) corners (degrees), in order around the quadrilateral
+        """
+        self.corners = [(float(ra), float(dec)) for ra, dec in corners]
+        self._vectors = [_vector(ra, dec) for ra, dec in self.corners]
+        self.center = _normalise(tuple(sum(v[i] for v in self._vectors) for i in range(3)))
+        self.radius = max(_separation(self.center, v) for v in self._vectors)
+
+    @staticmethod
+    def fromWcs(wcs, width, height, x0=0, y0=0):
+        """Footprint of an image with a WCS
+
+        @param wcs WCS for image
+        @param width, height Dimensions of image
+        @param x0, y0 Pixel coordinates of the lower-left corner
+        """
+        corners = list()
+        for x, y in ((x0, y0), (x0 + width, y0), (x0 + width, y0 + height), (x0, y0 + height)):
+            sky = wcs.pixelToSky(x, y)
+            corners.append((sky.getLongitude().asDegrees(), sky.getLatitude().asDegrees()))
+        return SkyFootprint(corners)
+
+    def getDec(self):
+        """Declination (degrees) of the centre of the bounding cap"""
+        return math.degrees(math.asin(max(-1.0, min(1.0, self.center[2]))))
+
+    def overlaps(self, other):
+        """Does this footprint overlap another?
+
+        Bounding caps are compared first; quadrilaterals that pass are compared in the gnomonic projection
+        about this footprint's centre, by searching for a separating axis.
+        """
+        if _separation(self.center, other.center) > self.radius + other.radius:
+            return False
+
+        # Basis for the tangent plane
+        pole = (0.0, 0.0, 1.0) if abs(self.center[2]) < 0.9 else (1.0, 0.0, 0.0)
+        east = _normalise(_cross(pole, self.center))
+        north = _cross(self.center, east)
+
+        polygons = list()
+        for vectors in (self._vectors, other._vectors):
+            points = list()
+            for v in vectors:
+                depth = _dot(v, self.center)
+                if depth <= 0.0:
+                    return True         # Can't project; be conservative
+                points.append((_dot(v, east) / depth, _dot(v, north) / depth))
+            polygons.append(points)
+
+        for points in polygons:
+            for i in range(len(points)):
+                x1, y1 = points[i]
+                x2, y2 = points[(i + 1) % len(points)]
+                axis = (y1 - y2, x2 - x1)
+                first = [axis[0] * x + axis[1] * y for x, y in polygons[0]]
+                second = [axis[0] * x + axis[1] * y for x, y in polygons[1]]
+                if max(first) < min(second) or max(second) < min(first):
+                    return False
+        return True
+
+
+class FootprintIndex(object):
+    """Persistent index of exposure sky footprints, keyed by data identifier
+
+    The index is an SQLite database, so that it may be built by concurrent processCcd runs.
+    """
+    def __init__(self, path, timeout=60.0):
+        """Initialisation
+
+        @param path Filename of index; created if it doesn't exist
+        @param timeout Time (sec) to wait for a concurrent writer
+        """
+        self.path = path
+        self.timeout = timeout
+        self._connection = None
+        self._pid = None
+        self._db.execute("CREATE TABLE IF NOT EXISTS footprints (dataId TEXT PRIMARY KEY, dec REAL, " +
+                         "x REAL, y REAL, z REAL, radius REAL, corners TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS footprintsDec ON footprints (dec)")
+        self._db.commit()
+
+    @property
+    def _db(self):
+        """Connection to the database, opened by this process
+
+        An SQLite connection must not be used across a fork, so a forked process (e.g., a pool worker) opens
+        its own.  The inherited connection is kept rather than closed, so the child doesn't disturb the
+        parent's use of it.
+        """
+        if self._pid != os.getpid():
+            if self._connection is not None:
+                _inheritedConnections.append(self._connection)
+            self._connection = sqlite3.connect(self.path, timeout=self.timeout)
+            self._pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def key(dataId):
+        """Key in index for a data identifier"""
+        return json.dumps(dataId, sort_keys=True)
+
+    @staticmethod
+    def dataId(key):
+        """Data identifier for a key in the index"""
+        dataId = dict()
+        for name, value in json.loads(key).iteritems():
+            if isinstance(value, unicode):
+                value = str(value)
+            dataId[str(name)] = value
+        return dataId
+
+    def add(self, dataId, footprint):
+        """Add (or replace) the footprint of an exposure
+
+        @param dataId Data identifier
+        @param footprint SkyFootprint of exposure
+        """
+        x, y, z = footprint.center
+        self._db.execute("INSERT OR REPLACE INTO footprints VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (self.key(dataId), footprint.getDec(), x, y, z, footprint.radius,
+                          json.dumps(footprint.corners)))
+        self._db.commit()
+
+    def addExposure(self, dataId, wcs, width, height):
+        """Add (or replace) the footprint of an exposure, given its WCS and dimensions"""
+        self.add(dataId, SkyFootprint.fromWcs(wcs, width, height))
+
+    def get(self, dataId):
+        """Return the footprint of an exposure, or None if it is not indexed"""
+        row = self._db.execute("SELECT corners FROM footprints WHERE dataId = ?",
+                               (self.key(dataId),)).fetchone()
+        if row is None:
+            return None
+        return SkyFootprint(json.loads(row[0]))
+
+    def __contains__(self, dataId):
+        return self._db.execute("SELECT 1 FROM footprints WHERE dataId = ?",
+                                (self.key(dataId),)).fetchone() is not None
+
+    def query(self, footprint):
+        """Return the data identifiers of all indexed exposures overlapping a footprint"""
+        maxRadius = self._db.execute("SELECT MAX(radius) FROM footprints").fetchone()[0]
+        if maxRadius is None:
+            return []
+        dec = footprint.getDec()
+        width = footprint.radius + maxRadius
+        rows = self._db.execute("SELECT dataId, corners FROM footprints WHERE dec BETWEEN ? AND ?",
+                                (dec - width, dec + width))
+        return [self.dataId(key) for key, corners in rows if
+                footprint.overlaps(SkyFootprint(json.loads(corners)))]
+
+    def prune(self, identList, footprint):
+        """Remove from a list the identifiers of exposures that don't overlap a footprint
+
+        Exposures that are not indexed are retained, since they can't be ruled out.
+
+        @param identList List of data identifiers
+        @param footprint SkyFootprint of interest
+        @return Pruned list of data identifiers
+        """
+        overlapping = set(self.key(dataId) for dataId in self.query(footprint))
+        indexed = set(key for key, in self._db.execute("SELECT dataId FROM footprints"))
+        return [ident for ident in identList if self.key(ident) in overlapping or
+                not self.key(ident) in indexed]
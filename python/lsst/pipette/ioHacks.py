@@ -3,6 +3,7 @@ import os, sys
 import numpy
 import pyfits
 import math
+import operator
 
 import lsst.afw.detection as afwDet
 import lsst.afw.geom      as afwGeom
@@ -91,10 +92,10 @@ def getSourceOutputListHsc(addRefFlux=False, simple=False):
 
 def getMatchOutputList():
     outlist = [
-        ["catId",     "getId",               None,                  "%8s",  "%08df",  int,   32, "K", 1, False, None],
-        ["catRa",     "getRa",               None,                  "%10s", "%10.6f", float, 64, "D", 1, True,  'deg'],
-        ["catDec",    "getDec",              None,                  "%10s", "%10.6f", float, 64, "D", 1, True,  'deg'],
-        ["catFlux",   "getPsfFlux",          None,                  "%8s",  "%8.3f",  float, 32, "E", 1, False, None],
+        ["catId",     "getId",               "setId",               "%8s",  "%08df",  int,   32, "K", 1, False, None],
+        ["catRa",     "getRa",               "setRa",               "%10s", "%10.6f", float, 64, "D", 1, True,  'deg'],
+        ["catDec",    "getDec",              "setDec",              "%10s", "%10.6f", float, 64, "D", 1, True,  'deg'],
+        ["catFlux",   "getPsfFlux",          "setPsfFlux",          "%8s",  "%8.3f",  float, 32, "E", 1, False, None],
         ["objId",     "getId",               "setId",               "%6s",  "%06d",   int,   32, "K", 0, False, None],
         ["objFlags",  "getFlagForDetection", "setFlagForDetection", "%6s",  "0x%04x", int,   16, "I", 0, False, None],
         ["ra",        "getRa",               "setRa",               "%10s", "%10.6f", float, 64, "D", 0, True,  'deg'],
@@ -106,156 +107,308 @@ def getMatchOutputList():
         ]
     return genOutputDict(outlist)
         
+def _outputGetter(output, side=False):
+    """Return a function(obj) that gets the value for an output from an object
+
+    @param output Output, from genOutputDict
+    @param side Is the object a SourceMatch, to get the value from the side nominated by the output?
+    Angles are returned in degrees.
+    """
+    getMethod = operator.methodcaller(output["get"])
+    if side:
+        getSide = operator.attrgetter("first" if output['side'] == 1 else "second")
+    else:
+        getSide = lambda s: s
+    if output['angle']:
+        return lambda s: getMethod(getSide(s)).asDegrees()
+    return lambda s: getMethod(getSide(s))
+
+###################################################################
+#
+# Columns are extracted from a list of objects in a single pass over the objects: each 'extractor' pulls a
+# group of values out of an object, and the values for an object are gathered into a row.  The rows are
+# converted to arrays in one go by numpy, rather than setting array elements one at a time.
+#
+# An extractor is a tuple of:
+# - function(obj) returning a list of values
+# - list of numpy dtype fields for the values: (name, type[, shape])
+# - list of FITS column definitions for the values: (name, format, unit)
+#
+###################################################################
+
+def extractColumns(objs, extractors):
+    """Extract columns of values from a list of objects, in a single pass over the objects
+
+    @param objs List of objects
+    @param extractors List of extractors
+    @return numpy record array, with a field for each column
+    """
+    dtype = numpy.dtype(sum([fields for function, fields, formats in extractors], []))
+    functions = [function for function, fields, formats in extractors]
+    rows = []
+    for obj in objs:
+        row = []
+        for function in functions:
+            row.extend(function(obj))
+        rows.append(tuple(row))
+    return numpy.array(rows, dtype=dtype)
+
+def fitsColumns(table, extractors):
+    """Return pyfits columns for the extractors, from the record array produced by extractColumns"""
+    return [pyfits.Column(name=name, format=format, unit=unit, array=table[name])
+            for function, fields, formats in extractors for name, format, unit in formats]
+
+def outputExtractor(outputs, side=False):
+    """Return an extractor for the values defined by the outputs structure
+
+    @param outputs Outputs structure, from genOutputDict
+    @param side Extract from SourceMatches, getting values from the side nominated by each output?
+    """
+    getters = [_outputGetter(out, side=side) for out in outputs]
+    fields = [(out["label"], out["dtype"]) for out in outputs]
+    formats = [(out["label"], out["fitstype"], out['units']) for out in outputs]
+
+    def extract(obj):
+        return [get(obj) for get in getters]
+
+    return extract, fields, formats
+
 def writeMatchListAsFits(matchList, fileName, log=NoLogging()):
     """ write matchList to a given filename with pyfits. """
 
     if matchList != None and len(matchList) > 0:
         nSource = len(matchList)
-        outputs = getMatchOutputList()
-        nOut = len(outputs)
-
-        log.log(log.DEBUG, "Writing %d matches" % nOut)
-
-        # create the arrays and fill them
-        arrays = {}
-        for i in range(nOut):
-            columnName = outputs[i]["label"]
-            arrays[columnName] = numpy.zeros(nSource, dtype=outputs[i]["dtype"])
-
-        for i in range(nOut):
-            columnName = outputs[i]["label"]
-            isangle = outputs[i]['angle']
-            for j,sourceMatch in enumerate(matchList):
-                s1 = sourceMatch.first
-                s2 = sourceMatch.second
-                if outputs[i]['side'] == 1:
-                    s = s1              # catalog
-                else:
-                    s = s2              # source
-                getMethod = getattr(s, outputs[i]["get"])
-                X = getMethod()
-                if isangle:
-                    arrays[columnName][j] = X.asDegrees()
-                else:
-                    arrays[columnName][j] = X
-
-        # create the column defs
-        columnDefs = []
-        for i in range(nOut):
-            columnName = outputs[i]["label"]
-            columnDefs.append(pyfits.Column(name=columnName,
-                                            format=outputs[i]["fitstype"],
-                                            unit=outputs[i]['units'],
-                                            array=arrays[columnName]))
-
-        tabhdu = pyfits.new_table(columnDefs, nrows=nSource)
+        extractors = [outputExtractor(getMatchOutputList(), side=True)]
+
+        log.log(log.DEBUG, "Writing %d matches" % nSource)
+
+        table = extractColumns(matchList, extractors)
+        tabhdu = pyfits.new_table(fitsColumns(table, extractors), nrows=nSource)
         hdulist = pyfits.HDUList([pyfits.PrimaryHDU(), tabhdu])
         hdulist.writeto(fileName, clobber=True)
 
 
 ###############################################################################
 #
-# read data from a FITS file with pyfits, and load the values into a SourceSet.
+# read data from a FITS file with pyfits, as a columnar catalog view.
+#
+# The columns are numpy arrays straight from the FITS table (optionally memory-mapped); Sources are only
+# constructed when they are requested.
 #
 ###############################################################################
-def readSourcesetFromFits(baseName, hdrKeys=[], outputStyle="hsc"):
 
-    fits = pyfits.open("%s.fits" % (baseName))
+def getOutputList(outputStyle="hsc"):
+    """Return the outputs structure for reading sources in the nominated style"""
+    if outputStyle == "hsc":
+        return getSourceOutputListHsc()
+    if outputStyle == "simple":
+        return getSourceOutputListHsc(simple=True)
+    raise RuntimeError("Unrecognised output style: %s" % outputStyle)
+
+def _openTable(fileName, memmap=False):
+    """Open a FITS table
+
+    @param fileName Name of file, or file-like object
+    @param memmap Memory-map the table?
+    @return table data, primary header, and the HDUList if it has been left open for memory-mapping
+    """
+    fits = pyfits.open(fileName, memmap=memmap)
     hdu = 1
     data = fits[hdu].data
     hdr = fits[0].header
+    if memmap:
+        return data, hdr, fits
     fits.close()
+    return data, hdr, None
 
-    outputs = getOutputList(outputStyle)
-    nOut = len(outputs)
 
-    # get any requested hdrs
-    hdrInfo = {}
-    for hdrKey in hdrKeys:
-        hdrInfo[hdrKey] = hdr[hdrKey]
-
-    sourceSet = afwDet.SourceSet()
-    for i in range(len(data)):
+class FitsCatalog(object):
+    """Columnar view of a catalog in a FITS table
 
-        source = afwDet.Source()
-        sourceSet.append(source)
-
-        for j in range(nOut):
-            setMethod = getattr(source, outputs[j]["set"])
-            thistype = outputs[j]["pytype"]
-            value = data[i].field(outputs[j]["label"])
-            if outputs[j]['angle']:
-                setMethod(value * afwGeom.degrees)
+    Columns are numpy arrays, got by name with catalog.field(name) or catalog[name].  Rows are turned into
+    objects only when they are requested, by index (catalog[i]) or by iterating; objects are constructed
+    afresh for each request, so changing them doesn't change the catalog.  Subclasses define the objects
+    constructed, by overriding _make.
+    """
+    BLOCK = 1024                        # Number of rows to convert at once when iterating
+
+    def __init__(self, data, outputs, header=None, fits=None):
+        """Initialisation
+
+        @param data FITS table data (pyfits record array)
+        @param outputs Outputs structure, from genOutputDict, defining the columns to set in the objects
+        @param header Primary header
+        @param fits HDUList holding the memory-mapped data, or None
+        """
+        self.data = data
+        self.header = header
+        self._fits = fits
+        self._outputs = outputs
+        names = [name.lower() for name in data.names]
+        # Setters for the columns present: (side, set method name, column, python type, angle?)
+        self._setters = [(out['side'], out["set"], data.field(out["label"]), out["pytype"], out['angle'])
+                         for out in outputs if out["set"] is not None and out["label"].lower() in names]
+
+    def __len__(self):
+        return len(self.data)
+
+    def names(self):
+        """Return the names of the columns"""
+        return list(self.data.names)
+
+    def field(self, name):
+        """Return a column, as a numpy array"""
+        return self.data.field(name)
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            return self.field(key)
+        if isinstance(key, slice):
+            return self.select(key)
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError("Row %d is out of range for catalog of %d rows" % (key, len(self)))
+        return self._make([column[key] for side, setName, column, pytype, angle in self._setters])
+
+    def __iter__(self):
+        for start in xrange(0, len(self), self.BLOCK):
+            # Converting a block of each column to a list at once is much faster than indexing each element
+            block = [column[start:start + self.BLOCK].tolist() for
+                     side, setName, column, pytype, angle in self._setters]
+            for values in zip(*block):
+                yield self._make(values)
+
+    def select(self, selection):
+        """Return a catalog of the selected rows
+
+        @param selection Slice, boolean array or array of indices (e.g., numpy.where(catalog['f_psf'] > 0))
+        """
+        return self.__class__(self.data[selection], self._outputs, header=self.header, fits=self._fits)
+
+    def close(self):
+        """Close the file holding the memory-mapped data; the catalog cannot be used afterwards"""
+        if self._fits is not None:
+            self._fits.close()
+            self._fits = None
+
+    def _set(self, obj, side, values):
+        """Set the values for the nominated side in an object"""
+        for (setSide, setName, column, pytype, angle), value in zip(self._setters, values):
+            if setSide != side:
+                continue
+            setMethod = getattr(obj, setName)
+            if angle:
+                setMethod(float(value) * afwGeom.degrees)
             else:
                 try:
-                    setMethod(thistype(value))
+                    setMethod(pytype(value))
                 except:
-                    setMethod(thistype("nan"))
+                    setMethod(pytype("nan"))
 
+    def _make(self, values):
+        """Construct an object from the values of a row, in the order of the setters"""
+        raise NotImplementedError("Subclasses must define _make")
 
 
-    #################################################
-    # input the matchlist
-    ################################################
-    matchList = readMatchListFits(baseName, outputStyle)
+class SourceCatalog(FitsCatalog):
+    """Columnar view of a catalog of sources; rows are constructed as Sources"""
 
-    return sourceSet, matchList, hdrInfo
+    def _make(self, values):
+        source = afwDet.Source()
+        self._set(source, 0, values)
+        return source
 
+    def getSourceSet(self):
+        """Return a SourceSet with all the sources"""
+        sourceSet = afwDet.SourceSet()
+        for source in self:
+            sourceSet.append(source)
+        return sourceSet
 
-###############################################################################
-#
-# read match lists from a FITS file with pyfits
-#
-###############################################################################
-def readMatchListFits(baseName, outputStyle="hsc"):
 
-    #################################################
-    # input the matchlist
-    # Unless basename is an instance of str,
-    # it is assumed to be an `file-like' object
-    ################################################
+class MatchCatalog(FitsCatalog):
+    """Columnar view of a catalog of matches; rows are constructed as SourceMatches
 
-    matchList = []
+    The first of the match is the catalog (reference) source, and the second is the measured source.
+    """
 
-    if isinstance(baseName, str):
-        if os.path.exists("%s.match.fits" % (baseName)):
-            fits = pyfits.open("%s.match.fits" % (baseName))
-        else:
-            fits = None
-    else:
-        # baseName is actually an file-like object
-        fits = pyfits.open(baseName)
+    def _make(self, values):
+        s1 = afwDet.Source()
+        s2 = afwDet.Source()
+        self._set(s1, 1, values)
+        self._set(s2, 0, values)
+        return afwDet.SourceMatch(s1, s2, 0.0)
+
+    def getMatchList(self):
+        """Return a list with all the matches"""
+        return list(self)
+
+
+def readSourceCatalog(fileName, outputStyle="hsc", memmap=False):
+    """Read sources from a FITS file as a columnar catalog view
+
+    @param fileName Name of file
+    @param outputStyle Style of outputs for the sources (see getOutputList)
+    @param memmap Memory-map the table?  The catalog should be closed when finished.
+    """
+    data, hdr, fits = _openTable(fileName, memmap=memmap)
+    return SourceCatalog(data, getOutputList(outputStyle), header=hdr, fits=fits)
+
+def readMatchCatalog(fileName, memmap=False):
+    """Read matches from a FITS file as a columnar catalog view
+
+    @param fileName Name of file, or file-like object
+    @param memmap Memory-map the table?  The catalog should be closed when finished.
+    """
+    data, hdr, fits = _openTable(fileName, memmap=memmap)
+    return MatchCatalog(data, getMatchOutputList(), header=hdr, fits=fits)
 
-    if fits:
+def readCatalogsFromFits(baseName, hdrKeys=[], outputStyle="hsc", memmap=False):
+    """Read sources and matches (if present) from FITS files as columnar catalog views
 
-        hdu = 1
-        data = fits[hdu].data
-        fits.close()
+    @param baseName Base name of files: the sources are in baseName.fits and the matches in baseName.match.fits
+    @param hdrKeys Keywords to get from the primary header of the sources
+    @param outputStyle Style of outputs for the sources (see getOutputList)
+    @param memmap Memory-map the tables?  The catalogs should be closed when finished.
+    @return source catalog, match catalog (or None), dict of header values
+    """
+    sources = readSourceCatalog("%s.fits" % (baseName), outputStyle=outputStyle, memmap=memmap)
+
+    # get any requested hdrs
+    hdrInfo = {}
+    for hdrKey in hdrKeys:
+        hdrInfo[hdrKey] = sources.header[hdrKey]
+
+    matches = None
+    if os.path.exists("%s.match.fits" % (baseName)):
+        matches = readMatchCatalog("%s.match.fits" % (baseName), memmap=memmap)
 
-        outputs = getOutputList(outputStyle)
-        nOut = len(outputs)
+    return sources, matches, hdrInfo
 
-        for i in range(len(data)):
+def readSourcesetFromFits(baseName, hdrKeys=[], outputStyle="hsc"):
+    """Read sources and matches from FITS files, constructing a SourceSet and match list
 
-            s1 = afwDet.Source()
-            s2 = afwDet.Source()
-            matchList.append(afwDet.SourceMatch(s1, s2, 0.0))
+    Use readCatalogsFromFits if not all the Sources are needed.
+    """
+    sources, matches, hdrInfo = readCatalogsFromFits(baseName, hdrKeys=hdrKeys, outputStyle=outputStyle)
+    matchList = matches.getMatchList() if matches is not None else []
+    return sources.getSourceSet(), matchList, hdrInfo
 
-            for j in range(nOut):
-                if outputs[j]['label'] in ['ra','dec']:
-                    s = s1
-                else:
-                    s = s2
+def readMatchListFits(baseName, outputStyle="hsc"):
+    """Read a match list from a FITS file
 
-                setMethod = getattr(s, outputs[j]["set"])
-                thistype = outputs[j]["pytype"]
-                value = data[i].field(outputs[j]["label"])
-                if outputs[j]['angle']:
-                    setMethod(value * afwGeom.degrees)
-                else:
-                    setMethod(thistype(value))
+    Unless baseName is an instance of str, it is assumed to be a `file-like' object; otherwise the matches
+    are read from baseName.match.fits, if it exists.
 
-    return matchList
+    The outputStyle is accepted for compatibility, but ignored: the columns of a match list are always those
+    of getMatchOutputList, which are what writeMatchListAsFits writes.
+    """
+    if isinstance(baseName, str):
+        if not os.path.exists("%s.match.fits" % (baseName)):
+            return []
+        baseName = "%s.match.fits" % (baseName)
+    return readMatchCatalog(baseName).getMatchList()
 
 class SchemaDuck(object):
     """ Pretend to be a Schema. Unused for now, because we need to access the schema
@@ -322,116 +475,99 @@ def getValue(measurement,               # Meaurement from which to get value
     return value
 
 
+def _schemaGetter(entry):
+    """Return a function(measurement) that gets the value for a schema entry"""
+    if entry.isArray():
+        indices = range(entry.getDimen())
+        return lambda measurement: [measurement.get(i, entry) for i in indices]
+    return lambda measurement: getValue(measurement, entry)
+
+
 def getFitsColumns(sourceSet, outputs):
     """ Return pyfits columns defined by the outputs structure.
 
     This is hopefully temporary, until schemas define everything
     we want to write. It uses the existing io.writeFits data structures.
     """
+    extractors = [outputExtractor(outputs)]
+    return fitsColumns(extractColumns(sourceSet, extractors), extractors)
 
-    nSource = len(sourceSet)
-    nOut = len(outputs)
-
-    # create the arrays and fill them
-    arrays = {}
-    for i in range(nOut):
-        columnName = outputs[i]["label"]
-        arrays[columnName] = numpy.zeros(nSource, dtype=outputs[i]["dtype"])
-
-        for j,source in enumerate(sourceSet):
-            getMethod = getattr(source, outputs[i]["get"])
-            X = getMethod()
-            if outputs[i]['angle']:
-                X = X.asDegrees()
-            arrays[columnName][j] = X
-
-    # create the column defs
-    columnDefs = []
-    for i in range(nOut):
-        columnName = outputs[i]["label"]
-        columnDefs.append(pyfits.Column(name=columnName,
-                                        format=outputs[i]["fitstype"],
-                                        unit=outputs[i]['units'],
-                                        array=arrays[columnName]))
-    return columnDefs
 
-    
-def schema2pyfits(objs, schemaNamePrefix, getterName, log=NoLogging()):
-    """ Return pyfits Columns for all the schema entries """
+def schemaExtractor(obj, schemaNamePrefix, getterName, log=NoLogging()):
+    """ Return an extractor for all the schema entries
 
-    nobj = len(objs)
-    if nobj == 0:
-        raise RuntimeError("If you need to construct a FITS table from an empty list, do it yourself...")
-    
-    npCols = []
-    colSchemas = []
-    colNames = []
-    getter = getattr(objs[0], getterName)
+    The schema is read from the measurements of the provided object, and is assumed to be the same for all
+    objects.  The measurements are got from each object only once.
+    """
+
+    getter = operator.methodcaller(getterName)
     log.log(log.DEBUG, "Getting schema for %s with %s" % (schemaNamePrefix, getterName))
-    values = getter()
-    for i, val in enumerate(values):
+    entryGetters = []                   # List of getters for the schema entries, for each measurement
+    fields = []
+    formats = []
+    for val in getter(obj):
         if hasattr(val, 'getAlgorithm'):
             # "getAlgorithm" is the camel's nose under the tent of abstraction -- CPL
             schemaName = "%s_%s" % (schemaNamePrefix, val.getAlgorithm())
         else:
             schemaName = schemaNamePrefix
-            
+
+        getters = []
         for s in val.getSchema():
             # Need to recurse? CPL
             try:
                 fitsType = schema2FitsTypes[s.getType()]
                 numpyType = schema2NumpyTypes[s.getType()]
             except KeyError:
-                raise RuntimeError("schema type %s does not (yet) have a corresponding FITS type.")
-            
-            if s.isArray():
-                n = s.getDimen()
-                numpyType = '%d%s' % (n, numpyType)
-                print "WARNING!!!!! schema arrays have not been tested yet!"
-            else:
-                n = 1
+                raise RuntimeError("schema type %s does not (yet) have a corresponding FITS type." %
+                                   s.getType())
 
-            npCols.append(numpy.zeros(nobj, dtype=numpyType))
-            colSchemas.append(s)
             if schemaName:
                 colName = "%s_%s" % (schemaName, s.getName())
             else:
                 colName = s.getName()
             # A better behaved person might do: colName = colName.lower()
-            colNames.append(colName)
-    log.log(log.DEBUG, "Column names for %s: %s" % (schemaNamePrefix, ",".join(colNames)))
-
-    for i in range(nobj):
-        getter = getattr(objs[i], getterName)
-        s_i = 0
-        for val in getter():
-            for s in val.getSchema():
-                # I'm guessing about arrays in schemas. -- CPL
-                if s.isArray():
-                    for v_i in range(s.getDimen()):
-                        npCols[s_i][i][v_i] = val.get(v_i, s)
-                else:
-                    npCols[s_i][i] = getValue(val, s)
-                s_i += 1
 
-    log.log(log.DEBUG, "Generating columns for %s" % schemaNamePrefix)
-    fitsCols = []
-    for npCol, colSchema, colName in zip(npCols, colSchemas, colNames):
-        fitsType = schema2FitsTypes[colSchema.getType()]
-        if colSchema.isArray():
-            fitsType = "%d%s" % (s.getDimen(), fitsType)
-
-        col = pyfits.Column(name=colName,
-                            format=fitsType,
-                            unit=colSchema.getUnits(),
-                            array=npCol)
-        fitsCols.append(col)
+            if s.isArray():
+                n = s.getDimen()
+                fields.append((colName, numpyType, (n,)))
+                fitsType = "%d%s" % (n, fitsType)
+                print "WARNING!!!!! schema arrays have not been tested yet!"
+            else:
+                fields.append((colName, numpyType))
+            formats.append((colName, fitsType, s.getUnits()))
+            getters.append(_schemaGetter(s))
+        entryGetters.append(getters)
+    log.log(log.DEBUG, "Column names for %s: %s" % (schemaNamePrefix,
+                                                    ",".join([name for name, format, unit in formats])))
+
+    def extract(obj):
+        values = []
+        for val, getters in zip(getter(obj), entryGetters):
+            values.extend([get(val) for get in getters])
+        return values
 
+    return extract, fields, formats
+
+
+def schema2pyfits(objs, schemaNamePrefix, getterName, log=NoLogging()):
+    """ Return pyfits Columns for all the schema entries """
+
+    nobj = len(objs)
+    if nobj == 0:
+        raise RuntimeError("If you need to construct a FITS table from an empty list, do it yourself...")
+
+    extractors = [schemaExtractor(objs[0], schemaNamePrefix, getterName, log=log)]
+    log.log(log.DEBUG, "Generating columns for %s" % schemaNamePrefix)
+    fitsCols = fitsColumns(extractColumns(objs, extractors), extractors)
     log.log(log.DEBUG, "Done parsing schema for %s" % schemaNamePrefix)
     return fitsCols
 
 def writeSourceSetAsFits(sourceSet, filename, hdrInfo=[], clobber=False, log=NoLogging()):
-    """Write a SourceSet as a FITS file. Crawls the Scheme for most columns, uses manual hacks for the rest. """
+    """Write a SourceSet as a FITS file. Crawls the Scheme for most columns, uses manual hacks for the rest.
+
+    All the columns are extracted in a single pass over the sources.
+    """
     log.log(log.DEBUG, "Writing source FITS table...")
 
     if not sourceSet:
@@ -443,17 +579,18 @@ def writeSourceSetAsFits(sourceSet, filename, hdrInfo=[], clobber=False, log=NoL
                         ("photometry", "getPhotometry"),
                         ("shape", "getShape"),
                         )
-    columns = []
 
     # Start with hacky manual columns
     log.log(log.DEBUG, "Adding manual columns...")
-    columns.extend(getFitsColumns(sourceSet, getSourceOutputListHsc(addRefFlux=True)))
-                   
+    extractors = [outputExtractor(getSourceOutputListHsc(addRefFlux=True))]
+
     # Add in nice schema-based columns
     for measureType, getterName in measurementTypes:
         log.log(log.DEBUG, "Parsing schema from %s..." % getterName)
-        fitsCols = schema2pyfits(sourceSet, measureType, getterName, log=log)
-        columns.extend(fitsCols)
+        extractors.append(schemaExtractor(source, measureType, getterName, log=log))
+
+    log.log(log.DEBUG, "Extracting columns from %d sources..." % len(sourceSet))
+    columns = fitsColumns(extractColumns(sourceSet, extractors), extractors)
 
     log.log(log.DEBUG, "Opening table with %d columns..." % len(columns))
     tblHdu = pyfits.new_table(columns)
@@ -475,5 +612,5 @@ def writeSourceSetAsFits(sourceSet, filename, hdrInfo=[], clobber=False, log=NoL
 
 def readSourceSetFromFits(filename):
     """Read a SourceSet from a FITS file"""
-    raise NotImplementedError("some other day...")
+    return readSourceCatalog(filename).getSourceSet()
 
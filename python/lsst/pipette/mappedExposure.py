@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+import json
+import numpy
+
+import lsst.daf.base as dafBase
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
+
+"""This module provides a raw, memory-mappable store for intermediate exposures (e.g., warps for coaddition).
+
+Each exposure is stored as one file per plane (image, mask, variance), holding the pixels in C order, with a
+JSON sidecar holding the bounding box, data types, WCS and filter, and any extra values provided by the
+writer.  Reading a subregion is then a view on the memory-mapped planes.
+
+Statistics of the pixels (see PixelStatistics) may be gathered as the planes are written, so that weights,
+coverage and mask summaries are available from the sidecar without reading the pixels again.
+"""
+
+PLANES = ("image", "mask", "variance")
+CHUNK_ROWS = 64                         # Number of rows written (and measured) at once
+
+IQ_TO_STDEV = 0.741301109               # Conversion from interquartile range to standard deviation (Gaussian)
+
+class PixelStatistics(object):
+    """Statistics of the pixels of an exposure, accumulated a block of rows at a time
+
+    The mean variance is clipped over the whole image as for lsst.afw.math.MEANCLIP: the first iteration
+    clips about the median with a width from the interquartile range, and subsequent iterations about the
+    clipped mean with the clipped standard deviation.  So that the pixels are visited only once, the good
+    variances are accumulated in a histogram (bins of 1/binsPerDecade in log10) holding the count, sum and
+    sum of squares in each bin, and the clipping is done on the histogram.
+
+    Results (see getResults):
+    - meanVariance: clipped mean variance of good pixels (NaN if there are none)
+    - coverage: number of good pixels (not masked as bad, with finite image and positive finite variance)
+    - maskCounts: dict of mask plane name: number of pixels with that plane set
+    """
+    def __init__(self, badPixelMask, maskPlanes, numSigmaClip=3.0, numIter=2, binsPerDecade=10000):
+        """Initialisation
+
+        @param badPixelMask Mask bits for pixels to ignore
+        @param maskPlanes dict of mask plane name: bit number
+        @param numSigmaClip Clipping threshold for the mean variance
+        @param numIter Number of clipping iterations for the mean variance
+        @param binsPerDecade Resolution of the histogram of variances
+        """
+        self.badPixelMask = badPixelMask
+        self.maskPlanes = maskPlanes
+        self.numSigmaClip = numSigmaClip
+        self.numIter = numIter
+        self.binsPerDecade = binsPerDecade
+        self._binMin = None             # Index of the first bin of the histogram
+        self._counts = numpy.zeros(0, dtype=numpy.int64)
+        self._sums = numpy.zeros(0, dtype=numpy.float64)
+        self._sumSquares = numpy.zeros(0, dtype=numpy.float64)
+        self._coverage = 0
+        self._maskCounts = dict((name, 0) for name in maskPlanes)
+
+    def add(self, image, mask, variance):
+        """Accumulate a block of pixels (arrays)"""
+        for name, bit in self.maskPlanes.iteritems():
+            self._maskCounts[name] += int(numpy.count_nonzero(mask & (1 << bit)))
+        good = ((mask & self.badPixelMask) == 0) & numpy.isfinite(image) & numpy.isfinite(variance) & \
+               (variance > 0)
+        values = variance[good].astype(numpy.float64)
+        self._coverage += len(values)
+        if len(values) == 0:
+            return
+
+        index = numpy.floor(numpy.log10(values) * self.binsPerDecade).astype(numpy.int64)
+        low, high = int(index.min()), int(index.max())
+        if self._binMin is None:
+            self._binMin = low
+        if low < self._binMin:
+            self._extend(self._binMin - low, 0)
+            self._binMin = low
+        if high >= self._binMin + len(self._counts):
+            self._extend(0, high - self._binMin - len(self._counts) + 1)
+        index -= self._binMin
+        num = len(self._counts)
+        self._counts += numpy.bincount(index, minlength=num)
+        self._sums += numpy.bincount(index, weights=values, minlength=num)
+        self._sumSquares += numpy.bincount(index, weights=values**2, minlength=num)
+
+    def _extend(self, before, after):
+        """Extend the histogram by a number of bins before and after"""
+        self._counts = numpy.concatenate((numpy.zeros(before, dtype=numpy.int64), self._counts,
+                                          numpy.zeros(after, dtype=numpy.int64)))
+        self._sums = numpy.concatenate((numpy.zeros(before), self._sums, numpy.zeros(after)))
+        self._sumSquares = numpy.concatenate((numpy.zeros(before), self._sumSquares, numpy.zeros(after)))
+
+    def _meanVariance(self):
+        """Clipped mean of the variances in the histogram"""
+        use = self._counts > 0
+        counts, sums, sumSquares = self._counts[use], self._sums[use], self._sumSquares[use]
+        if len(counts) == 0:
+            return float("nan")
+        values = sums / counts          # Representative value for each bin
+        cumulative = numpy.cumsum(counts)
+        quantile = lambda q: values[min(numpy.searchsorted(cumulative, q * cumulative[-1]), len(values) - 1)]
+
+        center = quantile(0.5)
+        width = self.numSigmaClip * IQ_TO_STDEV * (quantile(0.75) - quantile(0.25))
+        mean = float("nan")
+        for i in range(self.numIter):
+            keep = numpy.abs(values - center) <= width
+            num = counts[keep].sum()
+            if num == 0:
+                break
+            mean = sums[keep].sum() / num
+            variance = max(sumSquares[keep].sum() / num - mean**2, 0.0) * num / (num - 1) if num > 1 else 0.0
+            center, width = mean, self.numSigmaClip * numpy.sqrt(variance)
+        return float(mean)
+
+    def getResults(self):
+        """Return dict of results"""
+        return dict(meanVariance=self._meanVariance(), coverage=self._coverage,
+                    maskCounts=dict(self._maskCounts))
+
+
+def _planeArrays(exposure):
+    """Arrays of the planes of an exposure"""
+    mi = exposure.getMaskedImage()
+    return dict(image=mi.getImage().getArray(), mask=mi.getMask().getArray(),
+                variance=mi.getVariance().getArray())
+
+def _pixelStatistics(exposure, badPixelMask):
+    """PixelStatistics for an exposure"""
+    return PixelStatistics(badPixelMask, exposure.getMaskedImage().getMask().getMaskPlaneDict())
+
+def exposureStatistics(exposure, badPixelMask):
+    """Measure the statistics of an exposure (see PixelStatistics), for exposures that aren't being written
+
+    @param exposure Exposure to measure
+    @param badPixelMask Mask bits for pixels to ignore
+    @return dict of statistics
+    """
+    arrays = _planeArrays(exposure)
+    stats = _pixelStatistics(exposure, badPixelMask)
+    height = exposure.getHeight()
+    for y in range(0, height, CHUNK_ROWS):
+        stats.add(*[arrays[name][y:y + CHUNK_ROWS] for name in PLANES])
+    return stats.getResults()
+
+def writeMappedExposure(exposure, path, extra=None, badPixelMask=None):
+    """Write an exposure in the memory-mappable format
+
+    @param exposure Exposure to write
+    @param path Base path for the files; an extension is added for each plane and the sidecar
+    @param extra Dict of additional (JSON-serialisable) values to record in the sidecar
+    @param badPixelMask Mask bits for pixels to ignore in statistics, or None to skip statistics
+    @return dict of statistics (see PixelStatistics), or None
+    """
+    mi = exposure.getMaskedImage()
+    arrays = _planeArrays(exposure)
+    stats = _pixelStatistics(exposure, badPixelMask) if badPixelMask is not None else None
+    files = dict((name, open("%s.%s" % (path, name), "wb")) for name in PLANES)
+    try:
+        for y in range(0, mi.getHeight(), CHUNK_ROWS):
+            chunks = [arrays[name][y:y + CHUNK_ROWS] for name in PLANES]
+            for name, chunk in zip(PLANES, chunks):
+                numpy.ascontiguousarray(chunk).tofile(files[name])
+            if stats is not None:
+                stats.add(*chunks)
+    finally:
+        for fd in files.itervalues():
+            fd.close()
+    if stats is not None:
+        stats = stats.getResults()
+
+    wcs = dict()
+    if exposure.getWcs() is not None:
+        md = exposure.getWcs().getFitsMetadata()
+        for name in md.names():
+            wcs[name] = md.get(name)
+
+    sidecar = dict(x0=mi.getX0(), y0=mi.getY0(), width=mi.getWidth(), height=mi.getHeight(),
+                   dtypes=dict((name, arrays[name].dtype.str) for name in PLANES),
+                   wcs=wcs, filter=exposure.getFilter().getName(), extra=extra if extra else dict())
+    if stats is not None:
+        sidecar['stats'] = stats
+    fd = open("%s.json" % path, "w")
+    try:
+        json.dump(sidecar, fd)
+    finally:
+        fd.close()
+    return stats
+
+
+class MappedExposure(object):
+    """An exposure stored in the memory-mappable format
+
+    Attributes:
+    - path: base path of the files
+    - bbox: parent bounding box
+    - planes: dict of memory-mapped arrays (image, mask, variance), indexed [y, x]
+    - extra: dict of additional values recorded by the writer
+    - stats: dict of statistics gathered by the writer (see PixelStatistics), or None
+    """
+    def __init__(self, path):
+        """Open a stored exposure
+
+        @param path Base path for the files, as given to writeMappedExposure
+        """
+        fd = open("%s.json" % path)
+        try:
+            sidecar = json.load(fd)
+        finally:
+            fd.close()
+
+        self.path = path
+        self.bbox = afwGeom.Box2I(afwGeom.Point2I(sidecar['x0'], sidecar['y0']),
+                                  afwGeom.Extent2I(sidecar['width'], sidecar['height']))
+        shape = (sidecar['height'], sidecar['width'])
+        self.planes = dict((name, numpy.memmap("%s.%s" % (path, name), dtype=numpy.dtype(str(dtype)),
+                                               mode="r", shape=shape))
+                           for name, dtype in sidecar['dtypes'].iteritems())
+        self.extra = sidecar['extra']
+        self.stats = sidecar.get('stats', None)
+        if self.stats is not None:
+            self.stats['maskCounts'] = dict((str(k), v) for k, v in self.stats['maskCounts'].iteritems())
+        self._wcsCards = sidecar['wcs']
+        self._filterName = str(sidecar['filter'])
+        self._wcs = None
+
+    def getBBox(self):
+        """Parent bounding box"""
+        return afwGeom.Box2I(self.bbox)
+
+    def getWcs(self):
+        """WCS, or None"""
+        if self._wcs is None and self._wcsCards:
+            md = dafBase.PropertyList()
+            for name, value in self._wcsCards.iteritems():
+                md.set(str(name), str(value) if isinstance(value, unicode) else value)
+            self._wcs = afwImage.makeWcs(md)
+        return self._wcs
+
+    def getFilterName(self):
+        return self._filterName
+
+    def view(self, bbox):
+        """Views of the planes within a bounding box
+
+        No pixels are copied or read until the views are used.
+
+        @param bbox Parent bounding box of interest
+        @return Overlap of bbox with the exposure (parent bounding box) and dict of plane views; or None if
+        there is no overlap
+        """
+        overlap = afwGeom.Box2I(self.bbox)
+        overlap.clip(bbox)
+        if overlap.isEmpty():
+            return None
+        x0, y0 = self.bbox.getMinX(), self.bbox.getMinY()
+        box = (slice(overlap.getMinY() - y0, overlap.getMaxY() - y0 + 1),
+               slice(overlap.getMinX() - x0, overlap.getMaxX() - x0 + 1))
+        return overlap, dict((name, plane[box]) for name, plane in self.planes.iteritems())
+
+    def fill(self, maskedImage, edgeMask=0):
+        """Fill a masked image with the pixels within its (parent) bounding box
+
+        Pixels outside the exposure are zeroed, and flagged with edgeMask.  The masked image may be recycled
+        between calls, avoiding any further allocation.
+
+        @param maskedImage Masked image to fill
+        @param edgeMask Mask value for pixels outside the exposure
+        @return Whether the masked image overlaps the exposure
+        """
+        bbox = maskedImage.getBBox(afwImage.PARENT)
+        found = self.view(bbox)
+        arrays = dict(image=maskedImage.getImage().getArray(), mask=maskedImage.getMask().getArray(),
+                      variance=maskedImage.getVariance().getArray())
+        if found is None or found[0] != bbox:
+            arrays["image"].fill(0)
+            arrays["mask"].fill(edgeMask)
+            arrays["variance"].fill(0)
+        if found is None:
+            return False
+
+        overlap, views = found
+        x0, y0 = bbox.getMinX(), bbox.getMinY()
+        box = (slice(overlap.getMinY() - y0, overlap.getMaxY() - y0 + 1),
+               slice(overlap.getMinX() - x0, overlap.getMaxX() - x0 + 1))
+        for name in PLANES:
+            arrays[name][box] = views[name]
+        return True
+
+    def getExposure(self):
+        """Read the entire exposure into an afw Exposure"""
+        mi = afwImage.MaskedImageF(self.getBBox())
+        self.fill(mi)
+        exposure = afwImage.ExposureF(mi, self.getWcs())
+        if self._filterName != "_unknown_":
+            exposure.setFilter(afwImage.Filter(self._filterName))
+        return exposure
@@ -11,6 +11,7 @@ import lsst.pipette.process as pipProc
 import lsst.pipette.isr as pipIsr
 import lsst.pipette.background as pipBackground
 import lsst.pipette.phot as pipPhot
+import lsst.pipette.writeBehind as pipWriteBehind
 
 
 class Master(pipProc.Process):
@@ -43,28 +44,43 @@ class Master(pipProc.Process):
         isrProc = self.Isr(config=self.config, log=self.log)
         bgProc = self.BackgroundMeasure(config=self.config, log=self.log)
 
-        bgMatrix = list()
-        for identList in identMatrix:
-            bgList = list()
-            bgMatrix.append(bgList)
-            for ident in identList:
-                if outButler.datasetExists('calexp', ident):
-                    exposure, = self.read(outButler, ident, ['calexp'])
-                else:
-                    exposure, detrends = self.read(inButler, ident, ['raw', 'detrends'])
-                    isrProc.run(exposure, detrends=detrends)
-                    del detrends
-                    # XXX photometry so we can mask objects?
-                    self.write(outButler, ident, {'calexp': exposure})
-                bg = bgProc.run(exposure)
-                bgList.append(bg)
-                del exposure
+        def locate((i, ident)):
+            """Locate the processed exposure if it exists, otherwise read the raw exposure and detrends
+
+            Raw data are assembled by the butler, which can't be used by the thread reading ahead, so only
+            processed exposures are read ahead.
+            """
+            if outButler.datasetExists('calexp', ident):
+                return self.locate(outButler, ident, 'calexp'), None, None
+            exposure, detrends = self.read(inButler, ident, ['raw', 'detrends'])
+            return None, exposure, detrends
+
+        def read((filename, exposure, detrends)):
+            """Read the processed exposure, if that's what was located"""
+            if filename is not None:
+                return self.readExposure(filename), None
+            return exposure, detrends
+
+        bgMatrix = [list() for identList in identMatrix]
+        identIndices = [(i, ident) for i, identList in enumerate(identMatrix) for ident in identList]
+        for (i, ident), (exposure, detrends) in self.prefetch(read, identIndices, locate=locate):
+            if detrends is not None:
+                isrProc.run(exposure, detrends=detrends)
+                del detrends
+                # XXX photometry so we can mask objects?
+                self.write(outButler, ident, {'calexp': exposure})
+            bg = bgProc.run(exposure)
+            bgMatrix[i].append(bg)
+            del exposure
 
         if do['scale'] != "NONE":
             compScales, expScales = self.scale(bgMatrix)
         else:
             compScales, expScales = None, None
 
+        # The calexps are read back from the output butler, so they must all have been written
+        pipWriteBehind.flush()
+
         masterList = list()
         for identList, bgList in zip(identMatrix, bgMatrix):
             master = self.combine(identList, outButler, expScales=expScales, backgrounds=bgList)
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import multiprocessing
+
 import lsst.ip.isr as ipIsr
 import lsst.meas.algorithms as measAlg
 
@@ -7,6 +9,22 @@ import lsst.pipette.process as pipProcess
 import lsst.pipette.phot as pipPhot
 import lsst.pipette.calibrate as pipCalibrate
 
+_multiPhotState = dict()                # State for matched photometry workers; inherited on fork
+
+def _measureIdent(index):
+    """Measure a single exposure for MultiPhot.runIdents
+
+    @param index Index of identifier in the list of identifiers
+    @return Index, output for exposure
+    """
+    state = _multiPhotState
+    ident = state['identList'][index]
+    exposure = state['refExposure'] if ident == state['refIdent'] else None
+    sources = state['process'].measureIdent(state['butler'], ident, state['dataset'], state['footprintSet'],
+                                            exposure=exposure)
+    return index, state['output'](ident, sources)
+
+
 class MultiPhot(pipProcess.Process):
     """Matched photometry on multiple exposures"""
     def __init__(self, Phot=pipPhot.Photometry, Calibrate=pipCalibrate.Calibrate, **kwargs):
@@ -29,7 +47,6 @@ class MultiPhot(pipProcess.Process):
         sourceList = list()
         for exp in exposureList:
             self.display("isr", exposure=exp)
-            exp.writeFits("test.fits")
 
             psf, apcorr = self.psf(exp)
             wcs = exp.getWcs()
@@ -42,9 +59,96 @@ class MultiPhot(pipProcess.Process):
 
         return sourceList
 
+    def runIdents(self, refExposure, butler, identList, dataset, output, processes=1, refIdent=None):
+        """Perform matched photometry on exposures streamed from the butler
+
+        Each exposure is read, calibrated and measured in turn (on a pool of processes if processes > 1), so
+        only one exposure per worker is held in memory.  Results are handed to the output function as each
+        exposure is completed.  The reference exposure is measured as it is, rather than being read again.
+
+        @param refExposure Reference exposure (for detection)
+        @param butler Data butler
+        @param identList List of data identifiers of exposures to measure
+        @param dataset Dataset type of exposures to measure (e.g., 'calexp', 'stack')
+        @param output Function(ident, sources) to record the sources for an exposure; its return value must
+        be picklable if processes > 1
+        @param processes Number of processes
+        @param refIdent Data identifier of the reference exposure, or None
+        @return Iterator over (ident, output value), in order of completion
+        """
+        assert refExposure, "refExposure not provided"
+        assert butler, "butler not provided"
+        assert identList and len(identList) > 0, "identList not provided"
+
+        refPsf, refApcorr = self.psf(refExposure)
+        footprintSet = self.detect(refExposure, refPsf)
+
+        _multiPhotState.update(process=self, butler=butler, identList=identList, dataset=dataset,
+                               footprintSet=footprintSet, output=output, refExposure=refExposure,
+                               refIdent=refIdent)
+        try:
+            if processes > 1 and not multiprocessing.current_process().daemon:
+                pool = multiprocessing.Pool(processes=min(processes, len(identList)))
+                try:
+                    for index, value in pool.imap_unordered(_measureIdent, range(len(identList))):
+                        yield identList[index], value
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                for index in range(len(identList)):
+                    index, value = _measureIdent(index)
+                    yield identList[index], value
+        finally:
+            _multiPhotState.clear()
+
+    def measureIdent(self, butler, ident, dataset, footprintSet, exposure=None):
+        """Read, calibrate and measure a single exposure
+
+        A PSF persisted for the exposure is used if available (without aperture correction); otherwise the
+        PSF and aperture correction are determined.
+
+        @param butler Data butler
+        @param ident Data identifier
+        @param dataset Dataset type of exposure
+        @param footprintSet Footprints to measure
+        @param exposure Exposure, if already read; or None
+        @return Sources
+        """
+        exp = self.read(butler, ident, [dataset])[0] if exposure is None else exposure
+        self.display("isr", exposure=exp)
+
+        try:
+            exists = butler.datasetExists('psf', ident)
+        except Exception:
+            exists = False              # Dataset not defined for this kind of identifier (e.g., stacks)
+        if exists:
+            psf = self.read(butler, ident, ['psf'])[0]
+            apcorr = None
+            exp.setPsf(psf)
+            self.interpolateNans(exp, psf)
+        else:
+            psf, apcorr = self.psf(exp)
+
+        sources = self.measure(exp, footprintSet, psf, apcorr=apcorr, wcs=exp.getWcs())
+        del exp
+        return sources
+
     def psf(self, exposure):
         psf, wcs = self._Calibrate.fakePsf(exposure)
+        self.interpolateNans(exposure, psf)
+        
+        sources = self._Calibrate.phot(exposure, psf)
+        psf, cellSet = self._Calibrate.psf(exposure, sources)
+        apcorr = self._Calibrate.apCorr(exposure, cellSet)
+        return psf, apcorr
+
+    def interpolateNans(self, exposure, psf):
+        """Interpolate over NANs
 
+        @param exposure Exposure to process
+        @param psf PSF for interpolation
+        """
         # Need to clobber NANs...
         # XXX Use a Pipette process for this
         exposure.getMaskedImage().getMask().addMaskPlane("UNMASKEDNAN")
@@ -53,11 +157,6 @@ class MultiPhot(pipProcess.Process):
         nans = ipIsr.defectListFromMask(exposure, maskName='UNMASKEDNAN')
         measAlg.interpolateOverDefects(exposure.getMaskedImage(), psf, nans, 0.0)
         
-        sources = self._Calibrate.phot(exposure, psf)
-        psf, cellSet = self._Calibrate.psf(exposure, sources)
-        apcorr = self._Calibrate.apCorr(exposure, cellSet)
-        return psf, apcorr
-        
     def detect(self, exposure, psf):
         return self._Phot.detect(exposure, psf)
 
@@ -2,21 +2,59 @@
 
 import numpy
 import math
+import importlib
 
+import lsst.pex.logging as pexLog
 import lsst.afw.geom as afwGeom
 import lsst.meas.utils.sourceDetection as muDetection
 import lsst.meas.utils.sourceMeasurement as muMeasurement
 
 import lsst.pipette.process as pipProc
 import lsst.pipette.background as pipBackground
+import lsst.pipette.detection as pipDetection
 
 from lsst.pipette.timer import timecall
 
+pluginBuffer = dict()                   # Imported measurement plugin modules (None if import failed)
+pluginImports = set()                   # Sets of imports that have been processed
+
+def importPlugins(config, log=None):
+    """Import measurement plugin modules (so they can register themselves)
+
+    Each module is imported (or fails to import) once per process; thereafter this is a no-op for the
+    same set of imports.  Call this before creating a multiprocessing.Pool, so that the workers inherit the
+    imports rather than each importing for itself.
+
+    @param config Configuration, with the modules to import in 'imports'
+    @param log Log, or None for the default log
+    """
+    if not config.has_key('imports'):
+        return
+    imports = config['imports']
+    key = tuple(sorted((name, imports[name]) for name in imports.keys()))
+    if key in pluginImports:
+        return
+
+    if log is None:
+        log = pexLog.getDefaultLog()
+    for modName, module in key:
+        if not pluginBuffer.has_key(module):
+            try:
+                pluginBuffer[module] = importlib.import_module(module)
+                log.log(log.INFO, "Imported %s (%s)" % (modName, module))
+            except ImportError, err:
+                pluginBuffer[module] = None
+                log.log(log.WARN, "Failed to import %s (%s): %s" % (modName, module, err))
+    pluginImports.add(key)
+
+
 class Photometry(pipProc.Process):
-    def __init__(self, thresholdMultiplier=1.0, Background=pipBackground.Background, *args, **kwargs):
+    def __init__(self, thresholdMultiplier=1.0, Background=pipBackground.Background, detections=None,
+                 *args, **kwargs):
         super(Photometry, self).__init__(*args, **kwargs)
         self._Background = Background
         self._thresholdMultiplier = thresholdMultiplier
+        self._detections = detections
         return
 
     def run(self, exposure, psf, apcorr=None, wcs=None):
@@ -48,14 +86,7 @@ class Photometry(pipProc.Process):
 
     def imports(self):
         """Import modules (so they can register themselves)"""
-        if self.config.has_key('imports'):
-            for modName in self.config['imports']:
-                try:
-                    module = self.config['imports'][modName]
-                    self.log.log(self.log.INFO, "Importing %s (%s)" % (modName, module))
-                    exec("import " + module)
-                except ImportError, err:
-                    self.log.log(self.log.WARN, "Failed to import %s (%s): %s" % (modName, module, err))
+        importPlugins(self.config, log=self.log)
 
 
     @timecall
@@ -66,7 +97,10 @@ class Photometry(pipProc.Process):
         @return Background, Background-subtracted exposure
         """
         background = self._Background(config=self.config, log=self.log)
-        return background.run(exposure)
+        bg, subtracted = background.run(exposure)
+        if self._detections is not None:
+            self._detections.modified(exposure)
+        return bg, subtracted
 
 
     @timecall
@@ -79,14 +113,27 @@ class Photometry(pipProc.Process):
         """
         assert exposure, "No exposure provided"
         assert psf, "No psf provided"
+        if self._detections is not None:
+            return self._detections.detect(exposure, psf, self._thresholdMultiplier, self.detectSources)
+        return self.detectSources(exposure, psf, self._thresholdMultiplier)
+
+    def detectSources(self, exposure, psf, thresholdMultiplier):
+        """Detect sources on the image
+
+        @param exposure Exposure to process
+        @param psf PSF for detection
+        @param thresholdMultiplier Multiplier for the detection threshold
+        @return Positive source footprints
+        """
         policy = self.config['detect']
         posSources, negSources = muDetection.detectSources(exposure, psf, policy.getPolicy(),
-                                                           extraThreshold=self._thresholdMultiplier)
+                                                           extraThreshold=thresholdMultiplier)
         numPos = len(posSources.getFootprints()) if posSources is not None else 0
         numNeg = len(negSources.getFootprints()) if negSources is not None else 0
         if numNeg > 0:
             self.log.log(self.log.WARN, "%d negative sources found and ignored" % numNeg)
-        self.log.log(self.log.INFO, "Detected %d sources to %g sigma." % (numPos, policy['thresholdValue']))
+        self.log.log(self.log.INFO, "Detected %d sources to %g sigma." %
+                     (numPos, thresholdMultiplier * policy['thresholdValue']))
         return posSources
 
     @timecall
@@ -103,7 +150,7 @@ class Photometry(pipProc.Process):
         assert exposure, "No exposure provided"
         assert footprintSet, "No footprintSet provided"
         assert psf, "No psf provided"
-        policy = self.config['measure'].getPolicy()
+        policy = self.measurePolicy()
         footprints = []                    # Footprints to measure
         num = len(footprintSet.getFootprints())
         self.log.log(self.log.INFO, "Measuring %d positive sources" % num)
@@ -150,6 +197,123 @@ class Photometry(pipProc.Process):
         return sources
 
 
+    def measurePolicy(self):
+        """Return the policy for source measurement"""
+        return self.config['measure'].getPolicy()
+
+
+class BrightPhotometry(Photometry):
+    """Photometry of a limited number of bright sources, for calibration
+
+    Only the brightest isolated, unsaturated footprints are measured (up to calibrate.maxSources), and only
+    with the algorithms providing the centroid, shape, PSF and aperture fluxes.  This bounds the cost of
+    calibration on crowded fields.
+    """
+    def run(self, exposure, psf, apcorr=None, wcs=None):
+        """Run photometry
+
+        @param exposure Exposure to process
+        @param psf PSF for photometry
+        @param apcorr Aperture correction to apply
+        @param wcs WCS to apply
+        @return
+        - sources: Measured sources
+        - footprints: Selected footprints
+        """
+        assert exposure, "No exposure provided"
+        assert psf, "No psf provided"
+
+        self.imports()
+
+        footprintSet = self.detect(exposure, psf)
+
+        do = self.config['do']['phot']
+        if do['background']:
+            bg, exposure = self.background(exposure); del bg
+
+        footprints = self.select(exposure, footprintSet)
+        sources = self.measure(exposure, footprints, psf, apcorr=apcorr, wcs=wcs)
+
+        self.display('phot', exposure=exposure, sources=sources, pause=True)
+        return sources, footprints
+
+    @timecall
+    def select(self, exposure, footprintSet):
+        """Select the brightest isolated, unsaturated footprints
+
+        @param exposure Exposure on which footprints were detected
+        @param footprintSet Set of footprints
+        @return Selected footprints
+        """
+        calibrate = self.config['calibrate']
+        maxSources = calibrate['maxSources']
+        isolation = calibrate['isolation']
+
+        mi = exposure.getMaskedImage()
+        image = mi.getImage().getArray()
+        mask = mi.getMask().getArray()
+        x0, y0 = mi.getX0(), mi.getY0()
+        badBits = mi.getMask().getPlaneBitMask("SAT")
+
+        footprints = list(footprintSet.getFootprints())
+        num = len(footprints)
+        xCen = numpy.empty(num)
+        yCen = numpy.empty(num)
+        brightness = numpy.empty(num)
+        good = numpy.ones(num, dtype=bool)
+        for i, foot in enumerate(footprints):
+            bbox = foot.getBBox()
+            xCen[i] = 0.5 * (bbox.getMinX() + bbox.getMaxX())
+            yCen[i] = 0.5 * (bbox.getMinY() + bbox.getMaxY())
+            region = (slice(bbox.getMinY() - y0, bbox.getMaxY() - y0 + 1),
+                      slice(bbox.getMinX() - x0, bbox.getMaxX() - x0 + 1))
+            peaks = foot.getPeaks()
+            if len(peaks) > 1 or numpy.any(mask[region] & badBits):
+                good[i] = False     # Blended or saturated
+            if len(peaks) > 0:
+                brightness[i] = max(image[p.getIy() - y0, p.getIx() - x0] for p in peaks)
+            else:
+                brightness[i] = image[region].max()
+
+        selected = list()
+        for i in numpy.argsort(-brightness):
+            if len(selected) >= maxSources:
+                break
+            if not good[i]:
+                continue
+            distance2 = (xCen - xCen[i])**2 + (yCen - yCen[i])**2
+            if numpy.sum(distance2 < isolation**2) > 1:
+                continue
+            selected.append(i)
+
+        selected.sort()
+        self.log.log(self.log.INFO, "Selected %d of %d footprints for calibration" % (len(selected), num))
+        return pipDetection.FootprintSubset([footprints[i] for i in selected])
+
+    def measurePolicy(self):
+        """Return the policy for source measurement, reduced to the algorithms used by calibration"""
+        measure = self.config['measure'].copy()
+        if not measure.has_key('source'):
+            return measure.getPolicy()
+        slots = measure['source']
+        keep = {'astrometry': [], 'photometry': [], 'shape': []}
+        for kind, slot in (('astrometry', 'astrom'), ('photometry', 'psfFlux'), ('photometry', 'apFlux'),
+                           ('shape', 'shape')):
+            if slots.has_key(slot):
+                keep[kind].append(slots[slot])
+        for slot in ('modelFlux', 'instFlux'):
+            if slots.has_key(slot):
+                del slots[slot]
+        for kind, names in keep.items():
+            if not measure.has_key(kind):
+                continue
+            algorithms = measure[kind]
+            for name in algorithms.keys():
+                if name not in names:
+                    del algorithms[name]
+        return measure.getPolicy()
+
+
 class Rephotometry(Photometry):
     def run(self, exposure, footprints, psf, apcorr=None, wcs=None):
         """Photometer footprints that have already been detected
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+import sys
+import Queue
+import threading
+
+"""This module provides reading of inputs on a background thread, ahead of their use, so that reading the
+next item overlaps with processing the current one."""
+
+def dataSize(data):
+    """Estimate the size in memory (bytes) of data read for processing
+
+    Exposures, masked images and images are measured by their pixels; containers are measured by their
+    contents; anything else is counted as nothing.
+    """
+    if data is None:
+        return 0
+    if isinstance(data, (list, tuple)):
+        return sum(dataSize(d) for d in data)
+    if isinstance(data, dict):
+        return sum(dataSize(d) for d in data.itervalues())
+    if hasattr(data, "getMaskedImage"):
+        data = data.getMaskedImage()
+    if hasattr(data, "getVariance"):
+        return data.getWidth() * data.getHeight() * (4 + 2 + 4)
+    if hasattr(data, "getArray"):
+        return data.getArray().nbytes
+    return 0
+
+
+class _Failure(object):
+    """Wrapper for an exception raised while reading, to be raised again in the consumer"""
+    def __init__(self, excInfo):
+        self.excInfo = excInfo
+
+
+class Prefetcher(object):
+    """Iterator over items and their data, with the data read on a background thread
+
+    Up to 'depth' items are read ahead of the one being processed, so long as the data read ahead and not yet
+    finished with amount to less than 'memory' bytes (at least one item is always read ahead).  An item is
+    considered finished with when the next is requested.  Exceptions raised while locating or reading an
+    item are raised when that item is requested.
+
+    Butlers (and their registry connections) may not be shared between threads, so anything that needs them
+    (registry lookups, existence checks) should be done by the 'locate' function, which is run on the
+    consumer's thread, leaving only the reading of pixels to 'read' on the background thread.
+    """
+    def __init__(self, read, items, depth=1, memory=0, size=dataSize, locate=None):
+        """Initialisation
+
+        @param read Function(location) returning the data for an item, given its location
+        @param items List of items, in order of processing
+        @param depth Maximum number of items to read ahead
+        @param memory Maximum size of data read ahead (bytes), or 0 for no limit
+        @param size Function(data) returning the size of data (bytes)
+        @param locate Function(item) returning the location of an item for 'read'; None to pass the item
+        """
+        self._read = read
+        self._locate = locate
+        self._items = list(items)
+        self._depth = max(depth, 1)
+        self._memory = memory
+        self._size = size
+        self._requests = Queue.Queue()  # Located items, to be read
+        self._located = 0               # Number of items located
+        self._queue = Queue.Queue(maxsize=self._depth)
+        self._condition = threading.Condition()
+        self._held = 0                  # Size of data read but not finished with
+        self._current = 0               # Size of data being processed
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="Prefetcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _submit(self, number):
+        """Locate items (on this thread) and request they be read, until 'number' have been requested"""
+        while self._located < min(number, len(self._items)):
+            item = self._items[self._located]
+            try:
+                location = self._locate(item) if self._locate is not None else item
+            except Exception:
+                location = _Failure(sys.exc_info())
+            self._requests.put((item, location))
+            self._located += 1
+
+    def _run(self):
+        """Read items in the background"""
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            item, location = request
+
+            self._condition.acquire()
+            try:
+                while not self._stop and self._memory > 0 and self._held - self._current > 0 and \
+                          self._held >= self._memory:
+                    self._condition.wait()
+                if self._stop:
+                    return
+            finally:
+                self._condition.release()
+
+            if isinstance(location, _Failure):
+                data, size = location, 0
+            else:
+                try:
+                    data = self._read(location)
+                    size = self._size(data)
+                except Exception:
+                    data = _Failure(sys.exc_info())
+                    size = 0
+
+            self._condition.acquire()
+            try:
+                self._held += size
+            finally:
+                self._condition.release()
+            self._queue.put((item, data, size))
+
+    def __iter__(self):
+        try:
+            for i in range(len(self._items)):
+                # Keep 'depth' items requested beyond the one we're about to process
+                self._submit(i + 1 + self._depth)
+                item, data, size = self._queue.get()
+                self._condition.acquire()
+                try:
+                    self._held -= self._current
+                    self._current = size
+                    self._condition.notify()
+                finally:
+                    self._condition.release()
+                if isinstance(data, _Failure):
+                    raise data.excInfo[0], data.excInfo[1], data.excInfo[2]
+                yield item, data
+                del data
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop reading ahead"""
+        self._condition.acquire()
+        try:
+            self._stop = True
+            self._condition.notify()
+        finally:
+            self._condition.release()
+        self._requests.put(None)
+        # Unblock the reader if it's waiting on a full queue
+        while self._thread.isAlive():
+            try:
+                self._queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+
+
+class PerThread(object):
+    """A resource (e.g., a ReadWrite) constructed separately for each thread that uses it
+
+    Butlers hold registry connections that may only be used by the thread that opened them, so a reading
+    thread needs its own.
+    """
+    def __init__(self, factory, value=None):
+        """Initialisation
+
+        @param factory Function() returning a new instance of the resource
+        @param value Instance of the resource for the current thread, or None to construct when required
+        """
+        self._factory = factory
+        self._local = threading.local()
+        if value is not None:
+            self._local.value = value
+
+    def get(self):
+        """Return the instance of the resource for the current thread"""
+        if not hasattr(self._local, "value"):
+            self._local.value = self._factory()
+        return self._local.value
+
+
+def prefetch(read, items, config=None, locate=None):
+    """Iterate over items and their data, reading ahead as configured (prefetch.depth, prefetch.memory)
+
+    @param read Function(location) returning the data for an item, given its location
+    @param items List of items, in order of processing
+    @param config Configuration, or None
+    @param locate Function(item) returning the location of an item, run on this thread (see Prefetcher);
+    None to pass the item itself to 'read'
+    @return Iterator over (item, data)
+    """
+    depth, memory = 0, 0
+    if config is not None and config.has_key('prefetch'):
+        depth = config['prefetch']['depth']
+        memory = config['prefetch']['memory'] * 1024 * 1024
+    if depth <= 0:
+        if locate is None:
+            return ((item, read(item)) for item in items)
+        return ((item, read(locate(item))) for item in items)
+    return iter(Prefetcher(read, items, depth=depth, memory=memory, locate=locate))
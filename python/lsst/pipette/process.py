@@ -7,6 +7,8 @@ import lsst.afw.image as afwImage
 import lsst.afw.display.ds9 as ds9
 import lsst.ip.isr as ipIsr
 import lsst.pipette.util as pipUtil
+import lsst.pipette.prefetch as pipPrefetch
+import lsst.pipette.writeBehind as pipWriteBehind
 
 """This module defines the base class for processes."""
 
@@ -21,6 +23,45 @@ class Process(object):
         raise NotImplementedError("This method needs to be provided by the subclass.")
 
 
+    def prefetch(self, read, items, locate=None):
+        """Iterate over items and their data, reading ahead as configured (prefetch.depth, prefetch.memory)
+
+        Data are read ahead on another thread, which must not use the butlers; anything requiring a butler
+        should be done by 'locate', which runs on this thread.
+
+        @param read Function(location) returning the data for an item, given its location
+        @param items List of items, in order of processing
+        @param locate Function(item) returning the location of an item, or None to pass the item to 'read'
+        @return Iterator over (item, data)
+        """
+        return pipPrefetch.prefetch(read, items, config=self.config, locate=locate)
+
+    def locate(self, butler, ident, product, ignore=False):
+        """Locate the file holding a product, so it may be read without the butler (see readExposure)
+
+        @param butler Data butler
+        @param ident Identifier for data
+        @param product Product to locate
+        @param ignore Ignore non-existent data?
+        @return Filename, or None if the product doesn't exist
+        """
+        if not butler.datasetExists(product, ident):
+            if not ignore:
+                raise RuntimeError("Data type %s does not exist for %s" % (product, ident))
+            return None
+        return butler.mapper.map(product, ident).getLocations()[0]
+
+    def readExposure(self, filename):
+        """Read an exposure from a file found by locate
+
+        This doesn't use the butler, so it may be done by a thread reading ahead.
+
+        @param filename Name of file
+        @return Floating-point exposure
+        """
+        self.log.log(self.log.INFO, "Reading %s" % filename)
+        return afwImage.ExposureF(filename)
+
     def read(self, butler, ident, productList, ignore=False):
         """Read products
 
@@ -83,6 +124,9 @@ class Process(object):
     def write(self, butler, ident, productDict):
         """Write products
 
+        If write-behind is configured (writeBehind.memory > 0), the products are written in the background,
+        so must not be modified afterwards; lsst.pipette.writeBehind.flush waits for them.
+
         @param butler Data butler
         @param ident Identifier for data
         @param productDict
@@ -91,8 +135,9 @@ class Process(object):
         assert ident, "ident not provided"
         assert productDict, "productDict not provided"
 
+        writer = pipWriteBehind.getWriter(self.config)
         for product, source in productDict.items():
-            butler.put(source, product, ident)
+            pipWriteBehind.put(writer, butler, source, product, ident)
             self.log.log(self.log.INFO, "Writing %s: %s" % (product, ident))
         return
 
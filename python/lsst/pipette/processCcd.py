@@ -4,6 +4,7 @@ import lsst.pipette.process as pipProc
 import lsst.pipette.isr as pipIsr
 import lsst.pipette.calibrate as pipCalib
 import lsst.pipette.phot as pipPhot
+import lsst.pipette.detection as pipDetection
 
 from lsst.pipette.timer import timecall
 
@@ -45,10 +46,14 @@ class ProcessCcd(pipProc.Process):
             assert len(exposureList) == 1 # no ISR so the exposureList is just the calexp
             exposure, defects, background = exposureList[0], None, None
 
-        psf, apcorr, brightSources, matches, matchMeta = self.calibrate(exposure, defects=defects)
+        detections = self.detections()
+
+        psf, apcorr, brightSources, matches, matchMeta = self.calibrate(exposure, defects=defects,
+                                                                        detections=detections)
 
         if self.config['do']['phot']['enabled']:
-            sources, footprints = self.phot(exposure, psf, apcorr, wcs=exposure.getWcs())
+            sources, footprints = self.phot(exposure, psf, apcorr, wcs=exposure.getWcs(),
+                                            detections=detections)
         else:
             sources, footprints = None, None
 
@@ -64,12 +69,33 @@ class ProcessCcd(pipProc.Process):
         isr = self._Isr(config=self.config, log=self.log)
         return isr.run(exposureList, detrendsList)
 
+    def detections(self):
+        """Provide a cache of detections to share between calibration and photometry
+
+        Detections can only be shared if the PSF used for detection doesn't change and the exposure isn't
+        modified in between, so when the PSF is measured or the background is subtracted in calibration
+        (do.calibrate.psf, do.calibrate.background), the calibration detections are not run to the
+        photometry threshold.  Photometry detects before subtracting its own background, so
+        do.phot.background doesn't matter.
+
+        @return Detection cache, or None
+        """
+        do = self.config['do']
+        if not do['phot'].has_key('shareDetection') or not do['phot']['shareDetection']:
+            return None
+        shareable = not do['calibrate']['psf'] and not do['calibrate']['background']
+        if do['phot']['enabled'] and not shareable:
+            self.log.log(self.log.INFO, "Not sharing detections between calibration and photometry, "
+                         "since do.calibrate.psf or do.calibrate.background is set")
+        faintest = 1.0 if do['phot']['enabled'] and shareable else None
+        return pipDetection.DetectionCache(self.config, self.log, faintest=faintest)
+
     @timecall
-    def calibrate(self, *args, **kwargs):
-        calibrate = self._Calibrate(config=self.config, log=self.log)
-        return calibrate.run(*args, **kwargs)
+    def calibrate(self, exposure, detections=None, **kwargs):
+        calibrate = self._Calibrate(config=self.config, log=self.log, detections=detections)
+        return calibrate.run(exposure, **kwargs)
 
     @timecall
-    def phot(self, exposure, psf, apcorr, wcs=None):
-        phot = self._Photometry(config=self.config, log=self.log)
+    def phot(self, exposure, psf, apcorr, wcs=None, detections=None):
+        phot = self._Photometry(config=self.config, log=self.log, detections=detections)
         return phot.run(exposure, psf, apcorr, wcs=wcs)
@@ -3,6 +3,7 @@
 import os
 import re
 import math
+import threading
 import lsst.pex.logging as pexLog
 import lsst.pex.policy as pexPolicy
 import lsst.daf.persistence as dafPersist
@@ -13,16 +14,23 @@ import lsst.afw.detection as afwDet
 import lsst.afw.coord as afwCoord
 import lsst.meas.astrom as measAstrom
 import lsst.meas.algorithms.utils as maUtils
+import lsst.pipette.footprintIndex as pipIndex
+import lsst.pipette.writeBehind as pipWriteBehind
 
 from lsst.pipette.timer import timecall
 
 """This module provides I/O for pipette (LSST algorithms testing)"""
 
-mapperBuffer = dict()                   # Buffer of mappers for recycling
+mapperBuffer = dict()                   # Buffer of mappers for recycling, by thread
+fileStorages = ("BoostStorage", "FitsStorage", "PafStorage", "PickleStorage") # Storages that are files
 
 def getMapper(mapper, root=None, calibRoot=None, registry=None):
-    """Pull a mapper out of the buffer, if present, otherwise instantiate a new one"""
-    key = ""
+    """Pull a mapper out of the buffer, if present, otherwise instantiate a new one
+
+    Mappers hold registry connections that may only be used by the thread that opened them, so they are
+    buffered separately for each thread.
+    """
+    key = "%s:" % threading.current_thread().ident
     for part in (root, calibRoot, registry):
         if part:
             key += part
@@ -113,7 +121,13 @@ class ReadWrite(object):
         self.outMapper = initMapper(outMapper, config, self.log, inMap=False)
         self.obf = dafPersist.ButlerFactory(mapper=self.outMapper)
         self.outButler = self.obf.create()
-        
+
+        self.index = pipIndex.getIndex(config) if config is not None else None
+        self.config = config
+
+        self._lookups = dict()          # Memoized results of lookup, by data identifier
+        self._listings = dict()         # Directory listings for existence checks, by directory
+
         self.ccdKeys = ccdKeys
         if fileKeys is None:
             fileKeys = list(ccdKeys)
@@ -122,6 +136,14 @@ class ReadWrite(object):
         self.fileKeys = fileKeys
         return
 
+    @property
+    def writer(self):
+        """Writer for background writes, or None to write synchronously
+
+        The writer is got afresh each time, so a ReadWrite created before forking uses the worker's own.
+        """
+        return pipWriteBehind.getWriter(self.config)
+
     def lookup(self, dataId):
         """Lookup data for a CCD.
 
@@ -131,6 +153,14 @@ class ReadWrite(object):
         for key in self.ccdKeys:
             if not dataId.has_key(key):
                 raise KeyError("Data identifier does not contain keyword %s" % key)
+        memo = (tuple(self.fileKeys), tuple(sorted(dataId.items())))
+        if not self._lookups.has_key(memo):
+            self._lookups[memo] = self._lookup(dataId)
+        # Callers update the identifiers, so they get their own copies
+        return [dict(ident) for ident in self._lookups[memo]]
+
+    def _lookup(self, dataId):
+        """Lookup data for a CCD in the registry; see lookup"""
         keys = self.inButler.queryMetadata('raw', self.ccdKeys, format=self.fileKeys, dataId=dataId)
 
         identifiers = list()
@@ -145,6 +175,73 @@ class ReadWrite(object):
             identifiers.append(ident)
         return identifiers
 
+    def _location(self, butler, which, ident):
+        """Return the directory and filename of a dataset, or None if it isn't stored as a file"""
+        try:
+            location = butler.mapper.map(which, ident)
+        except Exception:
+            return None
+        if location.getStorageName() not in fileStorages:
+            return None
+        path = re.sub(r"\[.*\]$", "", location.getLocations()[0]) # Strip any HDU specification
+        return os.path.split(path)
+
+    def exists(self, butler, which, ident):
+        """Does a dataset exist?
+
+        Rather than testing each file, the directory holding it (typically, one per visit) is listed once and
+        the listing is cached until something is written there.  Files missing from the listing are checked
+        individually, in case they were written by other means.  Datasets that aren't stored as files are
+        checked with the butler.
+
+        @param butler Data butler
+        @param which Type of data
+        @param ident Data identifier for butler
+        @returns Whether the dataset exists
+        """
+        location = self._location(butler, which, ident)
+        if location is None:
+            return butler.datasetExists(which, ident)
+        dirname, filename = location
+        if not self._listings.has_key(dirname):
+            self._listings[dirname] = set(os.listdir(dirname)) if os.path.isdir(dirname) else set()
+        listing = self._listings[dirname]
+        if filename not in listing and os.path.exists(os.path.join(dirname, filename)):
+            listing.add(filename)
+        return filename in listing
+
+    def _put(self, obj, which, dataId):
+        """Write a dataset with the output butler (in the background, if configured)
+
+        The cached listing of the dataset's directory is invalidated; a file that hasn't yet been written in
+        the background is picked up by exists when it appears.
+        """
+        pipWriteBehind.put(self.writer, self.outButler, obj, which, dataId)
+        location = self._location(self.outButler, which, dataId)
+        if location is not None:
+            self._listings.pop(location[0], None)
+
+    def defer(self, function, args, size=None):
+        """Perform a write in the background, if write-behind is configured (writeBehind.memory > 0)
+
+        The data to be written must not be modified afterwards.  Errors are raised by a later write or flush.
+
+        @param function Function to perform the write
+        @param args List of arguments for the function
+        @param size Size of the data (bytes), or None to estimate from the arguments
+        """
+        writer = self.writer
+        if writer is None:
+            function(*args)
+        else:
+            writer.submit(function, args, size=size)
+
+    def flush(self):
+        """Wait for background writes to finish, raising any error"""
+        writer = self.writer
+        if writer is not None:
+            writer.flush()
+
     @timecall
     def readRaw(self, dataId):
         """Read raw data of a CCD.
@@ -160,7 +257,7 @@ class ReadWrite(object):
         exposures = list()
         for ident in identifiers:
             ident.update(dataId)
-            if not self.inButler.datasetExists('raw', ident):
+            if not self.exists(self.inButler, 'raw', ident):
                 raise RuntimeError("Raw data does not exist for %s" % ident)
             self.log.log(self.log.DEBUG, "Reading: %s" % (ident))
             exp = self.inButler.get('raw', ident)
@@ -205,7 +302,7 @@ class ReadWrite(object):
         for ident in identifiers:
             ident.update(dataId)
             for i, butler in enumerate([self.inButler, self.outButler]):
-                if not butler.datasetExists(which, ident):
+                if not self.exists(butler, which, ident):
                     if i == 1:
                         if not ignore:
                             raise RuntimeError("Data type %s does not exist for %s" % (which, ident))
@@ -234,7 +331,7 @@ class ReadWrite(object):
                 detList = list()
                 for ident in identifiers:
                     ident.update(dataId)
-                    if not self.inButler.datasetExists(kind, ident):
+                    if not self.exists(self.inButler, kind, ident):
                         raise RuntimeError("Data type %s does not exist for %s" % (kind, ident))
                     self.log.log(self.log.DEBUG, "Reading %s for %s" % (kind, ident))
                     detrend = self.inButler.get(kind, ident)
@@ -249,7 +346,7 @@ class ReadWrite(object):
                 assert len(filterList) == 1, "Filter query is non-unique: %s" % filterList
                 filtName = filterList[0]
                 if filtName in config['fringe']['filters']:
-                    if not self.inButler.datasetExists('fringe', ident):
+                    if not self.exists(self.inButler, 'fringe', ident):
                         raise RuntimeError("Data type fringe does not exist for %s" % ident)
                     self.log.log(self.log.DEBUG, "Reading fringe for %s" % (ident))
                     fringe = self.inButler.get("fringe", ident)
@@ -263,6 +360,9 @@ class ReadWrite(object):
               matches=None, matchMeta=None, **kwargs):
         """Write processed data.
 
+        If write-behind is configured, the data are written in the background, so must not be modified
+        afterwards; call flush to wait for them.
+
         @param dataId Data identifier for butler
         @param exposure Exposure to write, or None
         @param psf PSF to write, or None
@@ -271,20 +371,25 @@ class ReadWrite(object):
         """
         if exposure is not None:
             self.log.log(self.log.INFO, "Writing exposure: %s" % (dataId))
-            self.outButler.put(exposure, 'calexp', dataId)
+            self._put(exposure, 'calexp', dataId)
+            if self.index is not None and exposure.getWcs() is not None:
+                mi = exposure.getMaskedImage()
+                footprint = pipIndex.SkyFootprint.fromWcs(exposure.getWcs(), mi.getWidth(), mi.getHeight(),
+                                                          mi.getX0(), mi.getY0())
+                self.index.add(dataId, footprint)
         if psf is not None:
             self.log.log(self.log.INFO, "Writing PSF: %s" % (dataId))
-            self.outButler.put(psf, 'psf', dataId)
+            self._put(psf, 'psf', dataId)
         if sources is not None:
             self.log.log(self.log.INFO, "Writing sources: %s" % (dataId))
-            self.outButler.put(afwDet.PersistableSourceVector(sources), 'src', dataId)
+            self._put(afwDet.PersistableSourceVector(sources), 'src', dataId)
         if matches is not None:
             try:
                 self.log.log(self.log.INFO, "Writing matches: %s" % (dataId))
                 smv = afwDet.SourceMatchVector()
                 for match in matches:
                     smv.push_back(match)
-                self.outButler.put(afwDet.PersistableSourceMatchVector(smv, matchMeta), 'icMatch', dataId)
+                self._put(afwDet.PersistableSourceMatchVector(smv, matchMeta), 'icMatch', dataId)
 
                 if brightSources is None:
                     brightSources = afwDet.SourceSet()
@@ -295,6 +400,6 @@ class ReadWrite(object):
 
         if brightSources is not None:
             self.log.log(self.log.INFO, "Writing calibration sources: %s" % (dataId))
-            self.outButler.put(afwDet.PersistableSourceVector(brightSources), 'icSrc', dataId)
+            self._put(afwDet.PersistableSourceVector(brightSources), 'icSrc', dataId)
                 
         return
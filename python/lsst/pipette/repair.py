@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 
+import multiprocessing
+import multiprocessing.pool
+
 import lsst.afw.math as afwMath
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
 import lsst.afw.detection as afwDet
 import lsst.meas.algorithms as measAlg
 import lsst.pipette.process as pipProc
@@ -8,6 +13,73 @@ import lsst.pipette.process as pipProc
 import lsst.afw.display.ds9 as ds9
 import lsst.afw.display.utils as displayUtils
 
+_tileState = dict()                     # State for tiled cosmic-ray workers; inherited on fork
+
+
+def crTiles(width, height, numX, numY, overlap):
+    """Divide an image into overlapping tiles for cosmic-ray detection
+
+    @param width Width of image
+    @param height Height of image
+    @param numX Number of tiles in x
+    @param numY Number of tiles in y
+    @param overlap Overlap between neighbouring tiles (pixels)
+    @return List of (tile, core) boxes, each (xMin, yMin, xMax, yMax) inclusive in local coordinates;
+    the cores partition the image
+    """
+    tiles = list()
+    for iy in range(numY):
+        yCoreMin, yCoreMax = iy * height // numY, (iy + 1) * height // numY - 1
+        for ix in range(numX):
+            xCoreMin, xCoreMax = ix * width // numX, (ix + 1) * width // numX - 1
+            tile = (max(0, xCoreMin - overlap), max(0, yCoreMin - overlap),
+                    min(width - 1, xCoreMax + overlap), min(height - 1, yCoreMax + overlap))
+            tiles.append((tile, (xCoreMin, yCoreMin, xCoreMax, yCoreMax)))
+    return tiles
+
+
+def _findCosmicRaysInTile(args):
+    """Find cosmic rays in a single tile
+
+    Works on a copy of the tile, so neighbouring tiles don't interfere.  Only cosmic rays centred in the
+    core of the tile are returned, so that those in the overlaps are counted once; the overlap ensures the
+    pixels of the core are treated as they would be for the whole image.
+
+    @param args Tile and core boxes, as provided by crTiles
+    @return List of cosmic rays, each a list of (y, x0, x1) spans in parent coordinates; and arrays (image,
+    mask, variance) of the processed core
+    """
+    tile, core = args
+    mi = _tileState['maskedImage']
+    bbox = afwGeom.Box2I(afwGeom.Point2I(tile[0], tile[1]), afwGeom.Point2I(tile[2], tile[3]))
+    sub = mi.Factory(mi, bbox, afwImage.LOCAL)
+    copy = sub.Factory(sub, True)
+    del sub
+
+    crs = measAlg.findCosmicRays(copy, _tileState['psf'], _tileState['background'], _tileState['policy'],
+                                 _tileState['keep'])
+
+    coreBox = afwGeom.Box2I(afwGeom.Point2I(core[0] - tile[0], core[1] - tile[1]),
+                            afwGeom.Point2I(core[2] - tile[0], core[3] - tile[1]))
+    coreImage = copy.Factory(copy, coreBox, afwImage.LOCAL)
+    pixels = (coreImage.getImage().getArray().copy(), coreImage.getMask().getArray().copy(),
+              coreImage.getVariance().getArray().copy())
+    del coreImage
+
+    found = list()
+    if crs is None:
+        return found, pixels
+
+    x0, y0 = mi.getX0(), mi.getY0()
+    for cr in crs:
+        crBox = cr.getBBox()
+        xCen = (crBox.getMinX() + crBox.getMaxX()) // 2 - x0
+        yCen = (crBox.getMinY() + crBox.getMaxY()) // 2 - y0
+        if xCen < core[0] or xCen > core[2] or yCen < core[1] or yCen > core[3]:
+            continue
+        found.append([(span.getY(), span.getX0(), span.getX1()) for span in cr.getSpans()])
+    return found, pixels
+
 class Repair(pipProc.Process):
     def __init__(self, keepCRs=False, *args, **kwargs):
         super(Repair, self).__init__(*args, **kwargs)
@@ -78,12 +150,20 @@ class Repair(pipProc.Process):
         policy = self.config['cosmicray'].getPolicy()
         mi = exposure.getMaskedImage()
         bg = afwMath.makeStatistics(mi, afwMath.MEDIAN).getValue()
-        crs = measAlg.findCosmicRays(mi, psf, bg, policy, self._keepCRs)
+        tiling = self.config['repair'] if self.config.has_key('repair') else None
+        if tiling is not None and tiling['crTilesX'] * tiling['crTilesY'] > 1:
+            crs = self.tiledCosmicRays(mi, psf, bg, policy, tiling)
+        else:
+            crs = measAlg.findCosmicRays(mi, psf, bg, policy, self._keepCRs)
         num = 0
         if crs is not None:
             mask = mi.getMask()
             crBit = mask.getPlaneBitMask("CR")
-            afwDet.setMaskFromFootprintList(mask, crs, crBit)
+            if isinstance(crs, list):
+                for cr in crs:
+                    afwDet.setMaskFromFootprint(mask, cr, crBit)
+            else:
+                afwDet.setMaskFromFootprintList(mask, crs, crBit)
             num = len(crs)
 
             if display and displayCR:
@@ -100,3 +180,52 @@ class Repair(pipProc.Process):
         self.log.log(self.log.INFO, "Identified %d cosmic rays." % num)
         return
 
+    def tiledCosmicRays(self, maskedImage, psf, background, policy, tiling):
+        """Find cosmic rays on overlapping tiles in parallel
+
+        The tiles are processed by a pool of processes, or threads if we are ourselves a daemon (e.g., a pool
+        worker), which may not have children.  The core of each processed tile (image, with the repaired
+        pixels; mask, with the CR and INTRP bits; and variance) is copied back into the masked image.
+
+        @param maskedImage Masked image to process
+        @param psf PSF
+        @param background Background level
+        @param policy Cosmic ray policy
+        @param tiling Repair configuration, specifying the tiles
+        @return List of cosmic ray footprints
+        """
+        tiles = crTiles(maskedImage.getWidth(), maskedImage.getHeight(),
+                        tiling['crTilesX'], tiling['crTilesY'], tiling['crOverlap'])
+        numWorkers = tiling['crProcesses'] if tiling['crProcesses'] > 0 else multiprocessing.cpu_count()
+        numWorkers = min(numWorkers, len(tiles))
+
+        _tileState.update(maskedImage=maskedImage, psf=psf, background=background, policy=policy,
+                          keep=self._keepCRs)
+        if multiprocessing.current_process().daemon:
+            pool = multiprocessing.pool.ThreadPool(numWorkers)
+        else:
+            pool = multiprocessing.Pool(numWorkers)
+        try:
+            results = pool.map(_findCosmicRaysInTile, tiles)
+        finally:
+            pool.close()
+            pool.join()
+            _tileState.clear()
+
+        crs = list()
+        for (tile, core), (found, pixels) in zip(tiles, results):
+            box = afwGeom.Box2I(afwGeom.Point2I(core[0], core[1]), afwGeom.Point2I(core[2], core[3]))
+            target = maskedImage.Factory(maskedImage, box, afwImage.LOCAL)
+            for plane, array in zip((target.getImage(), target.getMask(), target.getVariance()), pixels):
+                plane.getArray()[:] = array
+            del target
+            for spans in found:
+                foot = afwDet.Footprint()
+                for y, spanX0, spanX1 in spans:
+                    foot.addSpan(y, spanX0, spanX1)
+                foot.normalize()
+                crs.append(foot)
+
+        self.log.log(self.log.INFO, "Searched %d tiles for cosmic rays with %d workers" %
+                     (len(tiles), numWorkers))
+        return crs
@@ -11,6 +11,7 @@ import lsst.pipette.processCcd as pipCcd
 import lsst.pipette.options as pipOptions
 import lsst.pipette.catalog as pipCatalog
 import lsst.pipette.readwrite as pipReadWrite
+import lsst.pipette.prefetch as pipPrefetch
 import lsst.pipette.phot as pipPhot
 
 import lsst.pipette.ioHacks as pipExtraIO
@@ -30,12 +31,10 @@ class DeferredHSCState(object):
     def __str__(self):
         return "DeferredHSCState(id=%s, exposure=%s)" % (self.dataId, self.exposure)
     
-def run(rerun,                          # Rerun name
-        frame,                          # Frame number
-        ccd,                            # CCD number
-        config,                         # Configuration
-        log = pexLog.Log.getDefaultLog(), # Log object
+def makeMapper(rerun,                   # Rerun name
+               config,                  # Configuration
     ):
+    """Return a new mapper for the camera"""
 
     # Make our own mappers for now
     mapperArgs = {'rerun': rerun}       # Arguments for mapper instantiation
@@ -50,35 +49,74 @@ def run(rerun,                          # Rerun name
     
     camera = config['camera']
     if camera.lower() in ("hsc"):
-        mapper = obsHsc.HscSimMapper(**mapperArgs)
-        ccdProc = pipCcd.ProcessCcd(config=config, Calibrate=CalibrateHscDc2, log=log)
+        return obsHsc.HscSimMapper(**mapperArgs)
     elif camera.lower() in ("suprimecam-mit", "sc-mit", "scmit", "suprimecam-old", "sc-old", "scold"):
-        mapper = obsSc.SuprimecamMapper(mit=True, **mapperArgs)
-        ccdProc = ProcessCcdSuprimeCam(config=config, log=log)
+        return obsSc.SuprimecamMapper(mit=True, **mapperArgs)
     elif camera.lower() in ("suprimecam", "suprime-cam", "sc"):
-        mapper = obsSc.SuprimecamMapper(**mapperArgs)
+        return obsSc.SuprimecamMapper(**mapperArgs)
+
+def setup(rerun,                        # Rerun name
+          config,                       # Configuration
+          log = pexLog.Log.getDefaultLog(), # Log object
+    ):
+    """Return the I/O and CCD processing objects for the camera"""
+    camera = config['camera']
+    if camera.lower() in ("hsc"):
+        ccdProc = pipCcd.ProcessCcd(config=config, Calibrate=CalibrateHscDc2, log=log)
+    elif camera.lower() in ("suprimecam-mit", "sc-mit", "scmit", "suprimecam-old", "sc-old", "scold",
+                            "suprimecam", "suprime-cam", "sc"):
         ccdProc = ProcessCcdSuprimeCam(config=config, log=log)
-        
-    io = pipReadWrite.ReadWrite(mapper, ['visit', 'ccd'], config=config)
 
-    oldUmask = os.umask(2)
-    if oldUmask != 2:
-        io.log.log(io.log.WARN, "pipette umask started as: %s" % (os.umask(2)))
+    io = pipReadWrite.ReadWrite(makeMapper(rerun, config), ['visit', 'ccd'], config=config)
+    return io, ccdProc
 
-    dataId = { 'visit': frame, 'ccd': ccd }
-    raws = io.readRaw(dataId)
+def readInputs(io, dataId, config):
+    """Read the inputs for a CCD: raw data and detrends if we need to run the ISR, else the calexp
+
+    This changes nothing but the caches of the I/O object, so it may be run ahead of processing, but the I/O
+    object (and its butlers) must not be used by another thread at the same time.
+
+    @return raws, detrends (None if not running the ISR), whether the raws are calexps
+    """
     detrends = io.detrends(dataId, config)
 
     if len([x for x in detrends if x]): # We need to run at least part of the ISR
-        raws = io.readRaw(dataId)
-    else:
-        io.fileKeys = ['visit', 'ccd']
+        return io.readRaw(dataId), detrends, False
+
+    fileKeys = io.fileKeys
+    io.fileKeys = ['visit', 'ccd']
+    try:
         try:
-            raws = io.read('calexp', dataId)
-            config['do']['calibrate']['repair']['cosmicray'] = False
+            return io.read('calexp', dataId), None, True
         except:
-            raws = io.readRaw(dataId)
-        detrends = None
+            return io.readRaw(dataId), None, False
+    finally:
+        io.fileKeys = fileKeys          # Don't leak into the next CCD
+
+def run(rerun,                          # Rerun name
+        frame,                          # Frame number
+        ccd,                            # CCD number
+        config,                         # Configuration
+        log = pexLog.Log.getDefaultLog(), # Log object
+        io = None,                      # I/O object, from setup
+        ccdProc = None,                 # CCD processing object, from setup
+        inputs = None,                  # Inputs, from readInputs
+    ):
+
+    if io is None or ccdProc is None:
+        io, ccdProc = setup(rerun, config, log=log)
+
+    oldUmask = os.umask(2)
+    if oldUmask != 2:
+        io.log.log(io.log.WARN, "pipette umask started as: %s" % (os.umask(2)))
+
+    dataId = { 'visit': frame, 'ccd': ccd }
+    if inputs is None:
+        inputs = readInputs(io, dataId, config)
+    raws, detrends, calexp = inputs
+    del inputs
+    if calexp:
+        config['do']['calibrate']['repair']['cosmicray'] = False
 
     exposure, psf, apcorr, brightSources, sources, matches, matchMeta = ccdProc.run(raws, detrends)
     io.write(dataId, exposure=None, psf=psf, sources=None)
@@ -117,14 +155,18 @@ def doMergeWcs(deferredState, wcs):
         hdrInfo = dict([(m, metadata.get(m)) for m in metadata.names()])
         filename = io.outButler.get('source_filename', dataId)[0]
         io.log.log(io.log.INFO, "writing sources to: %s" % (filename))
-        pipExtraIO.writeSourceSetAsFits(sources, filename, hdrInfo=hdrInfo, clobber=True, log=io.log)
+        def writeSources(sources, filename, hdrInfo):
+            pipExtraIO.writeSourceSetAsFits(sources, filename, hdrInfo=hdrInfo, clobber=True, log=io.log)
+        io.defer(writeSources, (sources, filename, hdrInfo))
 
     filename = io.outButler.get('matchFull_filename', dataId)[0]
     io.log.log(io.log.INFO, "writing match debugging info to: %s" % (filename))
-    try:
-        pipExtraIO.writeMatchListAsFits(matchlist, filename)
-    except Exception, e:
-        print "failed to write matchlist: %s" % (e)
+    def writeMatches(matchlist, filename):
+        try:
+            pipExtraIO.writeMatchListAsFits(matchlist, filename)
+        except Exception, e:
+            print "failed to write matchlist: %s" % (e)
+    io.defer(writeMatches, (matchlist, filename))
         
     deferredState.io.write(deferredState.dataId, sources=sources, exposure=exposure,
                            brightSources=deferredState.brightSources, matches=matchlist,
@@ -204,9 +246,18 @@ def main(argv=None):
         for ccd in range(int(c[0]), int(c[1])):
             ccds.append(ccd)
 
-    for ccd in ccds:
-        state = run(opts.rerun, int(opts.frame), ccd, config)
+    # The next CCD is read (if prefetch.depth > 0) while this one is processed.  The butlers can't be shared
+    # between threads, so the reading thread gets its own I/O object.
+    frame = int(opts.frame)
+    io, ccdProc = setup(opts.rerun, config)
+    readers = pipPrefetch.PerThread(lambda: pipReadWrite.ReadWrite(makeMapper(opts.rerun, config),
+                                                                   ['visit', 'ccd'], config=config), value=io)
+    read = lambda ccd: readInputs(readers.get(), { 'visit': frame, 'ccd': ccd }, config)
+    for ccd, inputs in pipPrefetch.prefetch(read, ccds, config=config):
+        state = run(opts.rerun, frame, ccd, config, io=io, ccdProc=ccdProc, inputs=inputs)
+        del inputs
         doMergeWcs(state, None)
+    io.flush()
 
 if __name__ == "__main__":
     main()
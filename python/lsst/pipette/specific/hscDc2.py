@@ -7,6 +7,7 @@ import lsst.afw.math as afwMath
 import lsst.meas.algorithms as measAlg
 import lsst.afw.display.ds9 as ds9
 import lsst.meas.algorithms as measAlg
+import lsst.pipette.stamps as pipStamps
 
 from lsst.pipette.specific.Hsc import CalibrateHsc
 
@@ -153,6 +154,7 @@ class CalibrateHscDc2(CalibrateHsc):
 
         psfCandidates = []
 
+        stars = list()
         for val in matches:
             ref, source = val[0:2]
             if not (ref.getFlagForDetection() & measAlg.Flags.STAR) or \
@@ -160,7 +162,15 @@ class CalibrateHscDc2(CalibrateHsc):
                 continue
             if source.getPsfFlux() <= 0.0:
                 continue
-            
+            stars.append(source)
+
+        # Extract all the stamps at once, so that unusable candidates can be rejected without making them
+        stamps = pipStamps.PsfStamps(exposure, stars, kernelSize + 2*borderWidth)
+        usable = stamps.usable()
+
+        for source, ok in zip(stars, usable):
+            if not ok:
+                continue
             try:
                 cand = measAlg.makePsfCandidate(source, mi)
                 #
@@ -171,11 +181,6 @@ class CalibrateHscDc2(CalibrateHsc):
                     cand.setWidth(kernelSize + 2*borderWidth)
                     cand.setHeight(kernelSize + 2*borderWidth)
 
-                im = cand.getImage().getImage()
-                max = afwMath.makeStatistics(im, afwMath.MAX).getValue()
-                if not numpy.isfinite(max):
-                    continue
-
                 if display and displayExposure:
                     ds9.dot("+", source.getXAstrom() - mi.getX0(), source.getYAstrom() - mi.getY0(),
                             size=4, frame=frame, ctype=ds9.CYAN)
@@ -5,6 +5,32 @@ import lsst.coadd.utils as coaddUtils
 
 import lsst.pipette.process as pipProcess
 import lsst.pipette.warp as pipWarp
+import lsst.pipette.footprintIndex as pipIndex
+
+def tileBoxes(xSize, ySize, tileSize):
+    """Divide an image into tiles
+
+    @param[in] xSize, ySize Dimensions of image
+    @param[in] tileSize Size of tiles, or 0 for a single tile
+    @return List of bounding boxes for tiles, in local coords
+    """
+    if tileSize <= 0:
+        tileSize = max(xSize, ySize)
+    tiles = list()
+    for yMin in range(0, ySize, tileSize):
+        for xMin in range(0, xSize, tileSize):
+            tiles.append(afwGeom.Box2I(afwGeom.Point2I(xMin, yMin),
+                                       afwGeom.Point2I(min(xMin + tileSize, xSize) - 1,
+                                                       min(yMin + tileSize, ySize) - 1)))
+    return tiles
+
+def tileFilename(basename, bbox):
+    """Filename for a tile of a stack
+
+    @param[in] basename Base of filename, without extension
+    @param[in] bbox Bounding box of tile, in local coords
+    """
+    return "%s-%d-%d.fits" % (basename, bbox.getMinX(), bbox.getMinY())
 
 
 class Stack(pipProcess.Process):
@@ -13,7 +39,7 @@ class Stack(pipProcess.Process):
         self._warp = Warp(**kwargs)
 
     
-    def run(self, identMatrix, butler, ra, dec, scale, xSize, ySize, ignore=False):
+    def run(self, identMatrix, butler, ra, dec, scale, xSize, ySize, ignore=False, output=None):
         """Warp and stack images
 
         @param[in] identMatrix Matrix of warp identifiers
@@ -24,22 +50,95 @@ class Stack(pipProcess.Process):
         @param[in] xSize Size in x
         @param[in] ySize Size in y
         @param[in] ignore Ignore missing files?
-        @output Stacked exposure
+        @param[in] output Function(bbox, tile) to receive each stacked tile as it is completed; required if
+        the skycell is divided into tiles (stack.tileSize), since the point of tiling is to never hold the
+        full stack
+        @output Stacked exposure, or None if tiles are sent to output
         """
         assert identMatrix, "No identMatrix provided"
 
         skycell = self.skycell(ra, dec, scale, xSize, ySize)
+        tiles = self.tiles(skycell)
+        if len(tiles) == 1 and output is None:
+            return self.stack(identMatrix, butler, skycell, ignore=ignore)
+        if output is None:
+            raise RuntimeError("Stacking in %d tiles (stack.tileSize) requires an output for the tiles" %
+                               len(tiles))
+
+        # Only one tile's worth of warps and weights is held at a time, and only the CCDs overlapping each
+        # tile are read for it
+        bounds = self.bounds(identMatrix, butler, skycell, ignore=ignore)
+        for num, bbox in enumerate(tiles):
+            self.log.log(self.log.INFO, "Stacking tile %d of %d: %d,%d --> %d,%d" % (num + 1, len(tiles),
+                         bbox.getMinX(), bbox.getMinY(), bbox.getMaxX(), bbox.getMaxY()))
+            overlaps = lambda ident: bounds[pipIndex.FootprintIndex.key(ident)] is not None and \
+                       bounds[pipIndex.FootprintIndex.key(ident)].overlaps(bbox)
+            tileMatrix = [filter(overlaps, identList) for identList in identMatrix]
+            tile = self.stack(tileMatrix, butler, self._warp.subSkycell(skycell, bbox), ignore=ignore)
+            output(bbox, tile)
+            del tile
+
+        return None
+
+    def bounds(self, identMatrix, butler, skycell, ignore=False):
+        """Bounding boxes of CCDs on a skycell, so CCDs may be selected for each tile without reading
+        their headers again
+
+        @param[in] identMatrix Matrix of warp identifiers
+        @param[in] butler Data butler
+        @param[in] skycell Skycell specification
+        @param[in] ignore Ignore missing files?
+        @return dict of footprint index key: bounding box on skycell (local coords), or None if the CCD
+        doesn't overlap or can't be read
+        """
+        bounds = dict()
+        for identList in identMatrix:
+            for ident in identList:
+                bounds[pipIndex.FootprintIndex.key(ident)] = None
+            for ident in self._warp.overlapping(identList, skycell):
+                header = self._warp.readHeader(butler, ident, ignore=ignore)
+                if header is None:
+                    continue
+                expWcs, width, height, fscale = header
+                bounds[pipIndex.FootprintIndex.key(ident)] = self._warp.bounds(expWcs, width, height, skycell)
+        return bounds
+
+    def tiles(self, skycell):
+        """Divide a skycell into tiles for stacking
+
+        @param[in] skycell Skycell specification
+        @return List of bounding boxes for tiles, in local coords
+        """
+        xSize, ySize = skycell.getDimensions()
+        tileSize = 0
+        if self.config.has_key('stack') and self.config['stack'].has_key('tileSize'):
+            tileSize = self.config['stack']['tileSize']
+        return tileBoxes(xSize, ySize, tileSize)
+
+    def stack(self, identMatrix, butler, skycell, ignore=False):
+        """Warp and stack images onto a skycell
 
+        @param[in] identMatrix Matrix of warp identifiers
+        @param[in] butler Data butler
+        @param[in] skycell Skycell specification
+        @param[in] ignore Ignore missing files?
+        @output Stacked exposure
+        """
+        xSize, ySize = skycell.getDimensions()
         coaddDim = afwGeom.Extent2I(xSize, ySize)
         coadd = afwImage.ExposureF(coaddDim, skycell.getWcs())
         weight = afwImage.ImageF(coaddDim)
 
         badpix = afwImage.MaskU.getPlaneBitMask("EDGE") # Allow everything else through
         for identList in identMatrix:
+            identList = self._warp.overlapping(identList, skycell)
+            if len(identList) == 0:
+                continue
             warp = self.warp(identList, butler, skycell, ignore=ignore)
             # XXX Save for later?
             
             coaddUtils.addToCoadd(coadd.getMaskedImage(), weight, warp.getMaskedImage(), badpix, 1.0)
+            del warp
 
         coaddUtils.setCoaddEdgeBits(coadd.getMaskedImage().getMask(), weight)
 
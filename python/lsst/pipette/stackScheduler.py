@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+import os
+import math
+import time
+import multiprocessing
+
+"""This module provides scheduling of sky-tile stacks on a local pool of processes."""
+
+# Bytes per pixel of a tile being stacked: coadd and warp (MaskedImageF), and their weights (ImageF)
+BYTES_PER_TILE_PIXEL = 2 * (4 + 2 + 4) + 2 * 4
+# Bytes per pixel of the shared buffers for parallel warping (image, mask, variance and weight)
+BYTES_PER_SHARED_PIXEL = 4 + 2 + 4 + 4
+# Bytes per pixel of a calexp being warped (ExposureF)
+BYTES_PER_CALEXP_PIXEL = 4 + 2 + 4
+# Number of pixels in a CCD
+CCD_PIXELS = 2048 * 4177
+# Smallest tile size (pixels) we'll use to meet a memory budget
+MIN_TILE_SIZE = 256
+
+class StackJob(object):
+    """A stack to make: a sky tile in a filter, with the inputs that overlap it
+
+    Attributes:
+    - tile: sky tile identifier
+    - filter: filter name
+    - visits: list of visits
+    - ccds: list of CCDs, or None for all
+    - ra, dec: centre of tile (degrees)
+    - size: size of (square) skycell (pixels)
+    - tileSize: stack.tileSize to use (0: whole skycell at once)
+    - warpProcesses: number of processes warping CCDs (stack.warpProcesses, resolved)
+    - calexps: number of calexps held at once while warping (see warpConcurrency)
+    """
+    def __init__(self, tile, filter, visits, ccds, ra, dec, size):
+        self.tile = tile
+        self.filter = filter
+        self.visits = visits
+        self.ccds = ccds
+        self.ra = ra
+        self.dec = dec
+        self.size = size
+        self.tileSize = 0
+        self.warpProcesses = 1
+        self.calexps = 1
+
+    def __str__(self):
+        return "tile %s (%s): %d visits" % (self.tile, self.filter, len(self.visits))
+
+    def numInputs(self, numCcds=1):
+        """Number of inputs (visit, CCD)
+
+        @param numCcds Number of CCDs per visit, if the CCDs aren't listed
+        """
+        return len(self.visits) * (len(self.ccds) if self.ccds is not None else numCcds)
+
+    def cost(self):
+        """Estimated cost: number of inputs times skycell area"""
+        return self.numInputs() * self.size**2
+
+    def memory(self):
+        """Estimated peak memory (bytes) for stacking, over all processes"""
+        side = min(self.tileSize, self.size) if self.tileSize > 0 else self.size
+        return fixedMemory(self.calexps) + side**2 * bytesPerTilePixel(self.warpProcesses)
+
+
+def warpConcurrency(config):
+    """Number of processes warping CCDs, and the number of calexps held at once while warping
+
+    Each process warping in parallel (stack.warpProcesses) holds a calexp; otherwise, one calexp is warped
+    while others are read ahead (prefetch.depth).
+
+    @param config Configuration
+    @return number of warping processes, number of calexps
+    """
+    processes = 1
+    if config.has_key('stack') and config['stack'].has_key('warpProcesses'):
+        processes = config['stack']['warpProcesses']
+        if processes <= 0:
+            processes = multiprocessing.cpu_count()
+    if processes != 1:
+        return processes, processes
+    depth = 0
+    if config.has_key('prefetch') and config['prefetch'].has_key('depth'):
+        depth = max(0, config['prefetch']['depth'])
+    return processes, 1 + depth
+
+
+def fixedMemory(calexps=1):
+    """Memory (bytes) for stacking that doesn't depend on the tile size: the calexps being warped
+
+    The full stacked skycell isn't held when tiling, since each tile is written as it is completed.
+
+    @param calexps Number of calexps held at once while warping
+    """
+    return calexps * CCD_PIXELS * BYTES_PER_CALEXP_PIXEL
+
+
+def bytesPerTilePixel(warpProcesses=1):
+    """Memory (bytes) per pixel of the tile being stacked
+
+    @param warpProcesses Number of processes warping CCDs; if not 1, the warp is accumulated in shared buffers
+    """
+    return BYTES_PER_TILE_PIXEL + (BYTES_PER_SHARED_PIXEL if warpProcesses != 1 else 0)
+
+
+def tileSizeForBudget(size, budget, calexps=1, warpProcesses=1):
+    """Tile size (stack.tileSize) that keeps the memory for stacking within a budget
+
+    The calexps being warped are held in memory regardless, so the budget can only be met by tiling if it
+    exceeds those; otherwise the smallest tile size (MIN_TILE_SIZE) is used.
+
+    @param size Size of skycell (pixels)
+    @param budget Memory budget (bytes), or 0 for no limit
+    @param calexps Number of calexps held at once while warping (see warpConcurrency)
+    @param warpProcesses Number of processes warping CCDs (see warpConcurrency)
+    @return Tile size, or 0 if the skycell may be stacked at once
+    """
+    available = budget - fixedMemory(calexps)
+    perPixel = bytesPerTilePixel(warpProcesses)
+    if budget <= 0 or size**2 * perPixel <= available:
+        return 0
+    if available <= 0:
+        return min(MIN_TILE_SIZE, size)
+    return min(size, max(MIN_TILE_SIZE, int(math.sqrt(available / perPixel))))
+
+
+def order(jobList):
+    """Order jobs by decreasing estimated cost, so the longest don't start last"""
+    return sorted(jobList, key=lambda job: job.cost(), reverse=True)
+
+
+def outputCurrent(outputPath, inputPaths):
+    """Is an output current: does it exist, and is it newer than all the inputs?
+
+    @param outputPath Filename of output
+    @param inputPaths Filenames of inputs (those that are None or don't exist are ignored)
+    """
+    if outputPath is None or not os.path.exists(outputPath):
+        return False
+    outputTime = os.path.getmtime(outputPath)
+    for path in inputPaths:
+        if path is not None and os.path.exists(path) and os.path.getmtime(path) > outputTime:
+            return False
+    return True
+
+
+_schedulerState = dict()                # State for scheduler workers; inherited on fork
+
+def _runJob(index):
+    """Run a single job for runJobs
+
+    @param index Index of job in the list of jobs
+    @return index, elapsed time (sec), error message (or None)
+    """
+    job = _schedulerState['jobList'][index]
+    start = time.time()
+    try:
+        _schedulerState['function'](job)
+        error = None
+    except Exception, e:
+        error = "%s: %s" % (e.__class__.__name__, e)
+    return index, time.time() - start, error
+
+
+def runJobs(jobList, function, processes=1):
+    """Run jobs concurrently on a pool of processes
+
+    Each worker process runs a single job, so that memory is returned between jobs.  Exceptions raised by a
+    job are reported rather than propagated, so that the other jobs may continue.
+
+    @param jobList List of jobs, in order of submission
+    @param function Function(job) that runs a job
+    @param processes Number of processes; if 1, jobs are run serially in this process
+    @return Iterator over (job, elapsed time in sec, error message or None), in order of completion
+    """
+    _schedulerState.update(jobList=jobList, function=function)
+    try:
+        if processes > 1 and not multiprocessing.current_process().daemon:
+            pool = multiprocessing.Pool(processes=processes, maxtasksperchild=1)
+            try:
+                for index, elapsed, error in pool.imap_unordered(_runJob, range(len(jobList))):
+                    yield jobList[index], elapsed, error
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for index in range(len(jobList)):
+                index, elapsed, error = _runJob(index)
+                yield jobList[index], elapsed, error
+    finally:
+        _schedulerState.clear()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import numpy
+
+"""This module provides a store of postage stamps around PSF candidates."""
+
+class PsfStamps(object):
+    """Postage stamps around PSF candidates, extracted once into a contiguous array
+
+    Attributes:
+    - images: stamp pixels, as an array of shape (number, size, size); NaN off the image
+    - masks: stamp mask pixels, of the same shape (zero off the image)
+    - origins: lower-left corner (x, y) of each stamp, in parent coordinates
+    - inside: whether each stamp lies entirely on the image
+    - flags: OR of the mask pixels in each stamp
+    """
+    def __init__(self, exposure, sources, size):
+        """Extract stamps
+
+        @param exposure Exposure from which to extract stamps
+        @param sources Sources on which to centre the stamps
+        @param size Size of each (square) stamp, pixels
+        """
+        mi = exposure.getMaskedImage()
+        image = mi.getImage().getArray()
+        mask = mi.getMask().getArray()
+        height, width = image.shape
+        x0, y0 = mi.getX0(), mi.getY0()
+
+        num = len(sources)
+        half = size // 2
+        self.size = size
+        self.images = numpy.empty((num, size, size), dtype=image.dtype)
+        self.images.fill(numpy.nan)
+        self.masks = numpy.zeros((num, size, size), dtype=mask.dtype)
+        self.origins = numpy.empty((num, 2), dtype=int)
+        self.inside = numpy.zeros(num, dtype=bool)
+
+        for i, source in enumerate(sources):
+            xMin = int(source.getXAstrom() + 0.5) - x0 - half
+            yMin = int(source.getYAstrom() + 0.5) - y0 - half
+            self.origins[i] = (xMin + x0, yMin + y0)
+            xLo, xHi = max(0, xMin), min(width, xMin + size)
+            yLo, yHi = max(0, yMin), min(height, yMin + size)
+            if xLo >= xHi or yLo >= yHi:
+                continue
+            self.inside[i] = (xLo == xMin and yLo == yMin and xHi == xMin + size and yHi == yMin + size)
+            self.images[i, yLo - yMin:yHi - yMin, xLo - xMin:xHi - xMin] = image[yLo:yHi, xLo:xHi]
+            self.masks[i, yLo - yMin:yHi - yMin, xLo - xMin:xHi - xMin] = mask[yLo:yHi, xLo:xHi]
+
+        self.flags = numpy.bitwise_or.reduce(self.masks.reshape(num, -1), axis=1) if num > 0 else \
+                     numpy.zeros(0, dtype=mask.dtype)
+
+    def __len__(self):
+        return len(self.images)
+
+    def maxima(self):
+        """Maximum of each stamp, ignoring NaNs (as for afwMath.MAX)"""
+        num = len(self.images)
+        if num == 0:
+            return numpy.zeros(0)
+        values = numpy.where(numpy.isnan(self.images), -numpy.inf, self.images)
+        return values.reshape(num, -1).max(axis=1)
+
+    def usable(self, badBits=0):
+        """Which stamps are usable: entirely on the image, with a finite maximum and no bad mask bits?
+
+        @param badBits Mask bits that disqualify a stamp
+        @return Boolean array
+        """
+        good = self.inside & numpy.isfinite(self.maxima())
+        if badBits:
+            good &= (self.flags & badBits) == 0
+        return good
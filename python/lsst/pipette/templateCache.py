@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import os
+import json
+import hashlib
+
+import lsst.afw.geom as afwGeom
+
+"""This module provides a cache of the template-side products of PSF matching (the candidate stamps found on
+the template), so that differencing many epochs against the same template needs to find them only once."""
+
+cacheBuffer = dict()                    # Buffer of caches, by directory
+
+def getTemplateCache(config):
+    """Return the template cache nominated in the configuration (roots.templateCache), or an in-memory cache"""
+    root = None
+    if config.has_key('roots') and config['roots'].has_key('templateCache'):
+        root = os.path.expanduser(config['roots']['templateCache'])
+    if not cacheBuffer.has_key(root):
+        cacheBuffer[root] = TemplateCache(root)
+    return cacheBuffer[root]
+
+
+class TemplateCache(object):
+    """Cache of candidate PSF-matching stamps (bounding boxes) for templates
+
+    Stamps are kept in memory, and also (if a directory is provided) in a JSON file per template so they
+    persist between runs.  The key for a template covers its identifier, its bounding box and the
+    PSF-matching policy used to find the stamps.
+    """
+    def __init__(self, root=None):
+        """Initialisation
+
+        @param root Directory for cache (created if it doesn't exist), or None to cache in memory only
+        """
+        self.root = root
+        if root is not None and not os.path.isdir(root):
+            os.makedirs(root)
+        self._stamps = dict()           # Stamps, by key
+
+    @staticmethod
+    def key(templateId, bbox, policy):
+        """Key for a template
+
+        @param templateId Identifier for template (e.g., data identifier; must be JSON-serialisable)
+        @param bbox Parent bounding box of template
+        @param policy PSF-matching policy
+        """
+        key = hashlib.sha1()
+        key.update(json.dumps(templateId, sort_keys=True))
+        key.update(repr((bbox.getMinX(), bbox.getMinY(), bbox.getWidth(), bbox.getHeight())))
+        key.update(policy.toString())
+        return key.hexdigest()
+
+    def path(self, key):
+        """Filename for the stamps of a template, or None if not persisting"""
+        if self.root is None:
+            return None
+        return os.path.join(self.root, key + ".json")
+
+    def get(self, key):
+        """Return the list of stamps (afwGeom.Box2I) for a template, or None if not cached"""
+        if self._stamps.has_key(key):
+            return self._stamps[key]
+        path = self.path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        fd = open(path)
+        try:
+            corners = json.load(fd)
+        finally:
+            fd.close()
+        stamps = [afwGeom.Box2I(afwGeom.Point2I(xMin, yMin), afwGeom.Point2I(xMax, yMax))
+                  for xMin, yMin, xMax, yMax in corners]
+        self._stamps[key] = stamps
+        return stamps
+
+    def put(self, key, stamps):
+        """Cache the list of stamps (afwGeom.Box2I) for a template"""
+        self._stamps[key] = stamps
+        path = self.path(key)
+        if path is None:
+            return
+        corners = [(box.getMinX(), box.getMinY(), box.getMaxX(), box.getMaxY()) for box in stamps]
+        # Write and rename, so a partially-written file is never read
+        fd = open(path + ".tmp", "w")
+        try:
+            json.dump(corners, fd)
+        finally:
+            fd.close()
+        os.rename(path + ".tmp", path)
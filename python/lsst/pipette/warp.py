@@ -21,12 +21,54 @@
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
 
+import ctypes
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.sharedctypes
+import numpy
+
 import lsst.afw.coord as afwCoord
 import lsst.afw.math as afwMath
 import lsst.afw.geom as afwGeom
 import lsst.afw.image as afwImage
 import lsst.coadd.utils as coaddUtils
 import lsst.pipette.process as pipProc
+import lsst.pipette.footprintIndex as pipIndex
+
+_warpState = dict()                     # State for parallel warping workers; inherited on fork
+
+def _warpIdent(index):
+    """Warp a single CCD for Warp.parallelWarp, adding it into the shared buffers
+
+    @param index Index of the CCD in the list of locations
+    @return Whether the CCD was warped
+    """
+    state = _warpState
+    proc = state['process']
+    component = proc.loadComponent(state['locations'][index])
+    if component is None:
+        return False
+    exp, bbox = component
+    target = proc.warpTarget(state['warp'], exp, bbox).getMaskedImage()
+    del exp
+
+    image = target.getImage().getArray()
+    mask = target.getMask().getArray()
+    variance = target.getVariance().getArray()
+    good = (mask & afwImage.MaskU.getPlaneBitMask("EDGE")) == 0 # Allow everything else through
+
+    box = (slice(bbox.getMinY(), bbox.getMaxY() + 1), slice(bbox.getMinX(), bbox.getMaxX() + 1))
+    arrays = state['arrays']
+    state['lock'].acquire()
+    try:
+        arrays['image'][box][good] += image[good]
+        arrays['mask'][box][good] |= mask[good]
+        arrays['variance'][box][good] += variance[good]
+        arrays['weight'][box][good] += 1.0
+    finally:
+        state['lock'].release()
+    return True
+
 
 class Skycell(object):
     def __init__(self, wcs, width, height):
@@ -75,9 +117,23 @@ class Warp(pipProc.Process):
         wcs = afwImage.makeWcs(crval, crpix, -scale / 3600.0, 0.0, 0.0, scale / 3600.0)
         return Skycell(wcs, xSize, ySize)
 
+    def subSkycell(self, skycell, bbox):
+        """Define a skycell covering part of another
+
+        @param[in] skycell Parent skycell
+        @param[in] bbox Bounding box of the part of interest, in the parent's pixels
+        @return Skycell
+        """
+        wcs = skycell.getWcs().clone()
+        wcs.shiftReferencePixel(-bbox.getMinX(), -bbox.getMinY())
+        return Skycell(wcs, bbox.getWidth(), bbox.getHeight())
+
     def warp(self, identList, butler, skycell, ignore=False):
         """Warp an exposure to a nominated skycell
 
+        CCDs are warped in parallel if stack.warpProcesses is not 1; otherwise, they may be read ahead of
+        warping (prefetch.depth).
+
         @param[in] identList List of data identifiers
         @param[in] butler Data butler
         @param[in] skycell Skycell specification
@@ -90,55 +146,237 @@ class Warp(pipProc.Process):
         warpImage = afwImage.MaskedImageF(xSize, ySize)
         warp = afwImage.ExposureF(warpImage, skyWcs)
         weight = afwImage.ImageF(xSize, ySize)
-        
-        for ident in identList:
-            try:
-                md = self.read(butler, ident, ["calexp_md"], ignore=ignore)
-            except RuntimeError as e:
-                self.log.log(self.log.WARN, e.__str__())
-                continue
-            if md is None or len(md) == 0:
-                self.log.log(self.log.WARN, "Unable to read %s --- ignoring" % ident)
-                continue
-            md = md[0]
-            width, height = md.get("NAXIS1"), md.get("NAXIS2")
-            # Read wcs created by hscMosaic
-            md_wcs = self.read(butler, ident, ["wcs_md"], ignore=ignore)
-            if md_wcs is None or len(md_wcs) == 0:
-                expWcs = afwImage.makeWcs(md)
-                fscale = 1.0
-            else:
-                expWcs = afwImage.makeWcs(md_wcs[0])
-                fscale = md_wcs[0].get('FSCALE')
-
-            xSkycell = list()
-            ySkycell = list()
-            for x, y in ((0.0, 0.0), (0.0, height), (width, 0.0), (width, height)):
-                sky = expWcs.pixelToSky(x, y)
-                position = skyWcs.skyToPixel(sky)
-                xSkycell.append(position.getX())
-                ySkycell.append(position.getY())
-
-            xMin = max(0, int(min(xSkycell)))
-            xMax = min(xSize - 1, int(max(xSkycell) + 0.5))
-            yMin = max(0, int(min(ySkycell)))
-            yMax = min(ySize - 1, int(max(ySkycell) + 0.5))
-            self.log.log(self.log.INFO, "Bounds of image: %d,%d --> %d,%d" % (xMin, yMin, xMax, yMax))
-            if xMin < xSize and xMax >= 0 and yMin < ySize and yMax >= 0:
-                bbox = afwGeom.Box2I(afwGeom.Point2I(xMin, yMin), afwGeom.Point2I(xMax, yMax))
-                exp = self.read(butler, ident, ["calexp"], ignore=ignore)[0]
-                mi = exp.getMaskedImage()
-                mi *= fscale
+
+        identList = self.overlapping(identList, skycell)
+        processes = self.processes()
+        if processes != 1 and len(identList) > 1:
+            self.parallelWarp(warp, weight, identList, butler, skycell, processes, ignore=ignore)
+        else:
+            locate = lambda ident: self.locateComponent(butler, ident, skycell, ignore=ignore)
+            for ident, component in self.prefetch(self.loadComponent, identList, locate=locate):
+                if component is None:
+                    continue
+                exp, bbox = component
                 self.warpComponent(warp, weight, exp, bbox)
-                del exp
-            del md
+                del exp, component
 
         # XXX Check that every pixel in the weight is either 1 or 0
 
         coaddUtils.setCoaddEdgeBits(warp.getMaskedImage().getMask(), weight)
 
         return warp
- 
+
+    def warpMany(self, identList, butler, skycells, ignore=False):
+        """Warp exposures to several skycells at once
+
+        Each CCD is read once, and warped onto every skycell it overlaps.
+
+        @param[in] identList List of data identifiers
+        @param[in] butler Data butler
+        @param[in] skycells List of skycell specifications
+        @param[in] ignore Ignore missing files?
+        @return List of warped exposures, one for each skycell
+        """
+        warps = list()
+        weights = list()
+        for skycell in skycells:
+            xSize, ySize = skycell.getDimensions()
+            warps.append(afwImage.ExposureF(afwImage.MaskedImageF(xSize, ySize), skycell.getWcs()))
+            weights.append(afwImage.ImageF(xSize, ySize))
+
+        wanted = set()
+        for skycell in skycells:
+            wanted.update(pipIndex.FootprintIndex.key(ident) for ident in self.overlapping(identList, skycell))
+
+        for ident in identList:
+            if not pipIndex.FootprintIndex.key(ident) in wanted:
+                continue
+            header = self.readHeader(butler, ident, ignore=ignore)
+            if header is None:
+                continue
+            expWcs, width, height, fscale = header
+            boxes = [(i, self.bounds(expWcs, width, height, skycell)) for i, skycell in enumerate(skycells)]
+            boxes = [(i, bbox) for i, bbox in boxes if bbox is not None]
+            if len(boxes) == 0:
+                continue
+            exp = self.read(butler, ident, ["calexp"], ignore=ignore)[0]
+            mi = exp.getMaskedImage()
+            mi *= fscale
+            for i, bbox in boxes:
+                self.warpComponent(warps[i], weights[i], exp, bbox)
+            del exp
+
+        for warp, weight in zip(warps, weights):
+            coaddUtils.setCoaddEdgeBits(warp.getMaskedImage().getMask(), weight)
+
+        return warps
+
+    def processes(self):
+        """Number of processes to use for warping"""
+        if not self.config.has_key('stack') or not self.config['stack'].has_key('warpProcesses'):
+            return 1
+        processes = self.config['stack']['warpProcesses']
+        return processes if processes > 0 else multiprocessing.cpu_count()
+
+    def parallelWarp(self, warp, weight, identList, butler, skycell, processes, ignore=False):
+        """Warp CCDs in parallel, accumulating into shared memory
+
+        Each worker warps a CCD into its own sub-box, and adds the result into image, mask, variance and
+        weight buffers shared by all workers; the addition is serialised with a lock, since CCDs may overlap
+        slightly.  The buffers are then copied into the warp and weight.  A pool of threads is used if we are
+        ourselves a daemon (e.g., a pool worker), which may not have children.
+
+        The butler's registry may only be used by the thread that opened it, so the CCDs are located (see
+        locateComponent) here, and the workers read them by filename.
+
+        @param[out] warp Warped exposure
+        @param[out] weight Accumulated weight map
+        @param[in] identList List of data identifiers
+        @param[in] butler Data butler
+        @param[in] skycell Skycell specification
+        @param[in] processes Number of processes
+        @param[in] ignore Ignore missing files?
+        """
+        xSize, ySize = skycell.getDimensions()
+        mi = warp.getMaskedImage()
+        arrays = dict()
+        for name, image in (("image", mi.getImage()), ("mask", mi.getMask()),
+                            ("variance", mi.getVariance()), ("weight", weight)):
+            array = image.getArray()
+            raw = multiprocessing.sharedctypes.RawArray(ctypes.c_byte, array.nbytes)
+            arrays[name] = numpy.frombuffer(raw, dtype=array.dtype).reshape(array.shape)
+
+        locations = [self.locateComponent(butler, ident, skycell, ignore=ignore) for ident in identList]
+        _warpState.update(process=self, locations=locations, warp=warp, arrays=arrays,
+                          lock=multiprocessing.Lock())
+        numWorkers = min(processes, len(identList))
+        if multiprocessing.current_process().daemon:
+            pool = multiprocessing.pool.ThreadPool(numWorkers)
+        else:
+            pool = multiprocessing.Pool(numWorkers)
+        try:
+            num = sum(pool.map(_warpIdent, range(len(identList))))
+        finally:
+            pool.close()
+            pool.join()
+            _warpState.clear()
+        self.log.log(self.log.INFO, "Warped %d of %d CCDs with %d workers" % (num, len(identList), numWorkers))
+
+        mi.getImage().getArray()[:] = arrays["image"]
+        mi.getMask().getArray()[:] = arrays["mask"]
+        mi.getVariance().getArray()[:] = arrays["variance"]
+        weight.getArray()[:] = arrays["weight"]
+
+    def bounds(self, expWcs, width, height, skycell):
+        """Bounding box of a CCD on a skycell
+
+        @param[in] expWcs WCS of CCD
+        @param[in] width, height Dimensions of CCD
+        @param[in] skycell Skycell specification
+        @return Bounding box on skycell, in local coords, or None if the CCD doesn't overlap
+        """
+        skyWcs = skycell.getWcs()
+        xSize, ySize = skycell.getDimensions()
+
+        xSkycell = list()
+        ySkycell = list()
+        for x, y in ((0.0, 0.0), (0.0, height), (width, 0.0), (width, height)):
+            sky = expWcs.pixelToSky(x, y)
+            position = skyWcs.skyToPixel(sky)
+            xSkycell.append(position.getX())
+            ySkycell.append(position.getY())
+
+        xMin = max(0, int(min(xSkycell)))
+        xMax = min(xSize - 1, int(max(xSkycell) + 0.5))
+        yMin = max(0, int(min(ySkycell)))
+        yMax = min(ySize - 1, int(max(ySkycell) + 0.5))
+        self.log.log(self.log.INFO, "Bounds of image: %d,%d --> %d,%d" % (xMin, yMin, xMax, yMax))
+        if xMin < xSize and xMax >= 0 and yMin < ySize and yMax >= 0:
+            return afwGeom.Box2I(afwGeom.Point2I(xMin, yMin), afwGeom.Point2I(xMax, yMax))
+        return None
+
+    def locateComponent(self, butler, ident, skycell, ignore=False):
+        """Locate a CCD, if it overlaps a skycell, so it may be read without the butler (see loadComponent)
+
+        @param[in] butler Data butler
+        @param[in] ident Data identifier
+        @param[in] skycell Skycell specification
+        @param[in] ignore Ignore missing files?
+        @return Filename, bounding box on skycell, flux scale; or None
+        """
+        header = self.readHeader(butler, ident, ignore=ignore)
+        if header is None:
+            return None
+        expWcs, width, height, fscale = header
+        bbox = self.bounds(expWcs, width, height, skycell)
+        if bbox is None:
+            return None
+        filename = self.locate(butler, ident, "calexp", ignore=ignore)
+        if filename is None:
+            return None
+        return filename, bbox, fscale
+
+    def loadComponent(self, location):
+        """Read a CCD found by locateComponent; this doesn't use the butler, so it may be done ahead
+
+        @param[in] location Filename, bounding box on skycell, flux scale; or None
+        @return Exposure (flux-scaled), bounding box on skycell; or None
+        """
+        if location is None:
+            return None
+        filename, bbox, fscale = location
+        exp = self.readExposure(filename)
+        mi = exp.getMaskedImage()
+        mi *= fscale
+        return exp, bbox
+
+    def readHeader(self, butler, ident, ignore=False):
+        """Read the WCS and dimensions of a CCD
+
+        The WCS created by hscMosaic is preferred, if present.
+
+        @param[in] butler Data butler
+        @param[in] ident Data identifier
+        @param[in] ignore Ignore missing files?
+        @return WCS, width, height, flux scale; or None if the header can't be read
+        """
+        try:
+            md = self.read(butler, ident, ["calexp_md"], ignore=ignore)
+        except RuntimeError as e:
+            self.log.log(self.log.WARN, e.__str__())
+            return None
+        if md is None or len(md) == 0:
+            self.log.log(self.log.WARN, "Unable to read %s --- ignoring" % ident)
+            return None
+        md = md[0]
+        width, height = md.get("NAXIS1"), md.get("NAXIS2")
+        # Read wcs created by hscMosaic
+        md_wcs = self.read(butler, ident, ["wcs_md"], ignore=ignore)
+        if md_wcs is None or len(md_wcs) == 0:
+            expWcs = afwImage.makeWcs(md)
+            fscale = 1.0
+        else:
+            expWcs = afwImage.makeWcs(md_wcs[0])
+            fscale = md_wcs[0].get('FSCALE')
+        return expWcs, width, height, fscale
+
+    def overlapping(self, identList, skycell):
+        """Prune the list of CCDs to those overlapping a skycell, using the footprint index
+
+        CCDs not in the index are retained.  If no index is configured, the list is returned unchanged.
+
+        @param[in] identList List of data identifiers
+        @param[in] skycell Skycell specification
+        @return List of data identifiers
+        """
+        index = pipIndex.getIndex(self.config)
+        if index is None:
+            return identList
+        width, height = skycell.getDimensions()
+        footprint = pipIndex.SkyFootprint.fromWcs(skycell.getWcs(), width, height)
+        pruned = index.prune(identList, footprint)
+        self.log.log(self.log.INFO, "Footprint index selects %d of %d CCDs" % (len(pruned), len(identList)))
+        return pruned
 
     def warpComponent(self, warp, weight, exposure, bbox):
         """Warp a component to a specified skycell
@@ -148,8 +386,24 @@ class Warp(pipProc.Process):
         @param[in] exposure Exposure component to process
         @param[in] bbox Bounding box for component on warp, in local coords
         """
-        target = warp.Factory(warp.getDimensions(), warp.getWcs())
-        subTarget = target.Factory(target, bbox, afwImage.LOCAL)
+        subTarget = self.warpTarget(warp, exposure, bbox)
+
+        subWarp = warp.getMaskedImage().Factory(warp.getMaskedImage(), bbox, afwImage.LOCAL)
+        subWeight = weight.Factory(weight, bbox, afwImage.LOCAL)
+
+        badpix = afwImage.MaskU.getPlaneBitMask("EDGE") # Allow everything else through
+        coaddUtils.addToCoadd(subWarp, subWeight, subTarget.getMaskedImage(), badpix, 1.0)
+
+    def warpTarget(self, warp, exposure, bbox):
+        """Warp a component onto a sub-box of a skycell
+
+        @param[in] warp Warped exposure (for WCS and dimensions)
+        @param[in] exposure Exposure component to process
+        @param[in] bbox Bounding box for component on warp, in local coords
+        @return Warped component, covering bbox
+        """
+        # Only the part of the warp covered by the component is needed
+        subTarget = warp.Factory(warp, bbox, afwImage.LOCAL, True)
 
         policy = self.config["warp"]
         kernel = afwMath.makeWarpingKernel(policy["warpingKernelName"])
@@ -157,9 +411,4 @@ class Warp(pipProc.Process):
         interpLength = policy["interpLength"]
 
         afwMath.warpExposure(subTarget, exposure, kernel, interpLength)
-
-        subWarp = warp.getMaskedImage().Factory(warp.getMaskedImage(), bbox, afwImage.LOCAL)
-        subWeight = weight.Factory(weight, bbox, afwImage.LOCAL)
-
-        badpix = afwImage.MaskU.getPlaneBitMask("EDGE") # Allow everything else through
-        coaddUtils.addToCoadd(subWarp, subWeight, subTarget.getMaskedImage(), badpix, 1.0)
+        return subTarget
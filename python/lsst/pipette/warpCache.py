@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+import os
+import json
+import math
+import hashlib
+
+import lsst.pex.logging as pexLog
+import lsst.afw.detection as afwDetection
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
+import lsst.afw.math as afwMath
+import lsst.ip.diffim as ipDiffIm
+import lsst.pipette.mappedExposure as pipMapped
+
+"""This module provides PSF-matching and warping of exposures for coaddition, with a cache of the results
+that is shared between coadd runs (and coadd flavours)."""
+
+FWHMPerSigma = 2 * math.sqrt(2 * math.log(2))
+
+def getWarpCache(desFwhm, coaddWcs, coaddBBox, policy):
+    """Return the warp cache nominated in the policy (roots.warpCache), or None"""
+    if not policy.exists("roots") or not policy.getPolicy("roots").exists("warpCache"):
+        return None
+    root = os.path.expanduser(policy.getPolicy("roots").get("warpCache"))
+    return WarpCache(root, desFwhm, coaddWcs, coaddBBox, policy)
+
+
+def _badMaskPlanes(policy):
+    """Names of the bad mask planes in a coadd policy (coaddPolicy.badMaskPlanes)"""
+    return list(policy.getPolicy("coaddPolicy").getArray("badMaskPlanes"))
+
+
+def _filename(butler, datasetType, dataId):
+    """Filename of a dataset, or None if it can't be determined"""
+    try:
+        return butler.mapper.map(datasetType, dataId).getLocations()[0]
+    except Exception:
+        return None
+
+
+class WarpCache(object):
+    """Cache of PSF-matched warps, keyed by content
+
+    The key for an exposure covers its data identifier, the modification time and size of its calexp and psf
+    files, the desired FWHM, the coadd WCS and bounding box, and the warping and PSF-matching policies, so a
+    cached warp is only used where it would be reproduced exactly.  Warps are stored in the memory-mappable
+    format of lsst.pipette.mappedExposure.
+    """
+    def __init__(self, root, desFwhm, coaddWcs, coaddBBox, policy):
+        """Initialisation
+
+        @param root Directory for cache; created if it doesn't exist
+        @param desFwhm Desired FWHM (pixels), or 0 for no PSF matching
+        @param coaddWcs WCS of coadd
+        @param coaddBBox Bounding box of coadd
+        @param policy Coadd policy, containing warpPolicy, psfMatchPolicy and coaddPolicy
+        """
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+        context = hashlib.sha1()
+        context.update(repr(desFwhm))
+        md = coaddWcs.getFitsMetadata()
+        for name in sorted(md.names()):
+            context.update("%s=%r;" % (name, md.get(name)))
+        context.update(repr((coaddBBox.getMinX(), coaddBBox.getMinY(),
+                             coaddBBox.getWidth(), coaddBBox.getHeight())))
+        context.update(policy.getPolicy("warpPolicy").toString())
+        if desFwhm > 0:
+            context.update(policy.getPolicy("psfMatchPolicy").toString())
+        # The statistics stored with each warp depend upon the bad mask planes
+        context.update(repr(_badMaskPlanes(policy)))
+        self._context = context
+
+    def key(self, dataId, butler):
+        """Key for an exposure, or None if the inputs can't be identified"""
+        key = self._context.copy()
+        key.update(json.dumps(dataId, sort_keys=True))
+        for datasetType in ("calexp", "psf"):
+            filename = _filename(butler, datasetType, dataId)
+            if filename is None or not os.path.exists(filename):
+                return None
+            stat = os.stat(filename)
+            key.update("%s:%r:%d;" % (datasetType, stat.st_mtime, stat.st_size))
+        return key.hexdigest()
+
+    def path(self, key):
+        """Base path for a cached warp"""
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """Return the cached warp (MappedExposure) for a key, or None"""
+        path = self.path(key)
+        if not os.path.exists(path + ".json"):
+            return None
+        return pipMapped.MappedExposure(path)
+
+    def put(self, key, exposure, extra=None, badPixelMask=None):
+        """Cache a warp
+
+        @param badPixelMask Mask bits for pixels to ignore in statistics, or None to skip statistics
+        @return Base path of cached warp, and statistics (see lsst.pipette.mappedExposure.PixelStatistics)
+        """
+        path = self.path(key)
+        # The sidecar is written last, so a partially-written warp is never found
+        stats = pipMapped.writeMappedExposure(exposure, path, extra=extra, badPixelMask=badPixelMask)
+        return path, stats
+
+
+class MatchedWarper(object):
+    """Read, PSF-match (if desFwhm > 0) and warp exposures onto a coadd, through a WarpCache if provided
+
+    PSF matching is to a double gaussian model with core FWHM = desFwhm and wings of amplitude 1/10 of core
+    and FWHM = 2.5 * core.  The size of the PSF matching kernel is the same as the size of the kernel found in
+    the calibrated science exposure, since there is no benefit to making it any other size.
+
+    Statistics of each warp (clipped mean variance, coverage and mask plane counts; see
+    lsst.pipette.mappedExposure.PixelStatistics) are measured as it is written to the cache, and kept in the
+    cache's sidecar, so they don't need a separate pass over the pixels.
+    """
+    def __init__(self, desFwhm, coaddWcs, coaddBBox, policy, cache=None, log=None):
+        """Initialisation
+
+        @param desFwhm Desired FWHM (pixels), or 0 for no PSF matching
+        @param coaddWcs WCS of coadd
+        @param coaddBBox Bounding box of coadd
+        @param policy Coadd policy, containing warpPolicy, coaddPolicy and (if desFwhm > 0) psfMatchPolicy
+        @param cache WarpCache, or None
+        @param log Log, or None for the default
+        """
+        if log is None: log = pexLog.getDefaultLog()
+        self.log = pexLog.Log(log, self.__class__.__name__)
+        self.desFwhm = desFwhm
+        self.coaddWcs = coaddWcs
+        self.coaddBBox = coaddBBox
+        self.cache = cache
+        self.badPixelMask = afwImage.MaskU.getPlaneBitMask(_badMaskPlanes(policy))
+
+        if desFwhm > 0:
+            psfMatchPolicy = policy.getPolicy("psfMatchPolicy")
+            psfMatchPolicy = ipDiffIm.modifyForModelPsfMatch(psfMatchPolicy)
+            self._psfMatcher = ipDiffIm.ModelPsfMatch(psfMatchPolicy)
+        else:
+            self.log.log(self.log.INFO, "No PSF matching will be done (desFwhm <= 0)")
+        self._warper = afwMath.Warper.fromPolicy(policy.getPolicy("warpPolicy"))
+        self._kernelDim = afwGeom.Extent2I(0, 0) # use this because the test Extent2I == None is an error
+        self._modelPsf = None
+
+    def cached(self, dataId, butler):
+        """Retrieve a PSF-matched warp from the cache
+
+        @param dataId Data identifier
+        @param butler Data butler for input calexp and psf
+        @return exposure, path, fluxMag0, stats (as for warp); or None if the warp isn't cached
+        """
+        if self.cache is None:
+            return None
+        key = self.cache.key(dataId, butler)
+        cached = self.cache.get(key) if key is not None else None
+        if cached is None:
+            return None
+        self.log.log(self.log.INFO, "Using cached warp %s" % (cached.path,))
+        exposure = cached.getExposure()
+        stats = cached.stats
+        if stats is None:
+            # Cached before statistics were recorded
+            stats = pipMapped.exposureStatistics(exposure, self.badPixelMask)
+        return exposure, cached.path, cached.extra["fluxMag0"], stats
+
+    def warp(self, dataId, butler):
+        """PSF-match and warp an exposure, or retrieve it from the cache
+
+        @param dataId Data identifier
+        @param butler Data butler for input calexp and psf
+        @return
+        - exposure: warped exposure
+        - path: base path of the cached (memory-mappable) warp, or None if not cached
+        - fluxMag0: flux of a zero-magnitude object in the input exposure
+        - stats: dict of statistics of the warp (see lsst.pipette.mappedExposure.PixelStatistics)
+        """
+        cached = self.cached(dataId, butler)
+        if cached is not None:
+            return cached
+        key = self.cache.key(dataId, butler) if self.cache is not None else None
+
+        exposure = butler.get("calexp", dataId)
+        psf = butler.get("psf", dataId)
+        exposure.setPsf(psf)
+        fluxMag0 = exposure.getCalib().getFluxMag0()[0]
+
+        if self.desFwhm > 0:
+            kernelDim = psf.getKernel().getDimensions()
+            if kernelDim != self._kernelDim:
+                self.log.log(self.log.INFO, "Create double Gaussian PSF model with core fwhm %0.1f "
+                             "and size %dx%d" % (self.desFwhm, kernelDim[0], kernelDim[1]))
+                coreSigma = self.desFwhm / FWHMPerSigma
+                self._modelPsf = afwDetection.createPsf("DoubleGaussian", kernelDim[0], kernelDim[1],
+                    coreSigma, coreSigma * 2.5, 0.1)
+                self._kernelDim = kernelDim
+
+            self.log.log(self.log.INFO, "PSF-match exposure")
+            exposure, psfMatchingKernel, kernelCellSet = self._psfMatcher.matchExposure(exposure,
+                                                                                        self._modelPsf)
+        self.log.log(self.log.INFO, "Warp exposure")
+        exposure = self._warper.warpExposure(self.coaddWcs, exposure, maxBBox = self.coaddBBox)
+
+        if key is not None:
+            path, stats = self.cache.put(key, exposure, extra=dict(fluxMag0=fluxMag0, dataId=dataId),
+                                         badPixelMask=self.badPixelMask)
+        else:
+            path = None
+            stats = pipMapped.exposureStatistics(exposure, self.badPixelMask)
+        return exposure, path, fluxMag0, stats
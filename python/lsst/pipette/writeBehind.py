@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import atexit
+import cPickle
+import threading
+import collections
+
+import lsst.daf.persistence as dafPersist
+import lsst.pipette.prefetch as pipPrefetch
+
+"""This module provides writing of outputs on a background thread, so that processing may continue while the
+outputs of previous processing are persisted."""
+
+writerBuffer = dict()                   # Buffer of writers, by memory limit
+_writerPid = [os.getpid()]              # Process that owns the writers in the buffer
+
+def _writers():
+    """Return the buffer of writers for this process
+
+    A forked process inherits the parent's writers but not their threads, so anything queued on them would
+    never be written; the inherited writers are dropped, and the process starts its own as required.
+    """
+    if _writerPid[0] != os.getpid():
+        writerBuffer.clear()
+        _writerPid[0] = os.getpid()
+    return writerBuffer
+
+def getWriter(config):
+    """Return the writer nominated by the configuration (writeBehind.memory), or None to write synchronously
+
+    Writers are started when first requested in each process.
+    """
+    if config is None or not config.has_key('writeBehind') or config['writeBehind']['memory'] <= 0:
+        return None
+    memory = config['writeBehind']['memory'] * 1024 * 1024
+    writers = _writers()
+    if not writers.has_key(memory):
+        writers[memory] = WriteBehind(memory)
+    return writers[memory]
+
+def flush():
+    """Wait for all writers in this process to finish their writes, raising any error"""
+    for writer in _writers().itervalues():
+        writer.flush()
+
+def put(writer, butler, obj, datasetType, dataId):
+    """Put a dataset with the butler, writing it in the background if a writer is provided
+
+    The butler's mapper holds registry connections that may only be used by the thread that opened them, so
+    the dataset is mapped to its location here, on the caller's thread; only the writing of the file is
+    handed to the writer.
+
+    @param writer Writer (from getWriter), or None to put synchronously
+    @param butler Data butler
+    @param obj Object to put; must not be modified afterwards
+    @param datasetType Type of data
+    @param dataId Data identifier for butler
+    """
+    if writer is None:
+        butler.put(obj, datasetType, dataId)
+        return
+    location = butler.mapper.map(datasetType, dataId)
+    writer.submit(persist, (butler, obj, location), size=pipPrefetch.dataSize([obj]))
+
+def persist(butler, obj, location):
+    """Write an object to a location provided by the butler's mapper
+
+    This follows Butler.put without consulting the mapper, so it may be called from any thread.
+
+    @param butler Data butler, providing the persistence
+    @param obj Object to write
+    @param location Location of the dataset (ButlerLocation)
+    """
+    additionalData = location.getAdditionalData()
+    storageName = location.getStorageName()
+    logLoc = dafPersist.LogicalLocation(location.getLocations()[0], additionalData)
+    path = logLoc.locString()
+    outDir = os.path.dirname(path)
+    if outDir and not os.path.isdir(outDir):
+        try:
+            os.makedirs(outDir)
+        except OSError:
+            # Another process may have got there first
+            if not os.path.isdir(outDir):
+                raise
+    if storageName == "PickleStorage":
+        outFile = open(path, "wb")
+        try:
+            cPickle.dump(obj, outFile, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            outFile.close()
+        return
+    storageList = dafPersist.StorageList()
+    storageList.append(butler.persistence.getPersistStorage(storageName, logLoc))
+    if hasattr(obj, '__deref__'):
+        # A smart pointer: persist what it points to
+        obj = obj.__deref__()
+    butler.persistence.persist(obj, storageList, additionalData)
+
+@atexit.register
+def _flushAtExit():
+    """Don't lose writes if the caller forgets to flush"""
+    for writer in _writers().itervalues():
+        try:
+            writer.flush()
+        except Exception, e:
+            print >> sys.stderr, "Error in write-behind: %s" % e
+
+
+class WriteBehind(object):
+    """Writes on a background thread
+
+    Writes are performed in the order submitted.  Submission blocks while the data queued for writing
+    amounts to more than the memory limit (back-pressure), unless nothing is queued.  The first error raised
+    by a write is raised again by the next call to submit or flush, after which writing continues.  Data must
+    not be modified after it has been submitted.
+    """
+    def __init__(self, memory):
+        """Initialisation
+
+        @param memory Maximum size of data queued for writing (bytes)
+        """
+        self.memory = memory
+        self._queue = collections.deque()
+        self._queued = 0                # Size of data queued (or being written)
+        self._pending = 0               # Number of writes queued (or being written)
+        self._error = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="WriteBehind")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        """Write in the background"""
+        while True:
+            self._condition.acquire()
+            try:
+                while len(self._queue) == 0:
+                    self._condition.wait()
+                function, args, size = self._queue.popleft()
+            finally:
+                self._condition.release()
+
+            try:
+                function(*args)
+                error = None
+            except Exception:
+                error = sys.exc_info()
+
+            self._condition.acquire()
+            try:
+                if error is not None and self._error is None:
+                    self._error = error
+                self._queued -= size
+                self._pending -= 1
+                self._condition.notifyAll()
+            finally:
+                self._condition.release()
+
+    def _raise(self):
+        """Raise any error from writing; the condition must be held"""
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error[0], error[1], error[2]
+
+    def submit(self, function, args, size=None):
+        """Submit a write
+
+        @param function Function to perform the write
+        @param args List of arguments for the function
+        @param size Size of the data (bytes), or None to estimate from the arguments
+        """
+        if size is None:
+            size = pipPrefetch.dataSize(list(args))
+        self._condition.acquire()
+        try:
+            self._raise()
+            while self._pending > 0 and self._queued + size > self.memory:
+                self._condition.wait()
+                self._raise()
+            self._queue.append((function, args, size))
+            self._queued += size
+            self._pending += 1
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def flush(self):
+        """Wait for all submitted writes to finish, raising any error"""
+        self._condition.acquire()
+        try:
+            while self._pending > 0:
+                self._condition.wait()
+            self._raise()
+        finally:
+            self._condition.release()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+import lsst.utils.tests as utilsTests
+
+import numpy
+
+import lsst.afw.coord as afwCoord
+import lsst.afw.detection as afwDetection
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
+import lsst.pipette.config as pipConfig
+import lsst.pipette.coaddEngine as pipCoadd
+import lsst.pipette.mappedExposure as pipMapped
+import lsst.pipette.warpCache as pipWarpCache
+
+SIZE = 100                              # Size of coadd
+
+
+class FakeMapper(object):
+    """Mapper providing filenames for the warp cache key"""
+    def __init__(self, root):
+        self.root = root
+
+    def map(self, datasetType, dataId):
+        mapper = self
+        class Location(object):
+            def getLocations(self):
+                return [os.path.join(mapper.root, "%s-%d.fits" % (datasetType, dataId['visit']))]
+        return Location()
+
+
+class FakeButler(object):
+    """Butler providing calexps and PSFs"""
+    def __init__(self, exposures, root):
+        self.exposures = exposures
+        self.mapper = FakeMapper(root)
+        self.calls = 0                  # Number of calexps read
+
+    def get(self, datasetType, dataId):
+        if datasetType == "psf":
+            return afwDetection.createPsf("DoubleGaussian", 15, 15, 1.5)
+        self.calls += 1
+        exposure = self.exposures[dataId['visit']]
+        return exposure.Factory(exposure, True)
+
+
+class CoaddEngineTestCase(unittest.TestCase):
+    """A test case for the coadd accumulators and MatchedWarper"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.policy = pipConfig.configuration("policy/outlierRejectedCoaddDictionary.paf").getPolicy()
+        self.zeroPoint = self.policy.getPolicy("coaddPolicy").get("coaddZeroPoint")
+        crval = afwCoord.Coord(afwGeom.Point2D(10.0, 0.0))
+        crpix = afwGeom.Point2D(SIZE / 2.0, SIZE / 2.0)
+        self.wcs = afwImage.makeWcs(crval, crpix, -0.2 / 3600.0, 0.0, 0.0, 0.2 / 3600.0)
+        self.bbox = afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(SIZE, SIZE))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def makeExposure(self, value, variance=1.0):
+        """Make an exposure on the coadd grid, with constant image and variance, at the coadd zero point"""
+        exposure = afwImage.ExposureF(self.bbox, self.wcs)
+        mi = exposure.getMaskedImage()
+        mi.getImage().getArray()[:] = value
+        mi.getMask().getArray()[:] = 0
+        mi.getVariance().getArray()[:] = variance
+        exposure.getCalib().setFluxMag0(10**(0.4 * self.zeroPoint))
+        return exposure
+
+    def makeInput(self, visit, value, variance=1.0):
+        """Make a CoaddInput, with its memory-mappable copy"""
+        exposure = self.makeExposure(value, variance)
+        path = os.path.join(self.root, "input-%d" % visit)
+        badPixelMask = afwImage.MaskU.getPlaneBitMask(pipWarpCache._badMaskPlanes(self.policy))
+        stats = pipMapped.writeMappedExposure(exposure, path, badPixelMask=badPixelMask)
+        return pipCoadd.CoaddInput({'visit': visit}, exposure, path, 10**(0.4 * self.zeroPoint), stats)
+
+    def coadd(self, name, inputs):
+        """Coadd inputs with the named accumulator"""
+        acc = pipCoadd.accumulatorRegistry[name](self.wcs, self.bbox, self.policy)
+        for coaddInput in inputs:
+            acc.add(coaddInput)
+        return acc, acc.finish()
+
+    def testMean(self):
+        inputs = [self.makeInput(i, value) for i, value in enumerate((1.0, 2.0, 3.0))]
+        acc, products = self.coadd("coadd", inputs)
+        image = products["coadd"].getMaskedImage().getImage().getArray()
+        self.assertTrue(numpy.allclose(image, 2.0), "Mean coadd")
+        self.assertTrue((products["weight"].getArray() > 0).all(), "Weight map")
+
+    def testChiSquared(self):
+        acc, products = self.coadd("chiSquaredCoadd", [self.makeInput(i, 1.0) for i in range(2)])
+        self.assertEqual(products["coadd"].getBBox(afwImage.PARENT), self.bbox, "Coadd bounding box")
+        self.assertEqual(products["weight"].getDimensions(), self.bbox.getDimensions(), "Weight dimensions")
+
+    def testOutlierRejected(self):
+        inputs = [self.makeInput(i, 1.0) for i in range(6)]
+        outlier = self.makeInput(6, 1.0)
+        outlier.exposure.getMaskedImage().getImage().getArray()[40:60, 40:60] = 100.0
+        pipMapped.writeMappedExposure(outlier.exposure, outlier.path)
+        acc, products = self.coadd("outlierRejectedCoadd", inputs + [outlier])
+        image = products["coadd"].getMaskedImage().getImage().getArray()
+        self.assertTrue(numpy.allclose(image, 1.0), "Outlier rejected")
+
+    def testIncremental(self):
+        inputs = [self.makeInput(i, float(i + 1), variance=i + 1.0) for i in range(3)]
+        acc, products = self.coadd("incrementalCoadd", inputs)
+        acc.retract(inputs[2].dataId)
+        self.assertEqual(sorted(dataId['visit'] for dataId in acc.dataIds()), [0, 1], "Manifest")
+        retracted = acc.finish()
+        acc, expected = self.coadd("incrementalCoadd", inputs[:2])
+        for name in ("coadd", "weight"):
+            image = retracted[name] if name == "weight" else retracted[name].getMaskedImage().getImage()
+            other = expected[name] if name == "weight" else expected[name].getMaskedImage().getImage()
+            self.assertTrue(numpy.allclose(image.getArray(), other.getArray()), "Retracted %s" % name)
+
+        state = os.path.join(self.root, "state")
+        acc.save(state)
+        loaded = pipCoadd.IncrementalAccumulator(self.wcs, self.bbox, self.policy)
+        loaded.load(state)
+        self.assertTrue(loaded.contains({'visit': 1}), "Loaded manifest")
+        self.assertTrue(numpy.all(loaded.finish()["coadd"].getMaskedImage().getImage().getArray() ==
+                                  expected["coadd"].getMaskedImage().getImage().getArray()), "Loaded state")
+
+    def testRetractSaved(self):
+        """Inputs are retracted from a saved state without their warps"""
+        inputs = [self.makeInput(i, float(i + 1), variance=i + 1.0) for i in range(3)]
+        state = os.path.join(self.root, "state")
+        acc = pipCoadd.IncrementalAccumulator(self.wcs, self.bbox, self.policy)
+        acc.save(state)
+        for coaddInput in inputs:
+            acc.add(coaddInput)
+        acc.save(state)
+        del acc, inputs
+
+        loaded = pipCoadd.IncrementalAccumulator(self.wcs, self.bbox, self.policy)
+        loaded.load(state)
+        loaded.retract({'visit': 2})
+        loaded.save(state)
+        self.assertEqual(len(os.listdir(os.path.join(state, "contributions"))), 2, "Contribution removed")
+        acc, expected = self.coadd("incrementalCoadd", [self.makeInput(i, float(i + 1), variance=i + 1.0)
+                                                        for i in range(2)])
+        self.assertTrue(numpy.allclose(loaded.finish()["coadd"].getMaskedImage().getImage().getArray(),
+                                       expected["coadd"].getMaskedImage().getImage().getArray()), "Retracted")
+
+    def testMatchedWarper(self):
+        butler = FakeButler({1: self.makeExposure(5.0, variance=4.0)}, self.root)
+        for datasetType in ("calexp", "psf"):
+            open(butler.mapper.map(datasetType, {'visit': 1}).getLocations()[0], "w").close()
+        warper = pipWarpCache.MatchedWarper(0.0, self.wcs, self.bbox, self.policy)
+        exposure, path, fluxMag0, stats = warper.warp({'visit': 1}, butler)
+        self.assertEqual(path, None, "Not cached")
+        self.assertEqual(fluxMag0, 10**(0.4 * self.zeroPoint), "Flux of zero magnitude")
+        self.assertTrue(stats['coverage'] > 0, "Coverage")
+        self.assertTrue(abs(stats['meanVariance'] - 4.0) < 1.0e-3, "Mean variance")
+
+        cacheRoot = os.path.join(self.root, "cache")
+        cache = pipWarpCache.WarpCache(cacheRoot, 0.0, self.wcs, self.bbox, self.policy)
+        warper = pipWarpCache.MatchedWarper(0.0, self.wcs, self.bbox, self.policy, cache=cache)
+        first = warper.warp({'visit': 1}, butler)
+        calls = butler.calls
+        second = warper.warp({'visit': 1}, butler)
+        self.assertEqual(butler.calls, calls, "Cached warp used")
+        self.assertEqual(second[1], first[1], "Cached warp path")
+        self.assertEqual(second[3], first[3], "Cached statistics")
+        self.assertTrue(numpy.all(second[0].getMaskedImage().getImage().getArray() ==
+                                  first[0].getMaskedImage().getImage().getArray()), "Cached warp pixels")
+
+
+def suite():
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(CoaddEngineTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(shouldExit = False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == '__main__':
+    run(True)
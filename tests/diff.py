@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import unittest
+import lsst.utils.tests as utilsTests
+
+import numpy
+
+import lsst.afw.detection as afwDet
+import lsst.afw.image as afwImage
+import lsst.pipette.config as pipConfig
+import lsst.pipette.diff as pipDiff
+
+SIZE = 256                              # Size of test images
+SPACING = 32                            # Spacing of stars
+BACKGROUND = 20.0                       # Background of input relative to template
+NOISE = 1.0                             # Noise sigma
+BORDER = 32                             # Border to ignore, pixels
+
+
+def makeExposure(sigma, background, seed):
+    """Make an exposure with a grid of Gaussian stars
+
+    @param sigma Gaussian sigma of stars
+    @param background Background level
+    @param seed Random number seed for noise
+    """
+    y, x = numpy.indices((SIZE, SIZE), dtype=float)
+    image = numpy.zeros((SIZE, SIZE)) + background
+    for yStar in range(SPACING // 2, SIZE, SPACING):
+        for xStar in range(SPACING // 2, SIZE, SPACING):
+            flux = 1000.0 * (1.0 + ((xStar + yStar) % 5))
+            image += flux / (2.0 * numpy.pi * sigma**2) * \
+                     numpy.exp(-0.5 * ((x - xStar)**2 + (y - yStar)**2) / sigma**2)
+    image += numpy.random.RandomState(seed).normal(0.0, NOISE, image.shape)
+
+    exposure = afwImage.ExposureF(SIZE, SIZE)
+    mi = exposure.getMaskedImage()
+    mi.getImage().getArray()[:] = image
+    mi.getMask().getArray()[:] = 0
+    mi.getVariance().getArray()[:] = NOISE**2
+    return exposure
+
+
+class MatchTestCase(unittest.TestCase):
+    """A test case for PSF matching"""
+
+    def setUp(self):
+        self.template = makeExposure(1.5, 0.0, 1)
+        self.input = makeExposure(2.5, BACKGROUND, 2)
+
+    def tearDown(self):
+        del self.template
+        del self.input
+
+    def makeDiff(self, cacheTemplate):
+        """Return a differencing process, caching template stamps or not"""
+        config = pipConfig.configuration("policy/DiffProcessDictionary.paf", "policy/suprimecam_diff.paf",
+                                         {'do': {'diff': {'cacheTemplate': cacheTemplate}}})
+        return pipDiff.Diff(config=config)
+
+    def residual(self, convolved):
+        """Return the interior of the input minus the convolved template"""
+        inner = slice(BORDER, SIZE - BORDER)
+        return (self.input.getMaskedImage().getImage().getArray()[inner, inner] -
+                convolved.getMaskedImage().getImage().getArray()[inner, inner])
+
+    def testDefault(self):
+        """By default, an identified template is matched with ImagePsfMatch.matchExposures"""
+        diff = self.makeDiff(False)
+        whole = self.residual(diff.match(self.template, self.input))
+        identified = self.residual(diff.match(self.template, self.input, templateId={'test': 1}))
+        self.assertTrue(numpy.all(whole == identified), "Template identifier ignored")
+        self.assertTrue(abs(numpy.median(whole) - BACKGROUND) < 0.5 * NOISE,
+                        "Background not added: median residual %f" % numpy.median(whole))
+
+    def testCachedStamps(self):
+        """Matching with cached template stamps agrees with matchExposures, plus the background"""
+        diff = self.makeDiff(True)
+        whole = self.residual(diff.match(self.template, self.input))
+        for i in range(2):              # First finds and caches the stamps; second uses the cache
+            cached = self.residual(diff.match(self.template, self.input, templateId={'test': 2}))
+            self.assertTrue(abs(numpy.median(cached)) < 0.5 * NOISE,
+                            "Background not included: median residual %f" % numpy.median(cached))
+            difference = whole - cached
+            difference -= numpy.median(difference)
+            self.assertTrue(numpy.sqrt((difference**2).mean()) < 0.1 * NOISE,
+                            "Cached stamps differ from matchExposures: rms %f" %
+                            numpy.sqrt((difference**2).mean()))
+
+
+class FakeButler(object):
+    """Butler holding only a 'diffpsf' dataset; the 'psf' dataset isn't defined for the identifier"""
+    def __init__(self, psf):
+        self.psf = psf
+
+    def datasetExists(self, datasetType, dataId):
+        if datasetType == "psf":
+            raise KeyError("ccd")
+        return datasetType == "diffpsf"
+
+    def get(self, datasetType, dataId):
+        assert datasetType == "diffpsf"
+        return self.psf
+
+
+class InputPsfTestCase(unittest.TestCase):
+    """A test case for reusing the input PSF"""
+
+    def setUp(self):
+        config = pipConfig.configuration("policy/DiffProcessDictionary.paf", "policy/suprimecam_diff.paf",
+                                         {'do': {'diff': {'reusePsf': True}}})
+        self.diff = pipDiff.Diff(config=config)
+        self.exposure = makeExposure(1.5, 0.0, 1)
+        self.attached = afwDet.createPsf("DoubleGaussian", 15, 15, 1.5)
+        self.persisted = afwDet.createPsf("DoubleGaussian", 15, 15, 2.0)
+
+    def tearDown(self):
+        del self.diff
+        del self.exposure
+        del self.attached
+        del self.persisted
+
+    def testPreference(self):
+        butler = FakeButler(self.persisted)
+        inputId = {'visit': 1, 'patch': 2}
+        psf, apcorr = self.diff.inputPsf(self.exposure)
+        self.assertTrue(psf is None, "No PSF available")
+        self.exposure.setPsf(self.attached)
+        psf, apcorr = self.diff.inputPsf(self.exposure)
+        self.assertTrue(psf is not None, "Attached PSF")
+        psf, apcorr = self.diff.inputPsf(self.exposure, butler=butler, inputId=inputId)
+        self.assertTrue(psf is self.persisted, "Persisted PSF preferred to attached")
+        psf, apcorr = self.diff.inputPsf(self.exposure, psf=self.attached, butler=butler, inputId=inputId)
+        self.assertTrue(psf is self.attached, "Provided PSF preferred to persisted")
+
+
+def suite():
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(MatchTestCase)
+    suites += unittest.makeSuite(InputPsfTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(shouldExit = False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == '__main__':
+    run(True)
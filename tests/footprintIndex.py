@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+
+
+import os
+import tempfile
+import unittest
+import lsst.utils.tests as utilsTests
+
+import lsst.pipette.footprintIndex as pipIndex
+
+
+def square(ra, dec, size):
+    """Footprint of a square of side size (degrees) centred on ra, dec (degrees)"""
+    return pipIndex.SkyFootprint([(ra - size / 2.0, dec - size / 2.0), (ra + size / 2.0, dec - size / 2.0),
+                                  (ra + size / 2.0, dec + size / 2.0), (ra - size / 2.0, dec + size / 2.0)])
+
+
+class FootprintIndexTestCase(unittest.TestCase):
+    """A test case for the footprint index"""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        self.index = pipIndex.FootprintIndex(self.path)
+        for ccd in range(10):
+            self.index.add({'visit': 1, 'ccd': ccd}, square(150.0 + 0.2 * ccd, 2.0, 0.19))
+
+    def tearDown(self):
+        del self.index
+        os.unlink(self.path)
+
+    def testOverlaps(self):
+        self.assertTrue(square(10.0, 0.0, 1.0).overlaps(square(10.9, 0.9, 1.0)), "Overlapping squares")
+        self.assertFalse(square(10.0, 0.0, 1.0).overlaps(square(11.1, 0.0, 1.0)), "Separate squares")
+        # Caps overlap, but the squares don't
+        self.assertFalse(square(10.0, 0.0, 1.0).overlaps(square(11.05, 1.05, 1.0)), "Diagonal squares")
+        self.assertTrue(square(359.9, 0.0, 1.0).overlaps(square(0.1, 0.0, 1.0)), "Wrap in RA")
+
+    def testQuery(self):
+        found = self.index.query(square(150.6, 2.0, 0.1))
+        self.assertEqual(found, [{'visit': 1, 'ccd': 3}], "Query single CCD")
+        found = self.index.query(square(150.5, 2.0, 0.3))
+        self.assertEqual(sorted(dataId['ccd'] for dataId in found), [2, 3], "Query two CCDs")
+        self.assertEqual(self.index.query(square(160.0, 2.0, 1.0)), [], "Query elsewhere")
+
+    def testPrune(self):
+        identList = [{'visit': 1, 'ccd': ccd} for ccd in range(10)] + [{'visit': 2, 'ccd': 0}]
+        pruned = self.index.prune(identList, square(150.6, 2.0, 0.1))
+        self.assertEqual(pruned, [{'visit': 1, 'ccd': 3}, {'visit': 2, 'ccd': 0}], "Unindexed CCDs retained")
+
+    def testPersistence(self):
+        del self.index
+        self.index = pipIndex.FootprintIndex(self.path)
+        self.assertTrue({'visit': 1, 'ccd': 5} in self.index, "Index persists")
+        self.assertFalse({'visit': 1, 'ccd': 10} in self.index, "Index contents")
+
+    def testFork(self):
+        parentDb = self.index._db
+        pid = os.fork()
+        if pid == 0:
+            # A forked worker must use its own connection
+            status = 1
+            try:
+                if self.index._db is not parentDb:
+                    self.index.add({'visit': 2, 'ccd': 0}, square(150.0, 2.0, 0.19))
+                    status = 0
+            finally:
+                os._exit(status)
+        pid, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0, "Worker opened its own connection")
+        self.assertTrue(self.index._db is parentDb, "Parent keeps its connection")
+        self.assertTrue({'visit': 2, 'ccd': 0} in self.index, "Worker's addition is visible")
+
+
+def suite():
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(FootprintIndexTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(shouldExit = False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == '__main__':
+    run(True)
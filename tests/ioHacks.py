@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+import lsst.utils.tests as utilsTests
+
+import numpy
+import pyfits
+
+import lsst.afw.detection as afwDet
+import lsst.afw.geom as afwGeom
+import lsst.pipette.ioHacks as pipIoHacks
+
+NUM = 10                                # Number of sources
+
+
+def makeSource(i, offset=0):
+    """Make a source with distinct values for all the outputs"""
+    source = afwDet.Source()
+    source.setId(i + offset)
+    source.setAmpExposureId(i % 4)
+    source.setFlagForDetection(i % 8)
+    source.setRa((10.0 + 0.001 * i + 0.0001 * offset) * afwGeom.degrees)
+    source.setDec((-5.0 - 0.001 * i) * afwGeom.degrees)
+    source.setXAstrom(100.0 + i)
+    source.setXAstromErr(0.01 * i)
+    source.setYAstrom(200.0 + 2 * i)
+    source.setYAstromErr(0.02 * i)
+    source.setIxx(1.0 + i)
+    source.setIxy(0.1 * i)
+    source.setIyy(2.0 + i)
+    source.setPsfFlux(1000.0 * (i + 1) + offset)
+    source.setApFlux(1100.0 * (i + 1))
+    source.setAstrometry(afwDet.MeasurementAstrometry())
+    source.setPhotometry(afwDet.MeasurementPhotometry())
+    source.setShape(afwDet.MeasurementShape())
+    return source
+
+def makeSourceSet(offset=0):
+    sourceSet = afwDet.SourceSet()
+    for i in range(NUM):
+        sourceSet.append(makeSource(i, offset=offset))
+    return sourceSet
+
+def referenceColumns(sourceSet, outputs):
+    """Columns as getFitsColumns made them before the extractors: element by element, column by column"""
+    columns = []
+    for out in outputs:
+        array = numpy.zeros(len(sourceSet), dtype=out["dtype"])
+        for j, source in enumerate(sourceSet):
+            value = getattr(source, out["get"])()
+            if out['angle']:
+                value = value.asDegrees()
+            array[j] = value
+        columns.append(pyfits.Column(name=out["label"], format=out["fitstype"], unit=out['units'],
+                                     array=array))
+    return columns
+
+
+class IoHacksTestCase(unittest.TestCase):
+    """A test case for writing and reading catalogs with pyfits"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.sourceSet = makeSourceSet()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        del self.sourceSet
+
+    def assertColumnsEqual(self, columns, reference):
+        self.assertEqual([col.name for col in columns], [col.name for col in reference], "Column names")
+        for col, ref in zip(columns, reference):
+            self.assertEqual(col.format, ref.format, "Format of %s" % ref.name)
+            self.assertEqual(col.unit, ref.unit, "Unit of %s" % ref.name)
+            self.assertEqual(numpy.asarray(col.array).dtype, numpy.asarray(ref.array).dtype,
+                             "Type of %s" % ref.name)
+            self.assertTrue(numpy.all(numpy.asarray(col.array) == numpy.asarray(ref.array)),
+                            "Values of %s" % ref.name)
+
+    def testFitsColumns(self):
+        """The extractors produce the same columns as before"""
+        for outputs in (pipIoHacks.getSourceOutputListHsc(addRefFlux=True),
+                        pipIoHacks.getSourceOutputListHsc(simple=True)):
+            self.assertColumnsEqual(pipIoHacks.getFitsColumns(self.sourceSet, outputs),
+                                    referenceColumns(self.sourceSet, outputs))
+
+    def testWriteSourceSet(self):
+        """The written table has the same columns as before"""
+        filename = os.path.join(self.dir, "sources.fits")
+        pipIoHacks.writeSourceSetAsFits(self.sourceSet, filename)
+        fits = pyfits.open(filename)
+        try:
+            data = fits[1].data
+            reference = referenceColumns(self.sourceSet, pipIoHacks.getSourceOutputListHsc(addRefFlux=True))
+            self.assertEqual(list(data.names), [col.name for col in reference], "Column names")
+            for ref in reference:
+                self.assertTrue(numpy.all(data.field(ref.name) == ref.array), "Values of %s" % ref.name)
+        finally:
+            fits.close()
+
+    def testRoundTrip(self):
+        """Sources and matches read back as columnar catalogs have the values written"""
+        baseName = os.path.join(self.dir, "catalog")
+        pipIoHacks.writeSourceSetAsFits(self.sourceSet, baseName + ".fits", hdrInfo={'VISIT': 123})
+        refSet = makeSourceSet(offset=1000)
+        matchList = [afwDet.SourceMatch(ref, source, 0.0) for ref, source in zip(refSet, self.sourceSet)]
+        pipIoHacks.writeMatchListAsFits(matchList, baseName + ".match.fits")
+
+        sources, matches, hdrInfo = pipIoHacks.readCatalogsFromFits(baseName, hdrKeys=['VISIT'])
+        try:
+            self.assertEqual(hdrInfo['VISIT'], 123, "Header value")
+            self.assertEqual(len(sources), NUM, "Number of sources")
+            self.assertTrue(numpy.all(sources['f_psf'] == [s.getPsfFlux() for s in self.sourceSet]),
+                            "Source column")
+            for source, original in zip(sources, self.sourceSet):
+                self.assertEqual(source.getId(), original.getId(), "Source id")
+                self.assertAlmostEqual(source.getRa().asDegrees(), original.getRa().asDegrees(), 10)
+                self.assertAlmostEqual(source.getXAstrom(), original.getXAstrom(), 4)
+                self.assertEqual(source.getFlagForDetection(), original.getFlagForDetection(), "Flags")
+
+            self.assertEqual(len(matches), NUM, "Number of matches")
+            for match, original in zip(matches, matchList):
+                # The first of each match is the catalog (reference) side, the second the measured source
+                self.assertEqual(match.first.getId(), original.first.getId(), "Catalog id")
+                self.assertAlmostEqual(match.first.getRa().asDegrees(), original.first.getRa().asDegrees(),
+                                       10)
+                self.assertAlmostEqual(match.first.getPsfFlux(), original.first.getPsfFlux(), 2)
+                self.assertEqual(match.second.getId(), original.second.getId(), "Measured id")
+                self.assertAlmostEqual(match.second.getRa().asDegrees(), original.second.getRa().asDegrees(),
+                                       10)
+                self.assertAlmostEqual(match.second.getYAstrom(), original.second.getYAstrom(), 4)
+        finally:
+            sources.close()
+            matches.close()
+
+        readList = pipIoHacks.readMatchListFits(baseName, outputStyle="hsc")
+        self.assertEqual([m.first.getId() for m in readList], [m.first.getId() for m in matchList],
+                         "readMatchListFits accepts outputStyle")
+        sourceSet, readList, hdrInfo = pipIoHacks.readSourcesetFromFits(baseName)
+        self.assertEqual(len(sourceSet), NUM, "readSourcesetFromFits sources")
+        self.assertEqual([m.second.getId() for m in readList], [m.second.getId() for m in matchList],
+                         "readSourcesetFromFits matches")
+
+
+def suite():
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(IoHacksTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(shouldExit = False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == '__main__':
+    run(True)
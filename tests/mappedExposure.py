@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import unittest
+import lsst.utils.tests as utilsTests
+
+import numpy
+
+import lsst.afw.image as afwImage
+import lsst.afw.math as afwMath
+import lsst.pipette.mappedExposure as pipMapped
+
+
+class PixelStatisticsTestCase(unittest.TestCase):
+    """A test case for the pixel statistics gathered while writing"""
+
+    def setUp(self):
+        width, height = 300, 1000
+        rng = numpy.random.RandomState(1)
+        self.exposure = afwImage.ExposureF(width, height)
+        mi = self.exposure.getMaskedImage()
+        mi.getImage().getArray()[:] = rng.normal(0.0, 10.0, (height, width))
+        variance = rng.normal(100.0, 5.0, (height, width))
+        variance[:, :10] += 50.0        # A column of blocks with a higher variance
+        variance[rng.randint(0, height, 500), rng.randint(0, width, 500)] = 1.0e5 # Outliers
+        mi.getVariance().getArray()[:] = variance
+        mask = mi.getMask()
+        self.badPixelMask = mask.getPlaneBitMask("BAD")
+        maskArray = mask.getArray()
+        maskArray[:] = 0
+        maskArray[500:520, 100:200] = self.badPixelMask
+        maskArray[700:710, :] = mask.getPlaneBitMask("SAT")
+
+    def tearDown(self):
+        del self.exposure
+
+    def testMeanClip(self):
+        """The mean variance agrees with MEANCLIP over the whole image"""
+        stats = pipMapped.exposureStatistics(self.exposure, self.badPixelMask)
+        mi = self.exposure.getMaskedImage()
+        sctrl = afwMath.StatisticsControl()
+        sctrl.setAndMask(self.badPixelMask)
+        sctrl.setNumSigmaClip(3.0)
+        sctrl.setNumIter(2)
+        expected = afwMath.makeStatistics(mi.getVariance(), mi.getMask(), afwMath.MEANCLIP, sctrl).getValue()
+        self.assertTrue(abs(stats['meanVariance'] - expected) < 1.0e-3 * expected,
+                        "Mean variance %f vs MEANCLIP %f" % (stats['meanVariance'], expected))
+
+    def testCounts(self):
+        stats = pipMapped.exposureStatistics(self.exposure, self.badPixelMask)
+        self.assertEqual(stats['coverage'], self.exposure.getWidth() * self.exposure.getHeight() - 20 * 100,
+                         "Coverage")
+        self.assertEqual(stats['maskCounts']['BAD'], 20 * 100, "BAD pixels")
+        self.assertEqual(stats['maskCounts']['SAT'], 10 * self.exposure.getWidth(), "SAT pixels")
+
+    def testEmpty(self):
+        self.exposure.getMaskedImage().getMask().getArray()[:] = self.badPixelMask
+        stats = pipMapped.exposureStatistics(self.exposure, self.badPixelMask)
+        self.assertEqual(stats['coverage'], 0, "No coverage")
+        self.assertTrue(numpy.isnan(stats['meanVariance']), "No mean variance")
+
+
+def suite():
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(PixelStatisticsTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(shouldExit = False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == '__main__':
+    run(True)
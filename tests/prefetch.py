@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+
+
+
+
+import time
+import threading
+import unittest
+import lsst.utils.tests as utilsTests
+
+import lsst.pipette.prefetch as pipPrefetch
+
+
+class Reader(object):
+    """Toy reader, recording how far ahead it has read"""
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.read = list()
+        self.lock = threading.Lock()
+
+    def __call__(self, item):
+        if item == self.fail:
+            raise RuntimeError("Can't read %d" % item)
+        self.lock.acquire()
+        try:
+            self.read.append(item)
+        finally:
+            self.lock.release()
+        return [item] * 10
+
+
+class PrefetchTestCase(unittest.TestCase):
+    """A test case for reading ahead"""
+
+    def testOrder(self):
+        reader = Reader()
+        results = list(pipPrefetch.Prefetcher(reader, range(20), depth=3))
+        self.assertEqual([item for item, data in results], range(20), "Order preserved")
+        self.assertEqual([data for item, data in results], [[i] * 10 for i in range(20)], "Data")
+
+    def testDepth(self):
+        reader = Reader()
+        for item, data in pipPrefetch.Prefetcher(reader, range(10), depth=2):
+            time.sleep(0.05)
+            # Read: this item, up to two in the queue, and one waiting to be queued
+            self.assertTrue(len(reader.read) <= item + 4, "Depth respected")
+
+    def testMemory(self):
+        reader = Reader()
+        size = lambda data: len(data)
+        for item, data in pipPrefetch.Prefetcher(reader, range(10), depth=5, memory=15, size=size):
+            time.sleep(0.05)
+            # Memory allows only one item to be held ahead
+            self.assertTrue(len(reader.read) <= item + 2, "Memory limit respected")
+
+    def testFailure(self):
+        reader = Reader(fail=3)
+        consumed = list()
+        def consume():
+            for item, data in pipPrefetch.Prefetcher(reader, range(10), depth=2):
+                consumed.append(item)
+        self.assertRaises(RuntimeError, consume)
+        self.assertEqual(consumed, range(3), "Items before the failure are processed")
+
+    def testLocate(self):
+        reader = Reader()
+        consumer = threading.current_thread()
+        locating = list()
+        def locate(item):
+            # Locating is done on the consumer's thread, and is kept only 'depth' ahead of processing
+            self.assertTrue(threading.current_thread() is consumer, "Located on consumer thread")
+            locating.append(item)
+            return item * 2
+        def read(location):
+            self.assertFalse(threading.current_thread() is consumer, "Read on background thread")
+            return reader(location)
+        results = list()
+        for item, data in pipPrefetch.Prefetcher(read, range(10), depth=2, locate=locate):
+            self.assertTrue(len(locating) <= item + 3, "Locating limited by depth")
+            results.append((item, data))
+        self.assertEqual(results, [(i, [2 * i] * 10) for i in range(10)], "Read from location")
+
+    def testLocateFailure(self):
+        def locate(item):
+            if item == 2:
+                raise RuntimeError("Can't locate %d" % item)
+            return item
+        consumed = list()
+        def consume():
+            for item, data in pipPrefetch.Prefetcher(Reader(), range(10), depth=2, locate=locate):
+                consumed.append(item)
+        self.assertRaises(RuntimeError, consume)
+        self.assertEqual(consumed, range(2), "Items before the failure are processed")
+
+    def testPerThread(self):
+        made = list()
+        def factory():
+            made.append(threading.current_thread())
+            return object()
+        main = object()
+        resource = pipPrefetch.PerThread(factory, value=main)
+        self.assertTrue(resource.get() is main, "Provided value used on this thread")
+        results = list(pipPrefetch.Prefetcher(lambda item: resource.get(), range(5), depth=2))
+        self.assertEqual(len(made), 1, "Constructed once for the background thread")
+        self.assertFalse(made[0] is threading.current_thread(), "Constructed on the background thread")
+        self.assertTrue(all(data is results[0][1] and data is not main for item, data in results),
+                        "Background thread uses its own")
+
+    def testSynchronous(self):
+        reader = Reader()
+        results = list(pipPrefetch.prefetch(reader, range(5)))
+        self.assertEqual([item for item, data in results], range(5), "No reading ahead")
+
+
+def suite():
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(PrefetchTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(shouldExit = False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == '__main__':
+    run(True)
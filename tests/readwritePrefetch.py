@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+
+
+import os
+import shutil
+import sqlite3
+import cPickle
+import tempfile
+import unittest
+import lsst.utils.tests as utilsTests
+import lsst.daf.persistence as dafPersist
+
+import lsst.pipette.readwrite as pipReadWrite
+import lsst.pipette.prefetch as pipPrefetch
+
+NUM_CCDS = 6
+
+
+class TestMapper(dafPersist.Mapper):
+    """Mapper for pickled 'raw' data, with an SQLite registry
+
+    Like the camera mappers, the registry connection is opened on construction, so it may only be used by the
+    constructing thread.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.registry = sqlite3.connect(os.path.join(root, "registry.sqlite3"))
+
+    def keys(self):
+        return ['visit', 'ccd']
+
+    def query_raw(self, key, format, dataId):
+        where = " AND ".join("%s = ?" % name for name in sorted(dataId.keys()))
+        sql = "SELECT DISTINCT %s FROM raw" % ", ".join(format)
+        if where:
+            sql += " WHERE " + where
+        values = [dataId[name] for name in sorted(dataId.keys())]
+        return [tuple(row) for row in self.registry.execute(sql, values)]
+
+    def map_raw(self, dataId):
+        path = os.path.join(self.root, "raw-%(visit)d-%(ccd)d.pickle" % dataId)
+        return dafPersist.ButlerLocation("__builtin__.dict", None, "PickleStorage", path, dataId)
+
+
+class ReadWritePrefetchTestCase(unittest.TestCase):
+    """A test case for reading ahead with a ReadWrite"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        registry = sqlite3.connect(os.path.join(self.root, "registry.sqlite3"))
+        registry.execute("CREATE TABLE raw (visit INT, ccd INT)")
+        for ccd in range(NUM_CCDS):
+            registry.execute("INSERT INTO raw VALUES (?, ?)", (1, ccd))
+            fd = open(os.path.join(self.root, "raw-1-%d.pickle" % ccd), "wb")
+            cPickle.dump({'visit': 1, 'ccd': ccd}, fd)
+            fd.close()
+        registry.commit()
+        registry.close()
+        self.io = pipReadWrite.ReadWrite(TestMapper(self.root), ['visit', 'ccd'])
+
+    def tearDown(self):
+        del self.io
+        shutil.rmtree(self.root)
+
+    def testOwnReadWrite(self):
+        readers = pipPrefetch.PerThread(lambda: pipReadWrite.ReadWrite(TestMapper(self.root), ['visit', 'ccd']),
+                                        value=self.io)
+        read = lambda ccd: readers.get().readRaw({'visit': 1, 'ccd': ccd})
+        for ccd, raws in pipPrefetch.Prefetcher(read, range(NUM_CCDS), depth=2):
+            # The main I/O object is used on this thread while the reader is using its own
+            self.assertEqual(self.io.lookup({'visit': 1, 'ccd': ccd}), [{'visit': 1, 'ccd': ccd}], "Lookup")
+            self.assertEqual(raws, [{'visit': 1, 'ccd': ccd}], "Read ahead")
+
+    def testSharedReadWrite(self):
+        # Using the main I/O object on the reading thread fails: the registry belongs to this thread
+        read = lambda ccd: self.io.readRaw({'visit': 1, 'ccd': ccd})
+        def consume():
+            for ccd, raws in pipPrefetch.Prefetcher(read, range(NUM_CCDS), depth=2):
+                pass
+        self.assertRaises(sqlite3.ProgrammingError, consume)
+
+
+def suite():
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(ReadWritePrefetchTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(shouldExit = False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == '__main__':
+    run(True)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+
+import unittest
+import lsst.utils.tests as utilsTests
+
+import numpy
+
+import lsst.afw.image as afwImage
+import lsst.afw.detection as afwDet
+import lsst.pipette.config as pipConfig
+import lsst.pipette.repair as pipRepair
+
+
+class CrTilesTestCase(unittest.TestCase):
+    """A test case for the cosmic-ray tiling"""
+
+    def setUp(self):
+        self.width, self.height = 2048, 4177
+        self.overlap = 32
+
+    def testCoresPartition(self):
+        tiles = pipRepair.crTiles(self.width, self.height, 3, 5, self.overlap)
+        self.assertEqual(len(tiles), 15, "Number of tiles")
+        count = dict()
+        for tile, core in tiles:
+            for y in range(core[1], core[3] + 1, 7):
+                for x in range(core[0], core[2] + 1, 7):
+                    count[(x, y)] = count.get((x, y), 0) + 1
+        self.assertTrue(all(n == 1 for n in count.values()), "Cores do not overlap")
+        self.assertEqual(sum(core[2] - core[0] + 1 for tile, core in tiles[:3]), self.width, "Cores span x")
+        self.assertEqual(sum(core[3] - core[1] + 1 for tile, core in tiles[::3]), self.height, "Cores span y")
+
+    def testTilesContainCores(self):
+        for tile, core in pipRepair.crTiles(self.width, self.height, 4, 4, self.overlap):
+            self.assertTrue(tile[0] >= 0 and tile[1] >= 0, "Tile within image")
+            self.assertTrue(tile[2] < self.width and tile[3] < self.height, "Tile within image")
+            for i in (0, 1):
+                self.assertEqual(tile[i], max(0, core[i] - self.overlap), "Tile overlaps core")
+            self.assertEqual(tile[2], min(self.width - 1, core[2] + self.overlap), "Tile overlaps core")
+            self.assertEqual(tile[3], min(self.height - 1, core[3] + self.overlap), "Tile overlaps core")
+
+    def testSingleTile(self):
+        tiles = pipRepair.crTiles(self.width, self.height, 1, 1, self.overlap)
+        box = (0, 0, self.width - 1, self.height - 1)
+        self.assertEqual(tiles, [(box, box)], "Single tile is the whole image")
+
+
+class TiledCosmicRayTestCase(unittest.TestCase):
+    """A test case comparing tiled and whole-image cosmic-ray detection"""
+
+    def setUp(self):
+        size = 512
+        y, x = numpy.indices((size, size), dtype=float)
+        image = numpy.random.RandomState(1).normal(100.0, 5.0, (size, size))
+        for xStar, yStar in ((100, 100), (300, 200), (254, 400), (400, 258)):
+            image += 10000.0 / (2.0 * numpy.pi * 1.5**2) * \
+                     numpy.exp(-0.5 * ((x - xStar)**2 + (y - yStar)**2) / 1.5**2)
+        # Cosmic rays, including some straddling the boundaries between tiles
+        for xCr, yCr in ((50, 60), (200, 300), (255, 100), (256, 256), (400, 255), (480, 470)):
+            image[yCr, xCr - 2:xCr + 3] += 3000.0
+        self.exposure = afwImage.ExposureF(size, size)
+        mi = self.exposure.getMaskedImage()
+        mi.getImage().getArray()[:] = image
+        mi.getMask().getArray()[:] = 0
+        mi.getVariance().getArray()[:] = 25.0
+        self.psf = afwDet.createPsf("DoubleGaussian", 15, 15, 1.5)
+
+    def tearDown(self):
+        del self.exposure
+        del self.psf
+
+    def cosmicray(self, tilesX, tilesY):
+        """Run cosmic-ray detection on a copy of the exposure, with the nominated tiling"""
+        config = pipConfig.configuration("policy/ProcessCcdDictionary.paf",
+                                         {'repair': {'crTilesX': tilesX, 'crTilesY': tilesY,
+                                                     'crProcesses': 2}})
+        exposure = self.exposure.Factory(self.exposure, True)
+        pipRepair.Repair(config=config).cosmicray(exposure, self.psf)
+        return exposure.getMaskedImage()
+
+    def testTiledEqualsWhole(self):
+        whole = self.cosmicray(1, 1)
+        tiled = self.cosmicray(2, 2)
+        crBit = whole.getMask().getPlaneBitMask("CR")
+        wholeCr = (whole.getMask().getArray() & crBit) != 0
+        self.assertTrue(wholeCr.any(), "Cosmic rays found")
+        self.assertTrue((wholeCr == ((tiled.getMask().getArray() & crBit) != 0)).all(), "CR masks agree")
+        self.assertTrue((whole.getMask().getArray() == tiled.getMask().getArray()).all(), "Masks agree")
+        self.assertTrue((whole.getImage().getArray() == tiled.getImage().getArray()).all(), "Images agree")
+        self.assertTrue((whole.getVariance().getArray() == tiled.getVariance().getArray()).all(),
+                        "Variances agree")
+
+
+def suite():
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(CrTilesTestCase)
+    suites += unittest.makeSuite(TiledCosmicRayTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(shouldExit = False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == '__main__':
+    run(True)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+
+
+
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import lsst.utils.tests as utilsTests
+
+import lsst.pipette.stackScheduler as pipScheduler
+
+
+def double(job):
+    """Toy job function: records twice the tile number in the job's output file, failing on tile 0"""
+    if job.tile == 0:
+        raise RuntimeError("No tile zero")
+    fd = open(job.output, "w")
+    try:
+        fd.write("%d\n" % (2 * job.tile))
+    finally:
+        fd.close()
+
+
+class StackSchedulerTestCase(unittest.TestCase):
+    """A test case for the stack scheduler"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.jobList = [pipScheduler.StackJob(tile, "W-S-R+", range(tile + 1), None, 150.0, 2.0, 1000)
+                        for tile in range(4)]
+        for job in self.jobList:
+            job.output = os.path.join(self.dir, "tile%d" % job.tile)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testOrder(self):
+        self.jobList[1].size = 4000
+        ordered = pipScheduler.order(self.jobList)
+        self.assertEqual([job.tile for job in ordered], [1, 3, 2, 0], "Order by cost")
+
+    def testTileSize(self):
+        self.assertEqual(pipScheduler.tileSizeForBudget(4000, 0), 0, "No budget")
+        self.assertEqual(pipScheduler.tileSizeForBudget(4000, 2**40), 0, "Generous budget")
+        self.assertEqual(pipScheduler.tileSizeForBudget(4000, 1), pipScheduler.MIN_TILE_SIZE, "Meagre budget")
+        budget = 512 * 1024 * 1024
+        tileSize = pipScheduler.tileSizeForBudget(5000, budget)
+        self.assertTrue(pipScheduler.MIN_TILE_SIZE < tileSize < 5000, "Tiled")
+        job = pipScheduler.StackJob(0, "W-S-R+", [1], None, 150.0, 2.0, 5000)
+        job.tileSize = tileSize
+        self.assertTrue(job.memory() <= budget, "Within budget")
+
+    def testWarpMemory(self):
+        self.assertEqual(pipScheduler.warpConcurrency({}), (1, 1), "Serial warping")
+        self.assertEqual(pipScheduler.warpConcurrency({'prefetch': {'depth': 2}}), (1, 3), "Reading ahead")
+        config = {'stack': {'warpProcesses': 4}, 'prefetch': {'depth': 2}}
+        self.assertEqual(pipScheduler.warpConcurrency(config), (4, 4), "Parallel warping")
+
+        job = pipScheduler.StackJob(0, "W-S-R+", [1], None, 150.0, 2.0, 5000)
+        serial = job.memory()
+        job.warpProcesses, job.calexps = 4, 4
+        parallel = job.memory()
+        extra = 3 * pipScheduler.CCD_PIXELS * pipScheduler.BYTES_PER_CALEXP_PIXEL + \
+                5000**2 * pipScheduler.BYTES_PER_SHARED_PIXEL
+        self.assertEqual(parallel - serial, extra, "Calexps and shared buffers")
+
+        budget = 1024 * 1024 * 1024
+        job.tileSize = pipScheduler.tileSizeForBudget(5000, budget, calexps=4, warpProcesses=4)
+        self.assertTrue(pipScheduler.MIN_TILE_SIZE < job.tileSize < 5000, "Tiled")
+        self.assertTrue(job.memory() <= budget, "Within budget")
+        self.assertEqual(pipScheduler.tileSizeForBudget(5000, budget), 0, "Serial warping needs no tiling")
+
+    def testOutputCurrent(self):
+        output = os.path.join(self.dir, "output")
+        inputs = [os.path.join(self.dir, "input%d" % i) for i in range(2)]
+        self.assertFalse(pipScheduler.outputCurrent(output, inputs), "Missing output")
+        for path in inputs + [output]:
+            open(path, "w").close()
+        now = time.time()
+        os.utime(output, (now, now))
+        os.utime(inputs[0], (now - 10, now - 10))
+        os.utime(inputs[1], (now - 10, now - 10))
+        self.assertTrue(pipScheduler.outputCurrent(output, inputs), "Output newer than inputs")
+        self.assertTrue(pipScheduler.outputCurrent(output, inputs + [None]), "Unlocated input ignored")
+        os.utime(inputs[1], (now + 10, now + 10))
+        self.assertFalse(pipScheduler.outputCurrent(output, inputs), "Input newer than output")
+
+    def testRunJobs(self):
+        for processes in (1, 2):
+            results = dict((job.tile, error) for job, elapsed, error in
+                           pipScheduler.runJobs(self.jobList, double, processes=processes))
+            self.assertEqual(sorted(results.keys()), range(4), "All jobs run")
+            self.assertTrue(results[0] is not None and results[0].find("No tile zero") >= 0, "Failure reported")
+            for tile in range(1, 4):
+                self.assertTrue(results[tile] is None, "Success")
+                self.assertEqual(open(os.path.join(self.dir, "tile%d" % tile)).read(), "%d\n" % (2 * tile),
+                                 "Job output")
+
+
+def suite():
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(StackSchedulerTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(shouldExit = False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == '__main__':
+    run(True)
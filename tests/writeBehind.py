@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+
+
+
+
+
+import os
+import time
+import shutil
+import cPickle
+import tempfile
+import threading
+import unittest
+import lsst.utils.tests as utilsTests
+
+import lsst.pipette.writeBehind as pipWriteBehind
+
+
+class WriteBehindTestCase(unittest.TestCase):
+    """A test case for writing in the background"""
+
+    def setUp(self):
+        self.writer = pipWriteBehind.WriteBehind(100)
+        self.written = list()
+
+    def tearDown(self):
+        del self.writer
+
+    def write(self, value, delay=0.0):
+        """Toy write function"""
+        time.sleep(delay)
+        if value < 0:
+            raise RuntimeError("Can't write %d" % value)
+        self.written.append(value)
+
+    def testOrder(self):
+        for i in range(20):
+            self.writer.submit(self.write, (i,), size=10)
+        self.writer.flush()
+        self.assertEqual(self.written, range(20), "All written in order")
+
+    def testBackPressure(self):
+        start = time.time()
+        for i in range(3):
+            self.writer.submit(self.write, (i, 0.2), size=60)
+        # Each submission must wait for the previous write, since two don't fit in memory
+        self.assertTrue(time.time() - start >= 0.35, "Submission blocked")
+        self.writer.flush()
+        self.assertEqual(self.written, range(3), "All written")
+
+    def testError(self):
+        self.writer.submit(self.write, (-1,), size=0)
+        self.writer.submit(self.write, (1,), size=0)
+        self.assertRaises(RuntimeError, self.writer.flush)
+        self.assertEqual(self.written, [1], "Writing continues after an error")
+        self.writer.flush()             # Error is only raised once
+
+    def testFork(self):
+        config = {'writeBehind': {'memory': 1}}
+        parent = pipWriteBehind.getWriter(config)
+        self.assertTrue(pipWriteBehind.getWriter(config) is parent, "Writer is reused")
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # The inherited writer has no thread, so the child must start its own
+            try:
+                child = pipWriteBehind.getWriter(config)
+                child.submit(self.write, (1,), size=0)
+                pipWriteBehind.flush()
+                os.write(write, "ok" if child is not parent and self.written == [1] else "bad")
+            finally:
+                os._exit(0)
+        os.close(write)
+        result = os.read(read, 10)
+        os.waitpid(pid, 0)
+        os.close(read)
+        self.assertEqual(result, "ok", "Forked process writes with its own writer")
+        self.assertTrue(pipWriteBehind.getWriter(config) is parent, "Parent keeps its writer")
+
+
+class FakeLocation(object):
+    """Enough of a ButlerLocation for pickling"""
+    def __init__(self, path):
+        self.path = path
+    def getAdditionalData(self):
+        return None
+    def getStorageName(self):
+        return "PickleStorage"
+    def getLocations(self):
+        return [self.path]
+
+class FakeMapper(object):
+    """Maps datasets to pickles, recording the thread doing the mapping"""
+    def __init__(self, root):
+        self.root = root
+        self.threads = list()
+    def map(self, datasetType, dataId):
+        self.threads.append(threading.currentThread())
+        return FakeLocation(os.path.join(self.root, "%d" % dataId['visit'], datasetType + ".pickle"))
+
+class FakeButler(object):
+    def __init__(self, root):
+        self.mapper = FakeMapper(root)
+
+
+class PutTestCase(unittest.TestCase):
+    """A test case for putting datasets in the background"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.butler = FakeButler(self.root)
+        self.writer = pipWriteBehind.WriteBehind(100)
+
+    def tearDown(self):
+        del self.writer
+        shutil.rmtree(self.root)
+
+    def testMapOnCaller(self):
+        """The mapper is only used by the calling thread; the file is written in the background"""
+        pipWriteBehind.put(self.writer, self.butler, range(5), "thing", {'visit': 12})
+        self.writer.flush()
+        self.assertEqual(self.butler.mapper.threads, [threading.currentThread()], "Mapped on caller")
+        path = os.path.join(self.root, "12", "thing.pickle")
+        self.assertEqual(cPickle.load(open(path, "rb")), range(5), "Written")
+
+
+def suite():
+    utilsTests.init()
+
+    suites = []
+    suites += unittest.makeSuite(WriteBehindTestCase)
+    suites += unittest.makeSuite(PutTestCase)
+    suites += unittest.makeSuite(utilsTests.MemoryTestCase)
+    return unittest.TestSuite(suites)
+
+def run(shouldExit = False):
+    utilsTests.run(suite(), shouldExit)
+
+if __name__ == '__main__':
+    run(True)